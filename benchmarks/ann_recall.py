@@ -0,0 +1,109 @@
+"""
+Recall@k vs latency report for the IVF approximate index against exact search.
+
+By default a synthetic clustered corpus is generated (guideline embeddings
+are strongly clustered by topic, uniform random vectors would understate
+recall). A compiled corpus store can be given instead with --store.
+Queries are corpus vectors with added noise, so every query has true
+neighbours in the corpus.
+
+Usage:
+    python benchmarks/ann_recall.py --chunks 200000 --dim 1024
+    python benchmarks/ann_recall.py --store data/dummy_corpora/my_corpus.corpus --n-lists 64
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(current_dir, '..', 'pipelines')))
+
+from retrieval import CorpusIndex, normalize_rows
+from ann_index import IVFIndex
+from corpus_store import load_compiled_corpus
+
+
+def synthetic_clustered_matrix(n_chunks: int, dim: int, n_topics: int = 200, seed: int = 0) -> np.ndarray:
+    """Unit-norm vectors scattered around `n_topics` random topic directions."""
+    rng = np.random.default_rng(seed)
+    topics = normalize_rows(rng.standard_normal((n_topics, dim)))
+    labels = rng.integers(0, n_topics, size=n_chunks)
+    matrix = topics[labels] + 0.6 * rng.standard_normal((n_chunks, dim)).astype(np.float32) / np.sqrt(dim)
+    return normalize_rows(matrix)
+
+
+def make_queries(matrix: np.ndarray, n_queries: int, seed: int = 1) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picks = np.asarray(matrix[rng.choice(matrix.shape[0], size=n_queries, replace=False)])
+    noise = 0.5 * rng.standard_normal(picks.shape).astype(np.float32) / np.sqrt(matrix.shape[1])
+    return normalize_rows(picks + noise)
+
+
+def timed_search(index: CorpusIndex, queries: np.ndarray, top_k: int, exact: bool):
+    """Return (chunk_id sets per query, median latency in ms)."""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = index.search(query, top_k=top_k, exact=exact)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({hit["chunk_id"] for hit in hits})
+    return results, float(np.median(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k vs latency of IVF search against exact search.")
+    parser.add_argument("--store", help="Compiled corpus store to evaluate instead of a synthetic corpus.")
+    parser.add_argument("--chunks", type=int, default=100000, help="Synthetic corpus size.")
+    parser.add_argument("--dim", type=int, default=1024, help="Synthetic embedding dimension.")
+    parser.add_argument("--n-lists", type=int, default=None, help="IVF clusters (default ~4*sqrt(n)).")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--json", help="Optional path to write the report as JSON.")
+    args = parser.parse_args()
+
+    if args.store:
+        index = load_compiled_corpus(args.store, use_ann=False)
+        matrix = index.matrix
+    else:
+        matrix = synthetic_clustered_matrix(args.chunks, args.dim)
+        index = CorpusIndex(matrix, list(range(len(matrix))), ["synthetic"] * len(matrix), [""] * len(matrix))
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(matrix, n_lists=args.n_lists)
+    build_seconds = time.perf_counter() - start
+    queries = make_queries(matrix, min(args.queries, matrix.shape[0]))
+
+    exact_results, exact_ms = timed_search(index, queries, args.top_k, exact=True)
+    report = {
+        "n_chunks": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "n_lists": ivf.n_lists,
+        "top_k": args.top_k,
+        "build_s": build_seconds,
+        "exact_ms": exact_ms,
+        "ivf": [],
+    }
+
+    index.ann = ivf
+    print(f"{report['n_chunks']} chunks x {report['dim']} dims, {ivf.n_lists} lists "
+          f"(built in {build_seconds:.1f}s), exact search {exact_ms:.3f} ms/query")
+    print(f"{'nprobe':>6} {'recall@' + str(args.top_k):>10} {'ms/query':>10} {'speedup':>8}")
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        ivf_results, ivf_ms = timed_search(index, queries, args.top_k, exact=False)
+        recall = float(np.mean([len(a & e) / len(e) for a, e in zip(ivf_results, exact_results)]))
+        report["ivf"].append({"nprobe": nprobe, "recall": recall, "ms": ivf_ms})
+        print(f"{nprobe:>6} {recall:>10.3f} {ivf_ms:>10.3f} {exact_ms / ivf_ms:>7.1f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
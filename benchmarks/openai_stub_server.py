@@ -0,0 +1,449 @@
+"""
+Local OpenAI-compatible stand-in server for offline load and latency testing.
+
+Implements the endpoints used by prompts/chatgpt.py:
+- POST /v1/chat/completions
+- POST /v1/threads, POST /v1/threads/runs (create and run, optionally streamed)
+- POST /v1/threads/{thread_id}/runs (optionally streamed)
+- GET  /v1/threads/{thread_id}/runs/{run_id}, POST .../cancel
+- GET  /v1/threads/{thread_id}/messages
+- GET  /stub/stats (request and error counters of the stand-in itself)
+
+Model latency and Assistant run durations are drawn from configurable
+distributions, and 429 / 500 responses and failed runs can be injected at a
+given rate. Responses echo the prompt or return canned text.
+
+Point the pipelines at it with:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python pipelines/batch_runner.py ...
+
+Usage:
+    python benchmarks/openai_stub_server.py --port 8765 --latency lognormal:0.8,0.4 --rate-429 0.05
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+
+# ------------------------------------------------------------------
+# Configuration
+# ------------------------------------------------------------------
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution in seconds.
+
+    Accepted forms: "0.5" or "fixed:0.5", "uniform:LOW,HIGH",
+    "normal:MEAN,STD" (clipped at 0) and "lognormal:MEDIAN,SIGMA".
+    """
+    kind, _, params = spec.partition(":")
+    if not params:
+        kind, params = "fixed", kind
+    values = [float(value) for value in params.split(",")]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: values[0]
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal" and len(values) == 2:
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: values[0] * rng.lognormvariate(0.0, values[1])
+    raise ValueError(f"Invalid latency distribution: {spec}")
+
+
+class StubConfig:
+    """Behaviour of the stand-in server."""
+
+    def __init__(
+        self,
+        latency: str = "0",
+        run_duration: str = "1",
+        rate_429: float = 0.0,
+        rate_500: float = 0.0,
+        run_failure_rate: float = 0.0,
+        retry_after: Optional[float] = None,
+        response: str = "echo",
+        seed: Optional[int] = None
+    ):
+        self.latency = parse_latency(latency)
+        self.run_duration = parse_latency(run_duration)
+        self.rate_429 = rate_429
+        self.rate_500 = rate_500
+        self.run_failure_rate = run_failure_rate
+        self.retry_after = retry_after
+        self.response = response
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def draw(self, func):
+        with self._rng_lock:
+            return func(self._rng)
+
+    def response_text(self, prompt: str) -> str:
+        if self.response == "echo":
+            return f"Das Board empfiehlt (echo): {prompt[:200]}"
+        return self.response
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token) for the usage fields."""
+    return max(1, len(text) // 4)
+
+
+# ------------------------------------------------------------------
+# Server state
+# ------------------------------------------------------------------
+class StubState:
+    """Threads, runs and counters shared by all request handlers."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.threads = {}  # thread_id -> list of message dicts (oldest first)
+        self.runs = {}     # run_id -> run dict
+        self.counters = {"requests": 0, "chat_completions": 0, "runs": 0, "injected_429": 0,
+                         "injected_500": 0, "failed_runs": 0, "cancelled_runs": 0}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}_stub{next(self.ids)}"
+
+    def create_thread(self, messages=()) -> str:
+        thread_id = self.new_id("thread")
+        with self.lock:
+            self.threads[thread_id] = []
+        for message in messages:
+            self.add_message(thread_id, message["role"], message["content"])
+        return thread_id
+
+    def add_message(self, thread_id: str, role: str, content: str, run_id: Optional[str] = None) -> dict:
+        message = {
+            "id": self.new_id("msg"),
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "run_id": run_id,
+            "assistant_id": None,
+            "role": role,
+            "status": "completed",
+            "attachments": [],
+            "metadata": {},
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+        }
+        with self.lock:
+            self.threads[thread_id].append(message)
+        return message
+
+    def create_run(self, thread_id: str, assistant_id: str) -> dict:
+        config = self.config
+        run = {
+            "id": self.new_id("run"),
+            "thread_id": thread_id,
+            "assistant_id": assistant_id,
+            "started": time.monotonic(),
+            "duration": config.draw(config.run_duration),
+            "outcome": "failed" if config.draw(lambda rng: rng.random()) < config.run_failure_rate else "completed",
+            "status": "queued",
+        }
+        with self.lock:
+            self.runs[run["id"]] = run
+        self.count("runs")
+        return run
+
+    def advance(self, run: dict) -> str:
+        """Move a run to its final status once its duration has elapsed."""
+        with self.lock:
+            if run["status"] not in ("queued", "in_progress"):
+                return run["status"]
+            if time.monotonic() - run["started"] < run["duration"]:
+                run["status"] = "in_progress"
+                return run["status"]
+            run["status"] = run["outcome"]
+        if run["outcome"] == "completed":
+            prompt = self.threads[run["thread_id"]][-1]["content"][0]["text"]["value"]
+            run["message"] = self.add_message(
+                run["thread_id"], "assistant", self.config.response_text(prompt), run_id=run["id"]
+            )
+        else:
+            self.count("failed_runs")
+        return run["status"]
+
+    def cancel(self, run: dict) -> None:
+        with self.lock:
+            if run["status"] in ("queued", "in_progress"):
+                run["status"] = "cancelled"
+                self.counters["cancelled_runs"] += 1
+
+    def run_object(self, run: dict) -> dict:
+        status = run["status"]
+        return {
+            "id": run["id"],
+            "object": "thread.run",
+            "created_at": int(time.time()),
+            "thread_id": run["thread_id"],
+            "assistant_id": run["assistant_id"],
+            "status": status,
+            "model": "stub",
+            "instructions": "",
+            "tools": [],
+            "parallel_tool_calls": False,
+            "last_error": {"code": "server_error", "message": "Injected run failure."} if status == "failed" else None,
+            "incomplete_details": None,
+            "required_action": None,
+            "usage": None,
+        }
+
+
+# ------------------------------------------------------------------
+# Request handler
+# ------------------------------------------------------------------
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    # --- helpers ---
+    def _send_json(self, payload: dict, status: int = 200, headers: Optional[dict] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str, headers: Optional[dict] = None) -> None:
+        self._send_json({"error": {"message": message, "type": "stub_error", "code": None}}, status, headers)
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _inject_error(self) -> bool:
+        """Answer with an injected 429 or 500 at the configured rates."""
+        config = self.state.config
+        draw = config.draw(lambda rng: rng.random())
+        if draw < config.rate_429:
+            self.state.count("injected_429")
+            headers = {"retry-after": str(config.retry_after)} if config.retry_after is not None else None
+            self._send_error(429, "Injected rate limit.", headers)
+            return True
+        if draw < config.rate_429 + config.rate_500:
+            self.state.count("injected_500")
+            self._send_error(500, "Injected server error.")
+            return True
+        return False
+
+    def _get_run(self, thread_id: str, run_id: str) -> Optional[dict]:
+        run = self.state.runs.get(run_id)
+        if run is None or run["thread_id"] != thread_id:
+            self._send_error(404, f"No run found with id '{run_id}'.")
+            return None
+        return run
+
+    # --- routing ---
+    def do_GET(self):
+        self.state.count("requests")
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/stub/stats":
+            with self.state.lock:
+                return self._send_json(dict(self.state.counters))
+        if self._inject_error():
+            return
+        match = re.fullmatch(r"/v1/threads/([^/]+)/runs/([^/]+)", path)
+        if match:
+            run = self._get_run(*match.groups())
+            if run is not None:
+                self.state.advance(run)
+                self._send_json(self.state.run_object(run))
+            return
+        match = re.fullmatch(r"/v1/threads/([^/]+)/messages", path)
+        if match:
+            return self._list_messages(match.group(1))
+        self._send_error(404, f"Unknown endpoint GET {path}")
+
+    def do_POST(self):
+        self.state.count("requests")
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._read_body()
+        if self._inject_error():
+            return
+        if path == "/v1/chat/completions":
+            return self._chat_completion(body)
+        if path == "/v1/threads":
+            thread_id = self.state.create_thread(body.get("messages", []))
+            return self._send_json({"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}})
+        if path == "/v1/threads/runs":
+            thread_id = self.state.create_thread(body.get("thread", {}).get("messages", []))
+            return self._start_run(thread_id, body, thread_created=True)
+        match = re.fullmatch(r"/v1/threads/([^/]+)/runs", path)
+        if match:
+            if match.group(1) not in self.state.threads:
+                return self._send_error(404, f"No thread found with id '{match.group(1)}'.")
+            return self._start_run(match.group(1), body)
+        match = re.fullmatch(r"/v1/threads/([^/]+)/runs/([^/]+)/cancel", path)
+        if match:
+            run = self._get_run(*match.groups())
+            if run is not None:
+                self.state.cancel(run)
+                self._send_json(self.state.run_object(run))
+            return
+        self._send_error(404, f"Unknown endpoint POST {path}")
+
+    # --- endpoints ---
+    def _chat_completion(self, body: dict) -> None:
+        config = self.state.config
+        time.sleep(config.draw(config.latency))
+        prompt = body["messages"][-1]["content"]
+        text = config.response_text(prompt)
+        self.state.count("chat_completions")
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in body["messages"])
+        completion_tokens = estimate_tokens(text)
+        self._send_json({
+            "id": self.state.new_id("chatcmpl"),
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _list_messages(self, thread_id: str) -> None:
+        if thread_id not in self.state.threads:
+            return self._send_error(404, f"No thread found with id '{thread_id}'.")
+        query = dict(part.split("=", 1) for part in self.path.partition("?")[2].split("&") if "=" in part)
+        messages = list(self.state.threads[thread_id])
+        if query.get("order", "desc") == "desc":
+            messages.reverse()
+        messages = messages[:int(query.get("limit", 20))]
+        self._send_json({
+            "object": "list",
+            "data": messages,
+            "first_id": messages[0]["id"] if messages else None,
+            "last_id": messages[-1]["id"] if messages else None,
+            "has_more": False,
+        })
+
+    def _start_run(self, thread_id: str, body: dict, thread_created: bool = False) -> None:
+        run = self.state.create_run(thread_id, body.get("assistant_id", ""))
+        if not body.get("stream"):
+            return self._send_json(self.state.run_object(run))
+
+        # Server-sent events until the run stops
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def send_event(event: str, data) -> None:
+            payload = data if isinstance(data, str) else json.dumps(data)
+            self.wfile.write(f"event: {event}\ndata: {payload}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            if thread_created:
+                send_event("thread.created", {"id": thread_id, "object": "thread",
+                                              "created_at": int(time.time()), "metadata": {}})
+            send_event("thread.run.created", self.state.run_object(run))
+            send_event("thread.run.queued", self.state.run_object(run))
+            if self.state.advance(run) == "in_progress":
+                send_event("thread.run.in_progress", self.state.run_object(run))
+            while self.state.advance(run) == "in_progress":
+                remaining = run["duration"] - (time.monotonic() - run["started"])
+                time.sleep(max(0.0, min(remaining, 0.05)))
+            if run["status"] == "completed":
+                send_event("thread.message.created", run["message"])
+                send_event("thread.message.completed", run["message"])
+            send_event(f"thread.run.{run['status']}", self.state.run_object(run))
+            send_event("done", "[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+# ------------------------------------------------------------------
+# Server
+# ------------------------------------------------------------------
+def make_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Create the server (port 0 picks a free port, see `server.server_port`)."""
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_background(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the server in a daemon thread; use its base URL as OPENAI_BASE_URL."""
+    server = make_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+# ------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="0",
+                        help="Chat completion latency in seconds, e.g. 0.5, uniform:0.2,1.5, lognormal:0.8,0.4.")
+    parser.add_argument("--run-duration", default="1", help="Assistant run duration in seconds (same forms).")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="Fraction of requests answered with 500.")
+    parser.add_argument("--run-failure-rate", type=float, default=0.0, help="Fraction of Assistant runs that fail.")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After header sent with 429s.")
+    parser.add_argument("--response", default="echo", help='"echo" to echo the prompt, or a canned response text.')
+    parser.add_argument("--response-file", help="Read the canned response text from a file.")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for latencies and injected errors.")
+    args = parser.parse_args()
+
+    response = args.response
+    if args.response_file:
+        with open(args.response_file, "r", encoding="utf-8") as f:
+            response = f.read().strip()
+
+    config = StubConfig(
+        latency=args.latency,
+        run_duration=args.run_duration,
+        rate_429=args.rate_429,
+        rate_500=args.rate_500,
+        run_failure_rate=args.run_failure_rate,
+        retry_after=args.retry_after,
+        response=response,
+        seed=args.seed
+    )
+    server = make_server(config, args.host, args.port)
+    print(f"OpenAI stand-in listening on {base_url(server)} (Ctrl+C to stop)")
+    print(f"Use: OPENAI_BASE_URL={base_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
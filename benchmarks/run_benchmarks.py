@@ -0,0 +1,380 @@
+"""
+Benchmark suite for corpus loading, retrieval, prompt assembly and the
+end-to-end RAG pipeline on synthetic guideline corpora of increasing size.
+
+For every corpus size a synthetic corpus is generated in the schema of
+`data/dummy_corpora/dummy_guidelines_with_embeddings.json` (JSON up to
+`--json-max-chunks`, larger corpora only as compiled stores) and measured:
+- load: parsing the JSON file vs opening the compiled store (time, RSS growth),
+- retrieve: `retrieve_top_k_chunks` latency (median/p95) over all chunks and
+  over the selected corpora, and peak memory allocated by one call, once
+  dense only and once fused with BM25 ("rrf") on the case text,
+- prompt: `get_prompt_for_configuration` time for the retrieved chunks,
+- end_to_end: the steps of framework_3_RAG.py (load, embed, filter, retrieve,
+  prompt, model call) with a mocked embedder and LLM, with fusion off and on.
+
+The `framework_3_RAG.py` script itself is also run once on the dummy corpus
+with scripted answers, a mocked embedder and a mocked LLM.
+
+Results are written as JSON together with the git commit, so runs can be
+compared across commits. Generated corpora are kept in `--workdir` and
+reused by later runs with the same size, dimension and seed.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 100 1000 10000 100000 --output bench.json
+    python benchmarks/run_benchmarks.py --sizes 1000000 --dim 1024 --workdir /data/bench
+"""
+
+import os
+import sys
+import json
+import time
+import runpy
+import hashlib
+import argparse
+import platform
+import builtins
+import tempfile
+import tracemalloc
+import contextlib
+import subprocess
+import numpy as np
+from typing import Dict, List
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.abspath(os.path.join(current_dir, '..'))
+sys.path.append(os.path.join(repo_dir, 'pipelines'))
+sys.path.append(os.path.join(repo_dir, 'prompts'))
+
+import embeddings
+import chatgpt
+from retrieval import CorpusIndex, normalize_rows
+from corpus_store import write_compiled_corpus, load_compiled_corpus, MANIFEST_FILE
+from prompt_templates import CONTEXT_TOKEN_BUDGET, get_prompt_for_configuration
+from framework_3_RAG import TOP_K, load_guideline_corpora, retrieve_top_k_chunks
+
+CASE_PATH = os.path.join(repo_dir, 'data', 'dummy_patients', 'example_case_de.txt')
+FRAMEWORK_3_PATH = os.path.join(repo_dir, 'pipelines', 'framework_3_RAG.py')
+
+# Synthetic chunks are generated and written in blocks of this many rows
+GENERATE_BLOCK_ROWS = 50000
+
+WORDS = (
+    "patients with locally advanced adenocarcinoma should receive neoadjuvant chemotherapy "
+    "followed by surgical resection staging includes endoscopy biopsy computed tomography "
+    "of chest and abdomen endoscopic ultrasound may be used to assess tumor depth and "
+    "regional lymph node involvement perioperative FLOT is recommended in fit patients "
+    "definitive chemoradiotherapy is an option for squamous cell carcinoma follow-up "
+    "includes clinical examination every three to six months HER2 MSI-high PD-L1 cT3 cN1 M0"
+).split()
+
+
+# ------------------------------------------------------------------
+# Mocks
+# ------------------------------------------------------------------
+def make_mock_embedder(dim: int):
+    """Deterministic stand-in for `embed_text`: a random vector seeded by the text hash."""
+    def mock_embed_text(text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return np.random.default_rng(seed).standard_normal(dim).astype(np.float32).tolist()
+    return mock_embed_text
+
+
+def make_mock_llm(latency: float):
+    """Stand-in for `chatgpt_chat_completion` that sleeps `latency` seconds."""
+    def mock_chat_completion(prompt_text: str, model: str) -> str:
+        time.sleep(latency)
+        return "Das Board empfiehlt (mock)."
+    return mock_chat_completion
+
+
+@contextlib.contextmanager
+def mocked_models(dim: int, llm_latency: float):
+    """Replace the embedder and the chat completion while the block runs."""
+    saved = embeddings.embed_text, chatgpt.chatgpt_chat_completion
+    embeddings.embed_text = make_mock_embedder(dim)
+    chatgpt.chatgpt_chat_completion = make_mock_llm(llm_latency)
+    try:
+        yield
+    finally:
+        embeddings.embed_text, chatgpt.chatgpt_chat_completion = saved
+
+
+# ------------------------------------------------------------------
+# Synthetic corpora
+# ------------------------------------------------------------------
+def synthetic_blocks(n_chunks: int, dim: int, seed: int = 0, n_topics: int = 200):
+    """
+    Yield (chunk dicts without embeddings, embedding block) of a synthetic
+    corpus. Embeddings are clustered around topic directions like real
+    guideline embeddings; texts are 40-80 words from a clinical vocabulary.
+    """
+    rng = np.random.default_rng(seed)
+    topics = normalize_rows(rng.standard_normal((n_topics, dim)))
+    sources = [f"Synthetic {organ} Cancer Guidelines ({source})"
+               for organ in ("Esophageal", "Gastric", "Hepatic", "Pancreatic", "Colorectal")
+               for source in ("S3", "NCCN")]
+    for start in range(0, n_chunks, GENERATE_BLOCK_ROWS):
+        size = min(GENERATE_BLOCK_ROWS, n_chunks - start)
+        labels = rng.integers(0, n_topics, size=size)
+        block = topics[labels] + 0.6 * rng.standard_normal((size, dim)).astype(np.float32) / np.sqrt(dim)
+        lengths = rng.integers(40, 80, size=size)
+        word_ids = rng.integers(0, len(WORDS), size=int(lengths.sum()))
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        selected = rng.random(size) < 0.4
+        chunks = [
+            {
+                "chunk_id": start + i,
+                "source": sources[labels[i] % len(sources)],
+                "selected_corpora": int(selected[i]),
+                "text": " ".join(WORDS[w] for w in word_ids[offsets[i]:offsets[i + 1]]) + ".",
+            }
+            for i in range(size)
+        ]
+        yield chunks, block.astype(np.float32)
+
+
+def write_synthetic_json(path: str, n_chunks: int, dim: int, seed: int) -> None:
+    """Write a synthetic corpus JSON file block by block (same schema as the dummy corpus)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        first = True
+        for chunks, block in synthetic_blocks(n_chunks, dim, seed):
+            for chunk, vector in zip(chunks, block.tolist()):
+                chunk["embedding"] = vector
+                f.write(("" if first else ",\n") + json.dumps(chunk, ensure_ascii=False))
+                first = False
+        f.write("\n]\n")
+    os.replace(tmp_path, path)
+
+
+def write_synthetic_store(store_dir: str, n_chunks: int, dim: int, seed: int) -> None:
+    """Write a synthetic corpus directly as a compiled store (no JSON round trip)."""
+    matrix_path = store_dir + ".matrix.npy"
+    matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32, shape=(n_chunks, dim))
+    corpora = []
+    for chunks, block in synthetic_blocks(n_chunks, dim, seed):
+        matrix[len(corpora):len(corpora) + len(chunks)] = block
+        corpora.extend(chunks)
+    write_compiled_corpus(corpora, store_dir, matrix=matrix)
+    del matrix
+    os.remove(matrix_path)
+
+
+def prepare_corpus(workdir: str, n_chunks: int, dim: int, seed: int, with_json: bool) -> Dict[str, str]:
+    """Generate (or reuse) the JSON file and compiled store of one corpus size."""
+    name = f"synthetic_{n_chunks}_{dim}d_seed{seed}"
+    paths = {"json": os.path.join(workdir, name + ".json") if with_json else None,
+             "store": os.path.join(workdir, name + ".corpus")}
+    if with_json and not os.path.exists(paths["json"]):
+        write_synthetic_json(paths["json"], n_chunks, dim, seed)
+    if not os.path.exists(os.path.join(paths["store"], MANIFEST_FILE)):
+        if with_json:
+            with open(paths["json"], "r", encoding="utf-8") as f:
+                write_compiled_corpus(json.load(f), paths["store"])
+        else:
+            write_synthetic_store(paths["store"], n_chunks, dim, seed)
+    return paths
+
+
+# ------------------------------------------------------------------
+# Measurements
+# ------------------------------------------------------------------
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, else peak RSS)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    values = np.asarray(seconds) * 1000
+    return {"median_ms": float(np.median(values)), "p95_ms": float(np.percentile(values, 95)),
+            "min_ms": float(values.min())}
+
+
+def measure_load(loader) -> Dict:
+    rss_before = current_rss_mb()
+    start = time.perf_counter()
+    index = loader()
+    # Touch every row once so memory-mapped stores are measured with the data paged in
+    index.score(np.ones(index.dim, dtype=np.float32))
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "rss_growth_mb": current_rss_mb() - rss_before}, index
+
+
+def measure_retrieve(index: CorpusIndex, queries: np.ndarray, case_text: str, rows=None,
+                     fusion: str = "none") -> Dict:
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        retrieve_top_k_chunks(query, index, top_k=TOP_K, exact=True, rows=rows,
+                              query_text=case_text, fusion=fusion)
+        latencies.append(time.perf_counter() - start)
+    tracemalloc.start()
+    retrieve_top_k_chunks(queries[0], index, top_k=TOP_K, exact=True, rows=rows,
+                          query_text=case_text, fusion=fusion)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {**summarize(latencies), "peak_alloc_mb": peak / 2 ** 20}
+
+
+def measure_prompt(case_text: str, retrieved_chunks: List[Dict], repeat: int) -> Dict:
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        get_prompt_for_configuration(case_text, "rag_full", retrieved_chunks=retrieved_chunks,
+                                     context_token_budget=CONTEXT_TOKEN_BUDGET)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def measure_end_to_end(store_dir: str, case_text: str, dim: int, llm_latency: float,
+                       fusion: str = "none") -> Dict:
+    """The steps of framework_3_RAG.py with a mocked embedder and LLM, timed per stage."""
+    stages = {}
+    embed, llm = make_mock_embedder(dim), make_mock_llm(llm_latency)
+    total = time.perf_counter()
+
+    start = time.perf_counter()
+    index = load_compiled_corpus(store_dir)
+    stages["load_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    query_embedding = np.asarray(embed(case_text), dtype=np.float32)
+    stages["embed_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rows = index.filter_rows(selected_only=True)
+    retrieved_chunks = retrieve_top_k_chunks(query_embedding, index, top_k=TOP_K, rows=rows,
+                                             query_text=case_text, fusion=fusion)
+    stages["retrieve_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    prompt = get_prompt_for_configuration(case_text, "rag_selected", retrieved_chunks=retrieved_chunks,
+                                          context_token_budget=CONTEXT_TOKEN_BUDGET)
+    stages["prompt_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    llm(prompt, "gpt-4o-mini")
+    stages["llm_s"] = time.perf_counter() - start
+
+    stages["total_s"] = time.perf_counter() - total
+    stages["overhead_s"] = stages["total_s"] - stages["llm_s"]
+    return stages
+
+
+def measure_framework_3_script(llm_latency: float) -> Dict:
+    """
+    Run framework_3_RAG.py on the dummy corpus with scripted answers
+    (gpt-4o-mini, original case, dummy corpus, all chunks).
+    """
+    dummy_corpus = os.path.join(repo_dir, 'data', 'dummy_corpora', 'dummy_guidelines_with_embeddings.json')
+    dim = len(load_guideline_corpora([dummy_corpus])[0]["embedding"])
+    answers = iter(["1", "n", "n", "n"])
+    saved_input = builtins.input
+    builtins.input = lambda prompt="": next(answers)
+    try:
+        with mocked_models(dim, llm_latency), contextlib.redirect_stdout(open(os.devnull, "w")):
+            start = time.perf_counter()
+            runpy.run_path(FRAMEWORK_3_PATH, run_name="__main__")
+            elapsed = time.perf_counter() - start
+    finally:
+        builtins.input = saved_input
+    return {"seconds": elapsed, "overhead_s": elapsed - llm_latency}
+
+
+def git_commit() -> Dict:
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=repo_dir, capture_output=True, text=True).stdout.strip()
+    return {"commit": git("rev-parse", "HEAD") or None, "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+# ------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark corpus loading, retrieval, prompts and the RAG pipeline.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="Synthetic corpus sizes in chunks (up to 1000000).")
+    parser.add_argument("--dim", type=int, default=1024, help="Embedding dimension (bge-m3: 1024).")
+    parser.add_argument("--json-max-chunks", type=int, default=10000,
+                        help="Largest corpus also generated and loaded as JSON.")
+    parser.add_argument("--queries", type=int, default=20, help="Queries per retrieval measurement.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds slept by the mocked LLM.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Directory for generated corpora (default: a temp dir).")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file.")
+    args = parser.parse_args()
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "gi_rag_benchmarks")
+    os.makedirs(workdir, exist_ok=True)
+    with open(CASE_PATH, "r", encoding="utf-8") as f:
+        case_text = f.read().strip()
+    queries = normalize_rows(np.random.default_rng(args.seed + 1).standard_normal((args.queries, args.dim)))
+
+    results = []
+    for n_chunks in sorted(args.sizes):
+        with_json = n_chunks <= args.json_max_chunks
+        start = time.perf_counter()
+        paths = prepare_corpus(workdir, n_chunks, args.dim, args.seed, with_json)
+        print(f"\n=== {n_chunks} chunks x {args.dim} (prepared in {time.perf_counter() - start:.1f}s) ===")
+
+        result = {"chunks": n_chunks, "dim": args.dim, "load": {}}
+        if with_json:
+            result["load"]["json"], _ = measure_load(
+                lambda: CorpusIndex.from_chunks(load_guideline_corpora([paths["json"]])))
+        result["load"]["compiled"], index = measure_load(lambda: load_compiled_corpus(paths["store"]))
+        for name, load in result["load"].items():
+            print(f"load {name:<16}: {load['seconds'] * 1000:10.1f} ms | RSS {load['rss_growth_mb']:+.0f} MB")
+
+        selected_rows = index.filter_rows(selected_only=True)
+        result["retrieve"] = {}
+        for fusion in ("none", "rrf"):
+            suffix = "" if fusion == "none" else f"_{fusion}"
+            result["retrieve"]["all" + suffix] = measure_retrieve(index, queries, case_text, fusion=fusion)
+            result["retrieve"]["selected" + suffix] = measure_retrieve(index, queries, case_text,
+                                                                       rows=selected_rows, fusion=fusion)
+        for name, stats in result["retrieve"].items():
+            print(f"retrieve {name:<12}: median {stats['median_ms']:8.2f} ms | p95 {stats['p95_ms']:8.2f} ms | "
+                  f"peak alloc {stats['peak_alloc_mb']:.1f} MB")
+
+        retrieved_chunks = retrieve_top_k_chunks(queries[0], index, top_k=TOP_K, exact=True)
+        result["prompt"] = measure_prompt(case_text, retrieved_chunks, repeat=args.queries)
+        print(f"prompt assembly      : median {result['prompt']['median_ms']:8.3f} ms")
+
+        result["end_to_end"] = {
+            fusion: measure_end_to_end(paths["store"], case_text, args.dim, args.llm_latency, fusion=fusion)
+            for fusion in ("none", "rrf")
+        }
+        for fusion, stages in result["end_to_end"].items():
+            print(f"end-to-end {fusion:<10}: {stages['total_s'] * 1000:10.1f} ms "
+                  f"(overhead {stages['overhead_s'] * 1000:.1f} ms, retrieve {stages['retrieve_s'] * 1000:.1f} ms)")
+        results.append(result)
+        del index
+
+    framework_3 = measure_framework_3_script(args.llm_latency)
+    print(f"\nframework_3_RAG.py (dummy corpus, mocked models): {framework_3['seconds'] * 1000:.1f} ms")
+
+    report = {
+        **git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": vars(args),
+        "results": results,
+        "framework_3_script": framework_3,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measure cold-start cost of each framework script.
+
+For every framework, a fresh Python process imports the modules the script
+depends on and then builds each heavy resource it needs on first use
+(embedding model, OpenAI client). Import time and first-call time are
+reported separately, so regressions in import-time side effects are visible.
+
+The interactive framework scripts themselves are not executed (they prompt
+for input); their imports are measured instead. Building the OpenAI client
+does not contact the API.
+
+Usage:
+    python benchmarks/startup_time.py [--repeat 3] [--json results.json]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.abspath(os.path.join(current_dir, '..'))
+
+SEARCH_PATH = [
+    os.path.join(repo_dir, 'pipelines'),
+    os.path.join(repo_dir, 'prompts'),
+    os.path.join(repo_dir, 'data', 'dummy_corpora'),
+]
+
+# Modules imported by each framework script and resources built on its first call
+FRAMEWORKS = {
+    "framework_1_simple_request": {
+        "imports": ["prompt_templates", "chatgpt", "rewrite"],
+        "resources": ["openai_client"],
+    },
+    "framework_2_chatgpt_assistant": {
+        "imports": ["prompt_templates", "chatgpt", "rewrite"],
+        "resources": ["openai_client"],
+    },
+    "framework_3_RAG": {
+        "imports": ["framework_3_RAG"],
+        "resources": ["embed_model", "openai_client"],
+    },
+}
+
+# Runs in a fresh interpreter so every measurement is a cold start
+CHILD_SCRIPT = """
+import sys, json, time, importlib
+sys.path[:0] = {search_path!r}
+start = time.perf_counter()
+for module in {imports!r}:
+    importlib.import_module(module)
+import_seconds = time.perf_counter() - start
+
+import resources
+first_call = {{}}
+for name in {resources!r}:
+    start = time.perf_counter()
+    resources.get(name)
+    first_call[name] = time.perf_counter() - start
+print(json.dumps({{"import": import_seconds, "first_call": first_call}}))
+"""
+
+
+def measure_framework(imports, resource_names):
+    """Run one cold start in a subprocess and return its timings."""
+    code = CHILD_SCRIPT.format(search_path=SEARCH_PATH, imports=imports, resources=resource_names)
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=repo_dir, capture_output=True, text=True, check=True
+    )
+    # The last stdout line holds the JSON; earlier lines are module prints
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and first-call cost of the framework scripts.")
+    parser.add_argument("--repeat", type=int, default=3, help="Cold starts per framework (median is reported).")
+    parser.add_argument("--json", help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = {}
+    for framework, spec in FRAMEWORKS.items():
+        runs = [measure_framework(spec["imports"], spec["resources"]) for _ in range(args.repeat)]
+        results[framework] = {
+            "import_s": statistics.median(run["import"] for run in runs),
+            "first_call_s": {
+                name: statistics.median(run["first_call"][name] for run in runs)
+                for name in spec["resources"]
+            },
+        }
+
+    print(f"{'framework':<32} {'import [s]':>10}   first call [s]")
+    for framework, timing in results.items():
+        first_calls = ", ".join(f"{name}={seconds:.3f}" for name, seconds in timing["first_call_s"].items())
+        print(f"{framework:<32} {timing['import_s']:>10.3f}   {first_calls}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved results to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,24 @@
 # processing/embedding.py
 import json
 import os
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import Settings, Document
+import sys
+import time
+import hashlib
+import argparse
+import multiprocessing
+
+# Add the 'pipelines' folder to sys.path for the shared embedding model and corpus store
+current_dir = os.path.dirname(os.path.abspath(__file__))
+pipelines_dir = os.path.abspath(os.path.join(current_dir, '..', 'pipelines'))
+sys.path.append(pipelines_dir)
+
+from corpus_store import DTYPES, MANIFEST_FILE, compiled_path_for, write_compiled_corpus
 
 # -------------------------------
-# 1. Load embedding model
+# 1. Embedding model (model name/version from config/hyperparameters.yaml,
+#    loaded lazily on the first embedding call)
 # -------------------------------
-embed_model = Settings.embed_model = HuggingFaceEmbedding(
-    model_name="BAAI/bge-m3"
-)
-print("Embedding model loaded!")
+from embeddings import EMBEDDING_CONFIG, get_embed_model
 
 # -------------------------------
 # 2. Load corpora JSON
@@ -22,11 +30,101 @@ def load_corpora(file_path: str):
 # -------------------------------
 # 3. Embed corpora text
 # -------------------------------
-def embed_corpora(corpora):
+def chunk_hash(text: str, embedding_config: dict = EMBEDDING_CONFIG) -> str:
+    """Content hash of a chunk text together with the embedding model name and version."""
+    key = f"{embedding_config['model']}\0{embedding_config['version']}\0{text}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def load_stored_embeddings(output_path: str) -> dict:
+    """
+    Map `embedding_hash` -> embedding for the chunks of a previous run.
+    Returns an empty dict if there is no previous output.
+    """
+    if not os.path.exists(output_path):
+        return {}
+    stored = {}
+    for chunk in load_corpora(output_path):
+        if "embedding_hash" in chunk and "embedding" in chunk:
+            stored[chunk["embedding_hash"]] = chunk["embedding"]
+    return stored
+
+def length_sorted_batches(texts, batch_size: int):
+    """
+    Split text indices into batches of similar length, so the tokenizer pads
+    each batch only to the length of its own longest text.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+def _init_embedding_worker(torch_threads: int, batch_size: int):
+    """Give each worker process an equal share of the CPU cores."""
+    import torch
+    torch.set_num_threads(torch_threads)
+    get_embed_model().embed_batch_size = batch_size
+
+def _embed_batch(batch_texts):
+    return get_embed_model().get_text_embedding_batch(batch_texts)
+
+def embed_texts(texts, batch_size: int = 32, workers: int = 1):
+    """
+    Embed `texts` in length-sorted batches and return the vectors in input order.
+
+    With `workers` > 1 the batches are spread over a pool of processes, each
+    holding its own copy of the embedding model. Throughput is reported in
+    chunks/second.
+    """
+    if not texts:
+        return []
+    if workers <= 1:
+        # Load the model before timing so throughput reflects embedding only
+        get_embed_model().embed_batch_size = batch_size
+    start = time.perf_counter()
+    batches = length_sorted_batches(texts, batch_size)
+    batch_texts = [[texts[i] for i in batch] for batch in batches]
+
+    if workers > 1:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(workers, initializer=_init_embedding_worker, initargs=(torch_threads, batch_size)) as pool:
+            batch_vectors = pool.map(_embed_batch, batch_texts, chunksize=1)
+    else:
+        batch_vectors = [_embed_batch(batch) for batch in batch_texts]
+
+    embeddings = [None] * len(texts)
+    for batch, vectors in zip(batches, batch_vectors):
+        for i, vector in zip(batch, vectors):
+            embeddings[i] = vector
+
+    elapsed = time.perf_counter() - start
+    print(f"Embedded {len(texts)} chunk(s) in {elapsed:.1f}s "
+          f"({len(texts) / elapsed:.1f} chunks/s, batch size {batch_size}, {workers} worker(s)).")
+    return embeddings
+
+def embed_corpora(corpora, stored_embeddings=None, batch_size: int = 32, workers: int = 1):
+    """
+    Embed every chunk, reusing vectors from `stored_embeddings` for chunks whose
+    text and embedding model are unchanged. Vectors of chunks that no longer
+    exist are dropped because only the given chunks are written back.
+    """
+    stored_embeddings = stored_embeddings or {}
+    to_embed = []
+    used_hashes = set()
     for chunk in corpora:
-        text = chunk["text"]
-        embedding = embed_model.get_text_embedding(text)
-        chunk["embedding"] = embedding
+        text_hash = chunk_hash(chunk["text"])
+        if text_hash in stored_embeddings:
+            chunk["embedding"] = stored_embeddings[text_hash]
+        else:
+            to_embed.append(chunk)
+        chunk["embedding_hash"] = text_hash
+        used_hashes.add(text_hash)
+
+    vectors = embed_texts([chunk["text"] for chunk in to_embed], batch_size=batch_size, workers=workers)
+    for chunk, vector in zip(to_embed, vectors):
+        chunk["embedding"] = vector
+
+    dropped = len(set(stored_embeddings) - used_hashes)
+    print(f"Embedded {len(to_embed)} chunk(s), reused {len(corpora) - len(to_embed)}, "
+          f"dropped {dropped} stale vector(s).")
     return corpora
 
 # -------------------------------
@@ -37,11 +135,37 @@ def save_corpora(corpora, output_path):
         json.dump(corpora, f, ensure_ascii=False, indent=2)
     print(f"Saved embeddings to {output_path}")
 
+# -------------------------------
+# 4b. Compile binary store
+# -------------------------------
+def compile_corpora(corpora, output_path, dtype: str = "float32"):
+    """
+    Write the memory-mapped store read by framework_3_RAG.py next to the JSON,
+    with the embedding matrix stored as `dtype` (float32, float16 or int8).
+    """
+    store_dir = write_compiled_corpus(corpora, compiled_path_for(output_path), dtype=dtype)
+    print(f"Compiled corpus store to {store_dir} ({dtype})")
+    if dtype != "float32":
+        with open(os.path.join(store_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            # No recall check is written for an empty corpus
+            recall = json.load(f).get("recall")
+        if recall is not None:
+            print(f"{dtype} recall@{recall['k']} against float32: {recall['recall_at_k']:.3f}")
+
 # -------------------------------
 # 5. Main
 # -------------------------------
 if __name__ == "__main__":
-    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Embed guideline corpora chunks.")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every chunk instead of reusing unchanged vectors from the previous output.")
+    parser.add_argument("--batch-size", type=int, default=EMBEDDING_CONFIG.get("batch_size", 32),
+                        help="Number of chunks per embedding batch.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of embedding processes (each loads its own model).")
+    parser.add_argument("--dtype", choices=DTYPES, default="float32",
+                        help="Storage type of the compiled embedding matrix (float16/int8 are checked for recall@k).")
+    args = parser.parse_args()
 
     INPUT_FILE = os.path.abspath(
         os.path.join(current_dir, '..', 'data', 'dummy_corpora', 'dummy_guidelines.json')
@@ -52,5 +176,9 @@ if __name__ == "__main__":
     )
 
     corpora = load_corpora(INPUT_FILE)
-    corpora_with_embeddings = embed_corpora(corpora)
+    stored_embeddings = {} if args.full else load_stored_embeddings(OUTPUT_FILE)
+    corpora_with_embeddings = embed_corpora(
+        corpora, stored_embeddings, batch_size=args.batch_size, workers=args.workers
+    )
     save_corpora(corpora_with_embeddings, OUTPUT_FILE)
+    compile_corpora(corpora_with_embeddings, OUTPUT_FILE, dtype=args.dtype)
@@ -1,8 +1,6 @@
 import os
 import sys
-import json
-import pymupdf
-import pymupdf4llm
+import argparse
 
 
 # Add the dummy_corpora folder to sys.path so we can import the dummy dictionary
@@ -11,53 +9,61 @@ dummy_corpora_dir = os.path.abspath(os.path.join(current_dir, '..', 'data', 'dum
 sys.path.append(dummy_corpora_dir)
 
 from guideline_dictionary_dummy import guidelines_nccn_dict
+from pdf_extraction import extract_pages, open_page_cache, nccn_pages, page_count
+from ingestion import remove_illegal_characters, write_json_records
 
 # Output folder for JSON files
 output_folder = os.path.abspath(os.path.join('..', 'data', 'dummy_corpora'))
 os.makedirs(output_folder, exist_ok=True)
 
-def remove_illegal_characters(text):
-    """Keep only printable characters plus newline, carriage return, and tab."""
-    return ''.join(c for c in text if c.isprintable() or c in "\n\r\t")
-
-# Loop through NCCN dummy guidelines
-for guideline_name, info in guidelines_nccn_dict.items():
-    print(f"Processing NCCN guideline: {guideline_name}")
-
-    pdf_path = os.path.abspath(os.path.join(current_dir, '..', 'data', 'dummy_corpora', info['path']))
-    source_name = f"Synthetic {guideline_name} NCCN-like Guideline (Dummy)"
-
-    # Load PDF as markdown docs
-    reader = pymupdf4llm.LlamaMarkdownReader()
-    try:
-        docs = reader.load_data(pdf_path)
-    except (FileNotFoundError, pymupdf.FileNotFoundError):
-        print(f"\nERROR: PDF file not found: {pdf_path}")
-        print("Please check that you inserted the correct path and filename in 'guideline_dictionary_dummy.py'.")
-        print("Make sure the PDF exists in the folder 'data/dummy_corpora/guidelines'.\n")
-        sys.exit(1)
-
-    # Filter pages according to starting_page / final_page and skip images
-    filtered_docs = [doc for i, doc in enumerate(docs)
-                     if (i + 1) >= info['starting_page']
-                     and (i + 1) <= info['final_page']
-                     and (i + 1) not in info['images_to_save']]
-
-    # Convert to JSON dicts
-    json_data = []
-    chunk_id_base = 500  # Start numbering for NCCN differently
-    for i, doc in enumerate(filtered_docs):
-        json_data.append({
+def pdf_not_found(pdf_path):
+    print(f"\nERROR: PDF file not found: {pdf_path}")
+    print("Please check that you inserted the correct path and filename in 'guideline_dictionary_dummy.py'.")
+    print("Make sure the PDF exists in the folder 'data/dummy_corpora/guidelines'.\n")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract NCCN guideline PDFs into JSON chunks (one per page).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes for the PDF to markdown conversion (default: number of CPUs).")
+    parser.add_argument("--no-page-cache", action="store_true",
+                        help="Convert every page without reading or filling the page cache.")
+    args = parser.parse_args()
+
+    # Select the pages of every configured guideline (placeholders without a PDF are skipped)
+    jobs = {}
+    for guideline_name, info in guidelines_nccn_dict.items():
+        if not info.get('path'):
+            print(f"Skipping NCCN guideline without a PDF: {guideline_name}")
+            continue
+        pdf_path = os.path.abspath(os.path.join(current_dir, '..', 'data', 'dummy_corpora', info['path']))
+        try:
+            # Only starting_page..final_page, without the images_to_save pages
+            jobs[guideline_name] = (pdf_path, nccn_pages(info, page_count(pdf_path)))
+        except FileNotFoundError:
+            pdf_not_found(pdf_path)
+
+    # Convert the selected pages of all guidelines in parallel
+    page_cache = None if args.no_page_cache else open_page_cache()
+    pages_markdown = extract_pages(jobs, workers=args.workers, cache=page_cache)
+
+    # Loop through NCCN dummy guidelines
+    for guideline_name in jobs:
+        print(f"Processing NCCN guideline: {guideline_name}")
+        source_name = f"Synthetic {guideline_name} NCCN-like Guideline (Dummy)"
+
+        # Stream JSON dicts (one per page)
+        chunk_id_base = 500  # Start numbering for NCCN differently
+        json_data = ({
             "chunk_id": chunk_id_base + i + 1,
             "source": source_name,
             "selected_corpora": 0,  # default 0
-            "text": remove_illegal_characters(doc.text)
-        })
+            "text": remove_illegal_characters(page_text)
+        } for i, page_text in enumerate(pages_markdown[guideline_name]))
 
-    # Save JSON
-    json_filename = f"dummy_NCCN_guidelines_{guideline_name.replace('-', '_')}.json"
-    json_path = os.path.join(output_folder, json_filename)
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(json_data, f, ensure_ascii=False, indent=2)
+        # Save JSON
+        json_filename = f"dummy_NCCN_guidelines_{guideline_name.replace('-', '_')}.json"
+        json_path = os.path.join(output_folder, json_filename)
+        n_chunks = write_json_records(json_path, json_data)
 
-    print(f"Saved {len(json_data)} chunks to {json_path}\n")
+        print(f"Saved {n_chunks} chunks to {json_path}\n")
@@ -0,0 +1,107 @@
+"""
+Streaming ingestion stage shared by the S3 and NCCN extractors.
+
+Page markdown flows through generators, so the extractors never hold the
+joined guideline text, its lines or the full chunk list in memory:
+
+1. `remove_illegal_characters`: normalization with a memoized `str.translate`
+   table instead of a per-character Python filter.
+2. `heading_chunks` / `final_heading_chunks`: chunk by heading page by page,
+   with the same chunks as the former `chunk_by_heading` +
+   `split_last_chunk` over the joined text.
+3. `write_json_records`: write chunk records one at a time, byte-identical to
+   `json.dump(records, f, ensure_ascii=False, indent=2)`.
+"""
+
+import os
+import json
+import collections
+from typing import Dict, Iterable, Iterator
+
+
+# -------------------------------
+# 1. Normalization
+# -------------------------------
+class _IllegalCharacterTable(dict):
+    """`str.translate` table deleting non-printable characters except newline, carriage return and tab."""
+
+    def __missing__(self, codepoint: int):
+        char = chr(codepoint)
+        value = codepoint if char.isprintable() or char in "\n\r\t" else None
+        self[codepoint] = value
+        return value
+
+ILLEGAL_CHARACTER_TABLE = _IllegalCharacterTable()
+
+def remove_illegal_characters(text: str) -> str:
+    """Keep only printable characters plus newline, carriage return, and tab."""
+    return text.translate(ILLEGAL_CHARACTER_TABLE)
+
+
+# -------------------------------
+# 2. Chunking by heading
+# -------------------------------
+def _page_lines(page_texts: Iterable[str]) -> Iterator[str]:
+    """Lines of `"\\n".join(page_texts)`, produced one page at a time."""
+    previous = None
+    for text in page_texts:
+        if previous is not None:
+            # A page followed by another one ends with the joining newline
+            yield from (previous + "\n").splitlines()
+        previous = text
+    if previous is not None:
+        yield from previous.splitlines()
+
+def heading_chunks(page_texts: Iterable[str], heading_marker: str = "### ") -> Iterator[str]:
+    """Yield chunks starting at each line that begins with `heading_marker`."""
+    current_chunk = []
+    for line in _page_lines(page_texts):
+        if line.startswith(heading_marker) and current_chunk:
+            yield "\n".join(current_chunk)
+            current_chunk = []
+        current_chunk.append(line)
+    if current_chunk:
+        yield "\n".join(current_chunk)
+
+def final_heading_chunks(page_texts: Iterable[str], heading_marker: str, final_heading: str) -> Iterator[str]:
+    """
+    Heading chunks without the trailing sections.
+
+    The last chunk is split at `final_heading` and the last resulting piece is
+    dropped (e.g. everything from the table of tables on). Two chunks are held
+    back, because the dropped piece can be the second to last chunk.
+    """
+    pending = collections.deque()
+    for chunk in heading_chunks(page_texts, heading_marker):
+        pending.append(chunk)
+        if len(pending) > 2:
+            yield pending.popleft()
+    if not pending:
+        return
+    last_chunk = pending.pop()
+    tail = list(pending) + [c.strip() for c in last_chunk.split(final_heading) if c.strip()]
+    yield from tail[:-1]
+
+
+# -------------------------------
+# 3. Incremental JSON output
+# -------------------------------
+def write_json_records(path: str, records: Iterable[Dict]) -> int:
+    """
+    Write `records` as a JSON array, one record at a time.
+
+    The file is written atomically (to a temporary file renamed at the end).
+
+    Returns:
+        Number of records written.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write("[\n  " if count == 0 else ",\n  ")
+            f.write(json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+            count += 1
+        f.write("\n]" if count else "[]")
+    os.replace(tmp_path, path)
+    return count
@@ -0,0 +1,169 @@
+"""
+Parallel, page-range-aware PDF to markdown conversion for the guideline extractors.
+
+The extractors used to convert every page of a guideline PDF with
+`pymupdf4llm.LlamaMarkdownReader.load_data` and discard the unused pages
+afterwards. This module converts only the pages a guideline actually keeps
+and spreads them over a process pool:
+
+1. Header detection (`IdentifyHeaders`) runs once per PDF over all pages,
+   one PDF per worker, exactly as `LlamaMarkdownReader` does, so headings
+   get the same `#` levels as before.
+2. The needed pages of all PDFs are converted one page per call to
+   `to_markdown(doc, pages=[page], hdr_info=...)` (again as the reader does),
+   in small batches spread over the workers. Each worker keeps its open
+   documents, so a PDF is opened once per worker.
+
+Converted pages are kept in a page cache (`pdf_page_cache.py`,
+`.cache/pdf_pages.sqlite`) keyed by PDF content hash, page and converter
+version, so only pages that were never converted reach the pool.
+
+Throughput is reported in pages/second.
+"""
+
+import os
+import time
+import multiprocessing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pymupdf
+import pymupdf4llm
+from pymupdf4llm.helpers.pymupdf_rag import IdentifyHeaders, to_markdown
+
+from pdf_page_cache import PageCache, file_sha256
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Pages converted per worker task (small enough to balance uneven pages)
+PAGES_PER_TASK = 4
+
+PAGE_CACHE_PATH = os.environ.get(
+    "PDF_PAGE_CACHE_PATH",
+    os.path.abspath(os.path.join(current_dir, '..', '.cache', 'pdf_pages.sqlite'))
+)
+CONVERTER_VERSION = f"pymupdf4llm {pymupdf4llm.__version__}, pymupdf {pymupdf.__version__}"
+
+def open_page_cache(path: str = PAGE_CACHE_PATH) -> PageCache:
+    """Page cache for the installed pymupdf4llm/PyMuPDF version."""
+    return PageCache(path, CONVERTER_VERSION)
+
+
+# -------------------------------
+# 1. Page selection
+# -------------------------------
+def page_count(pdf_path: str) -> int:
+    """Number of pages of a PDF (raises FileNotFoundError if it does not exist)."""
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(pdf_path)
+    with pymupdf.open(pdf_path) as doc:
+        return doc.page_count
+
+def s3_pages(info: dict, n_pages: int) -> List[int]:
+    """1-based pages kept by the S3 extractor: everything from `starting_page` on."""
+    return list(range(info['starting_page'], n_pages + 1))
+
+def nccn_pages(info: dict, n_pages: int) -> List[int]:
+    """1-based pages kept by the NCCN extractor: `starting_page`..`final_page` without `images_to_save`."""
+    skipped = set(info['images_to_save'])
+    return [page for page in range(info['starting_page'], min(info['final_page'], n_pages) + 1)
+            if page not in skipped]
+
+
+# -------------------------------
+# 2. Worker functions
+# -------------------------------
+_open_docs: Dict[str, pymupdf.Document] = {}
+
+def _document(pdf_path: str) -> pymupdf.Document:
+    if pdf_path not in _open_docs:
+        _open_docs[pdf_path] = pymupdf.open(pdf_path)
+    return _open_docs[pdf_path]
+
+def _header_info(pdf_path: str) -> Tuple[str, IdentifyHeaders]:
+    return pdf_path, IdentifyHeaders(pdf_path)
+
+def _convert_pages(task) -> Tuple[str, List[Tuple[int, str]]]:
+    """Convert the 1-based `pages` of one PDF to markdown, one page at a time."""
+    pdf_path, pages, hdr_info = task
+    doc = _document(pdf_path)
+    return pdf_path, [(page, to_markdown(doc, pages=[page - 1], hdr_info=hdr_info)) for page in pages]
+
+
+# -------------------------------
+# 3. Extraction
+# -------------------------------
+def extract_pages(
+    jobs: Dict[str, Tuple[str, List[int]]],
+    workers: int = None,
+    pages_per_task: int = PAGES_PER_TASK,
+    cache: Optional[PageCache] = None
+) -> Dict[str, Iterable[str]]:
+    """
+    Convert the selected pages of several PDFs to markdown.
+
+    Args:
+        jobs: mapping of a job name (e.g. the guideline) to its PDF path and
+            the 1-based pages to convert. Pages shared by several jobs are
+            converted once.
+        workers: number of worker processes (default: number of CPUs; 1 runs
+            in this process).
+        pages_per_task: pages converted per worker task.
+        cache: page cache to skip cached pages and store converted ones in
+            (None converts every page).
+
+    Returns:
+        Mapping of job name to the markdown text of its pages, in the order
+        of the selection. With a cache the pages are not held in memory but
+        read from the cache one at a time while iterating.
+    """
+    workers = workers or os.cpu_count() or 1
+    needed = {}
+    for pdf_path, pages in jobs.values():
+        needed.setdefault(pdf_path, set()).update(pages)
+    needed = {path: sorted(pages) for path, pages in needed.items() if pages}
+    start = time.perf_counter()
+
+    # Cached pages are not converted again
+    pdf_hashes = {}
+    cached_pages = 0
+    if cache is not None:
+        for path, pages in list(needed.items()):
+            pdf_hashes[path] = file_sha256(path)
+            needed[path] = cache.missing_pages(pdf_hashes[path], pages)
+            cached_pages += len(pages) - len(needed[path])
+        needed = {path: pages for path, pages in needed.items() if pages}
+    total_pages = sum(len(pages) for pages in needed.values())
+
+    def page_tasks(header_infos):
+        return [(path, pages[i:i + pages_per_task], header_infos[path])
+                for path, pages in needed.items()
+                for i in range(0, len(pages), pages_per_task)]
+
+    converted = {}
+    def collect(results):
+        # Pages are cached as they arrive, so an interrupted run keeps its progress
+        for pdf_path, pages in results:
+            if cache is not None:
+                cache.put_pages(pdf_hashes[pdf_path], dict(pages))
+            else:
+                converted.update(((pdf_path, page), text) for page, text in pages)
+
+    if workers > 1 and total_pages > pages_per_task:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(min(workers, total_pages)) as pool:
+            header_infos = dict(pool.map(_header_info, needed, chunksize=1))
+            collect(pool.imap_unordered(_convert_pages, page_tasks(header_infos), chunksize=1))
+    else:
+        header_infos = dict(_header_info(path) for path in needed)
+        collect(map(_convert_pages, page_tasks(header_infos)))
+        for path in needed:
+            _open_docs.pop(path).close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Converted {total_pages} page(s) of {len(needed)} PDF(s) in {elapsed:.1f}s "
+          f"({total_pages / max(elapsed, 1e-9):.1f} pages/s, {workers} worker(s), {CONVERTER_VERSION}); "
+          f"{cached_pages} page(s) from the page cache.")
+
+    if cache is not None:
+        return {name: cache.iter_pages(pdf_hashes.get(pdf_path), pages) for name, (pdf_path, pages) in jobs.items()}
+    return {name: [converted[(pdf_path, page)] for page in pages] for name, (pdf_path, pages) in jobs.items()}
@@ -0,0 +1,107 @@
+"""
+Persistent cache of per-page PDF markdown.
+
+Converted pages are stored in SQLite keyed by the SHA-256 of the PDF file,
+the 1-based page number and the converter version (pymupdf4llm and PyMuPDF),
+so re-running an extractor after changing `starting_page`, `mark`,
+`final_cleaned_chunk` or `images_to_save` only re-chunks cached text.
+Replacing a PDF or upgrading pymupdf4llm invalidates its pages.
+
+Delete `.cache/pdf_pages.sqlite` to reclaim the space of old PDFs and versions.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Iterable, Iterator, List
+
+HASH_BLOCK_BYTES = 1 << 20
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 of a file's content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PageCache:
+    """
+    SQLite-backed cache of page markdown for one converter version.
+
+    Attributes:
+        hits: number of pages answered from the cache
+        misses: number of pages that had to be converted
+    """
+
+    def __init__(self, path: str, converter_version: str):
+        self.path = path
+        self.converter_version = converter_version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " pdf_sha256 TEXT NOT NULL,"
+            " page INTEGER NOT NULL,"
+            " converter_version TEXT NOT NULL,"
+            " markdown TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " PRIMARY KEY (pdf_sha256, page, converter_version))"
+        )
+        self._conn.commit()
+
+    def missing_pages(self, pdf_sha256: str, pages: Iterable[int]) -> List[int]:
+        """Return the pages of `pages` that are not cached yet."""
+        pages = list(pages)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page FROM pages WHERE pdf_sha256 = ? AND converter_version = ?",
+                (pdf_sha256, self.converter_version)
+            ).fetchall()
+        cached = {row[0] for row in rows}
+        missing = [page for page in pages if page not in cached]
+        self.hits += len(pages) - len(missing)
+        self.misses += len(missing)
+        return missing
+
+    def iter_pages(self, pdf_sha256: str, pages: Iterable[int]) -> Iterator[str]:
+        """
+        Yield the cached markdown of `pages` one page at a time.
+
+        Raises:
+            KeyError: If a page is not cached
+        """
+        for page in pages:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT markdown FROM pages WHERE pdf_sha256 = ? AND page = ? AND converter_version = ?",
+                    (pdf_sha256, page, self.converter_version)
+                ).fetchone()
+            if row is None:
+                raise KeyError(f"Page {page} of PDF {pdf_sha256} is not cached")
+            yield row[0]
+
+    def put_pages(self, pdf_sha256: str, pages: Dict[int, str]) -> None:
+        """Store the markdown of converted pages."""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages (pdf_sha256, page, converter_version, markdown, created)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(pdf_sha256, page, self.converter_version, markdown, now) for page, markdown in pages.items()]
+            )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters and the number of stored pages."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
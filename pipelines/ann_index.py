@@ -0,0 +1,156 @@
+"""
+Approximate nearest-neighbour (IVF) index over the guideline embedding matrix.
+
+An inverted-file index partitions the unit-norm chunk embeddings into
+`n_lists` clusters with spherical k-means. A query is only scored against the
+chunks of its `nprobe` closest clusters, so retrieval cost grows with
+`nprobe * n_chunks / n_lists` instead of `n_chunks`.
+
+The index is built offline next to a compiled corpus store (see
+corpus_store.py) and is used transparently by `CorpusIndex.search`.
+Use benchmarks/ann_recall.py to choose `n_lists` / `nprobe` from a recall@k
+vs latency report against exact search.
+"""
+
+import os
+import numpy as np
+from typing import Optional
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+ROWS_FILE = "ivf_rows.npy"
+
+# Rows scored per block when assigning chunks to clusters (bounds temporary memory)
+ASSIGN_BLOCK_ROWS = 65536
+
+
+# ------------------------------------------------------------------
+# Clustering
+# ------------------------------------------------------------------
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+def assign_to_centroids(matrix: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the index of the most similar centroid for every row of `matrix`."""
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], ASSIGN_BLOCK_ROWS):
+        block = np.asarray(matrix[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(
+    matrix: np.ndarray,
+    n_clusters: int,
+    n_iter: int = 20,
+    sample_size: Optional[int] = None,
+    seed: int = 0
+) -> np.ndarray:
+    """
+    Cluster rows by cosine similarity and return unit-norm centroids.
+
+    Training runs on a random sample of at most `sample_size` rows
+    (default: 256 per cluster), which is enough for a coarse quantizer. The
+    sample is normalized, so quantized (float16/int8) rows can be clustered.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = matrix.shape[0]
+    sample_size = sample_size or 256 * n_clusters
+    if n_rows > sample_size:
+        sample_rows = np.sort(rng.choice(n_rows, size=sample_size, replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+    else:
+        sample = np.asarray(matrix, dtype=np.float32)
+    sample = _normalize(sample)
+
+    centroids = sample[rng.choice(len(sample), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        order = np.argsort(assignments, kind="stable")
+        non_empty = np.flatnonzero(counts)
+        sums = np.zeros_like(centroids)
+        sums[non_empty] = np.add.reduceat(sample[order], (np.cumsum(counts) - counts)[non_empty])
+        # Re-seed empty clusters with random training points
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+# ------------------------------------------------------------------
+# IVF index
+# ------------------------------------------------------------------
+class IVFIndex:
+    """
+    Inverted-file index: cluster centroids plus the row ids of each cluster,
+    stored contiguously (`rows[offsets[i]:offsets[i + 1]]` belong to cluster i).
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, nprobe: int = 8):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(
+        cls,
+        matrix: np.ndarray,
+        n_lists: Optional[int] = None,
+        nprobe: int = 8,
+        n_iter: int = 20,
+        seed: int = 0
+    ) -> "IVFIndex":
+        """
+        Build an index over the unit-norm rows of `matrix`.
+        `n_lists` defaults to about 4 * sqrt(n_chunks).
+        """
+        n_rows = matrix.shape[0]
+        if n_lists is None:
+            n_lists = int(4 * np.sqrt(n_rows))
+        n_lists = max(1, min(n_lists, n_rows))
+
+        centroids = spherical_kmeans(matrix, n_lists, n_iter=n_iter, seed=seed)
+        assignments = assign_to_centroids(matrix, centroids)
+        rows = np.argsort(assignments, kind="stable").astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+        return cls(centroids, offsets, rows, nprobe=nprobe)
+
+    def candidates(self, query: np.ndarray, top_k: int, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        Row ids in the `nprobe` clusters closest to the unit-norm `query`.
+        More clusters are probed if needed to return at least `top_k` rows.
+        """
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        order = np.argsort(-(self.centroids @ query))
+        sizes = np.diff(self.offsets)[order]
+        enough = int(np.searchsorted(np.cumsum(sizes), top_k)) + 1
+        probed = order[:max(nprobe, min(enough, self.n_lists))]
+        return np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in probed])
+
+    def save(self, store_dir: str) -> None:
+        np.save(os.path.join(store_dir, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(store_dir, OFFSETS_FILE), self.offsets)
+        np.save(os.path.join(store_dir, ROWS_FILE), self.rows)
+
+    @classmethod
+    def load(cls, store_dir: str, nprobe: int = 8) -> Optional["IVFIndex"]:
+        """Open the index stored in `store_dir`, or return None if there is none."""
+        if not os.path.exists(os.path.join(store_dir, CENTROIDS_FILE)):
+            return None
+        return cls(
+            centroids=np.load(os.path.join(store_dir, CENTROIDS_FILE)),
+            offsets=np.load(os.path.join(store_dir, OFFSETS_FILE)),
+            rows=np.load(os.path.join(store_dir, ROWS_FILE), mmap_mode="r"),
+            nprobe=nprobe
+        )
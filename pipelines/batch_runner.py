@@ -0,0 +1,273 @@
+"""
+Run the full configuration matrix over a directory of patient cases.
+
+The matrix in `experiments/configuration_matrix.yaml` (input type x retrieval
+x model) is expanded for every case file, and all work is scheduled
+concurrently with bounded parallelism:
+- each (case, rewrite model) is rewritten once and shared by all configurations
+  (and by later runs, through the rewritten-case store of rewrite.py),
+- each distinct case text is embedded once and shared by both RAG modes and models,
+- LLM calls run in parallel, limited by `--max-concurrency` (chat completions
+  and Assistant runs use the async, pooled client with retry/backoff from
+  prompts/chatgpt.py; Assistant runs are followed through streamed events),
+- embedding runs one at a time (the model is CPU-bound and loaded once).
+
+One JSON line is written to the output file per (case, configuration) as
+soon as it finishes, so partial runs keep their results and `--resume`
+skips configurations that are already in the output.
+
+IMPORTANT:
+- For the `assistant` retrieval, model selection is handled on the Assistant
+  side; the `model` column is recorded but not sent. Rows that only differ in
+  `model` send the same prompt and share one Assistant run.
+
+Usage:
+    python pipelines/batch_runner.py --cases data/dummy_patients --output results.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import concurrent.futures
+import yaml
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+# ------------------------------------------------------------------
+# Path setup: allow imports from parallel folders
+# ------------------------------------------------------------------
+current_dir = os.path.dirname(os.path.abspath(__file__))
+prompts_dir = os.path.abspath(os.path.join(current_dir, '..', 'prompts'))
+sys.path.append(prompts_dir)
+
+from prompt_templates import CONTEXT_TOKEN_BUDGET, get_prompt_for_configuration
+from chatgpt import achatgpt_assistant, achatgpt_chat_completion, get_assistant_stats, get_latency_stats
+from query_vectors import QUERY_MODE, embed_query
+import tracing
+from rewrite import rewrite_case_from_txt
+from corpus_store import MANIFEST_FILE, load_compiled_corpus
+from framework_3_RAG import LIBRARY_STORE, TOP_K, load_guideline_index, retrieve_top_k_chunks
+
+# ------------------------------------------------------------------
+# Configuration
+# ------------------------------------------------------------------
+MATRIX_PATH = os.path.abspath(os.path.join(current_dir, '..', 'experiments', 'configuration_matrix.yaml'))
+CASES_DIR = os.path.abspath(os.path.join(current_dir, '..', 'data', 'dummy_patients'))
+DEFAULT_CORPUS = os.path.abspath(
+    os.path.join(current_dir, '..', 'data', 'dummy_corpora', 'dummy_guidelines_with_embeddings.json')
+)
+
+# Retrieval column of the matrix -> prompt configuration type
+RETRIEVAL_TO_CONFIG = {
+    "none": "simple",
+    "assistant": "assistant",
+    "rag_full": "rag_full",
+    "rag_selected": "rag_selected",
+}
+
+
+# ------------------------------------------------------------------
+# Helper functions
+# ------------------------------------------------------------------
+def expand_matrix(matrix_path: str, case_paths: List[str]) -> List[Dict]:
+    """Cartesian product of the configuration matrix over all case files."""
+    with open(matrix_path, "r", encoding="utf-8") as f:
+        matrix = yaml.safe_load(f)
+    return [
+        {"case": os.path.basename(case_path), "case_path": case_path,
+         "input_type": input_type, "retrieval": retrieval, "model": model}
+        for case_path in case_paths
+        for input_type in matrix["input_type"]
+        for retrieval in matrix["retrieval"]
+        for model in matrix["model"]
+    ]
+
+
+def job_key(job: Dict) -> tuple:
+    return job["case"], job["input_type"], job["retrieval"], job["model"]
+
+
+def load_done_keys(output_path: str) -> set:
+    """
+    Keys of successful records already present in the output file. Blank
+    lines and lines that are not valid JSON (e.g. a record cut off by a
+    crash) are skipped with a warning; those jobs are simply run again.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    done = set()
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"WARNING: Skipping unreadable line {line_number} of {output_path}: {e}")
+                continue
+            if not isinstance(record, dict):
+                print(f"WARNING: Skipping line {line_number} of {output_path}: not a JSON object.")
+                continue
+            if record.get("error") is None:
+                done.add(job_key(record))
+    return done
+
+
+# ------------------------------------------------------------------
+# Batch runner
+# ------------------------------------------------------------------
+class BatchRunner:
+    """
+    Schedules all jobs of a matrix run on one event loop. Blocking calls
+    (OpenAI, embedding model) run in worker threads; shared stages are
+    memoized as tasks so concurrent jobs wait for the same result.
+    """
+
+    def __init__(self, corpus_index, organ: Optional[str] = None, max_concurrency: int = 8):
+        self.corpus_index = corpus_index
+        self.organ = organ
+        self.llm_semaphore = asyncio.Semaphore(max_concurrency)
+        self.embed_semaphore = asyncio.Semaphore(1)
+        self._shared: Dict[tuple, asyncio.Task] = {}
+
+    def _once(self, key: tuple, coro_factory) -> asyncio.Task:
+        if key not in self._shared:
+            self._shared[key] = asyncio.ensure_future(coro_factory())
+        return self._shared[key]
+
+    async def _llm(self, func, *args, **kwargs):
+        async with self.llm_semaphore:
+            return await asyncio.to_thread(func, *args, **kwargs)
+
+    async def _chat(self, prompt: str, model: str) -> str:
+        async with self.llm_semaphore:
+            return await achatgpt_chat_completion(prompt, model)
+
+    async def _assistant(self, prompt: str) -> str:
+        async with self.llm_semaphore:
+            return await achatgpt_assistant(prompt)
+
+    async def case_text(self, case_path: str, input_type: str, model: str) -> str:
+        if input_type == "rewritten":
+            return await self._once(
+                ("rewrite", case_path, model),
+                lambda: self._llm(rewrite_case_from_txt, case_path, model=model)
+            )
+        with open(case_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    async def query_embedding(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Query vectors and their weights for `text` (see query_vectors.embed_query)."""
+        async def embed():
+            async with self.embed_semaphore:
+                return await asyncio.to_thread(embed_query, text, QUERY_MODE)
+        return await self._once(("embed", text), embed)
+
+    async def run_job(self, job: Dict) -> Dict:
+        config_type = RETRIEVAL_TO_CONFIG[job["retrieval"]]
+        record = {key: value for key, value in job.items() if key != "case_path"}
+        record.update({"config_type": config_type, "response": None, "retrieved_chunks": None, "error": None})
+        start = time.perf_counter()
+        with tracing.span("batch_job", case=job["case"], input_type=job["input_type"],
+                          retrieval=job["retrieval"], model=job["model"]):
+            await self._run_stages(job, config_type, record)
+        record["latency_s"] = time.perf_counter() - start
+        return record
+
+    async def _run_stages(self, job: Dict, config_type: str, record: Dict) -> None:
+        try:
+            text = await self.case_text(job["case_path"], job["input_type"], job["model"])
+
+            if config_type == "assistant":
+                prompt = get_prompt_for_configuration(text, config_type)
+                # The model is not sent, so model rows with the same prompt share one run
+                record["response"] = await self._once(("assistant", prompt), lambda: self._assistant(prompt))
+            elif config_type == "simple":
+                prompt = get_prompt_for_configuration(text, config_type)
+                record["response"] = await self._chat(prompt, job["model"])
+            else:
+                query_embedding, query_weights = await self.query_embedding(text)
+                rows = self.corpus_index.filter_rows(
+                    organ=self.organ, selected_only=(config_type == "rag_selected")
+                )
+                retrieved_chunks = await asyncio.to_thread(
+                    retrieve_top_k_chunks, query_embedding, self.corpus_index, top_k=TOP_K, rows=rows,
+                    weights=query_weights, query_text=text
+                )
+                prompt = await asyncio.to_thread(
+                    get_prompt_for_configuration, text, config_type, retrieved_chunks=retrieved_chunks,
+                    context_token_budget=CONTEXT_TOKEN_BUDGET
+                )
+                record["retrieved_chunks"] = [
+                    {"chunk_id": chunk["chunk_id"], "score": chunk["score"]} for chunk in retrieved_chunks
+                ]
+                record["response"] = await self._chat(prompt, job["model"])
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            tracing.current_span().set("error", record["error"])
+
+    async def run(self, jobs: List[Dict], output_path: str) -> List[Dict]:
+        records = []
+        with open(output_path, "a", encoding="utf-8") as out:
+            for finished in asyncio.as_completed([self.run_job(job) for job in jobs]):
+                record = await finished
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                records.append(record)
+                status = "ERROR " + record["error"] if record["error"] else "ok"
+                print(f"[{len(records)}/{len(jobs)}] {record['case']} | {record['input_type']} | "
+                      f"{record['retrieval']} | {record['model']} | {record['latency_s']:.1f}s | {status}")
+        return records
+
+
+# ------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the configuration matrix over a directory of cases.")
+    parser.add_argument("--cases", default=CASES_DIR, help="Directory of patient case .txt files.")
+    parser.add_argument("--matrix", default=MATRIX_PATH, help="Configuration matrix YAML.")
+    parser.add_argument("--output", default="batch_results.jsonl", help="JSON lines output file.")
+    parser.add_argument("--corpus", nargs="+", default=[DEFAULT_CORPUS],
+                        help="Guideline corpus JSON file(s) with embeddings (compiled stores are used when present).")
+    parser.add_argument("--organ", default=None,
+                        help="Restrict retrieval to one organ using the compiled guideline library.")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Maximum parallel LLM calls.")
+    parser.add_argument("--resume", action="store_true", help="Skip configurations already in the output file.")
+    args = parser.parse_args()
+
+    case_paths = sorted(
+        os.path.join(args.cases, f) for f in os.listdir(args.cases) if f.endswith(".txt")
+    )
+    jobs = expand_matrix(args.matrix, case_paths)
+    if args.resume:
+        done = load_done_keys(args.output)
+        jobs = [job for job in jobs if job_key(job) not in done]
+    print(f"{len(jobs)} job(s) for {len(case_paths)} case(s).\n")
+
+    if args.organ:
+        if not os.path.exists(os.path.join(LIBRARY_STORE, MANIFEST_FILE)):
+            print(f"ERROR: --organ needs the compiled guideline library at {LIBRARY_STORE}.")
+            sys.exit(1)
+        corpus_index = load_compiled_corpus(LIBRARY_STORE)
+    else:
+        corpus_index = load_guideline_index(args.corpus)
+
+    async def main():
+        # Enough threads for every concurrent LLM call plus the embedding worker
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=args.max_concurrency + 2)
+        )
+        runner = BatchRunner(corpus_index, organ=args.organ, max_concurrency=args.max_concurrency)
+        return await runner.run(jobs, args.output)
+
+    start = time.perf_counter()
+    records = asyncio.run(main())
+    failed = sum(1 for record in records if record["error"])
+    print(f"\nFinished {len(records)} job(s) in {time.perf_counter() - start:.1f}s, {failed} failed. "
+          f"Results in {args.output}")
+    print(f"API request latency: {get_latency_stats()}")
+    print(f"Assistant run latency: {get_assistant_stats()}")
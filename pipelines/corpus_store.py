@@ -0,0 +1,472 @@
+"""
+Compiled, memory-mapped guideline corpus store.
+
+Parsing JSON float lists is slow and needs several times the memory of the
+vectors themselves. A compiled corpus is a directory `<name>.corpus/` written
+next to the JSON file it was built from:
+
+- `embeddings.npy`: (n_chunks, dim) matrix of the L2-normalized embeddings, opened with
+  mmap; float32, or quantized to float16 or int8 (`--dtype`)
+- `scales.npy` (int8 only): per-row scale, the embedding is `scale * int8 row`
+- `rows.npz`: per-row chunk_id, source code, selected_corpora flag and text offsets
+- `texts.bin`: UTF-8 chunk texts, concatenated and sliced on demand
+- `manifest.json`: format version, shapes, storage dtype (with the recall@k of a
+  quantized matrix against float32) and the table of source names
+- `filters.npz`: sorted row-id arrays per metadata value (`selected=1`, `organ=gastric`,
+  `source_type=NCCN`, ...) used to restrict retrieval without walking the chunks
+- `ivf_*.npy` (optional): approximate nearest-neighbour index, see ann_index.py
+- `bm25_*`: BM25 inverted index over the chunk texts (postings memory-mapped), see sparse_index.py
+
+Usage (compile JSON files that already contain embeddings):
+    python pipelines/corpus_store.py data/dummy_corpora/dummy_guidelines_with_embeddings.json
+    python pipelines/corpus_store.py --ivf-lists 256 <corpus_with_embeddings.json>
+    python pipelines/corpus_store.py --dtype int8 <corpus_with_embeddings.json>
+
+Compile all organ/source guideline files into one library store with a metadata index:
+    python pipelines/corpus_store.py --library data/dummy_corpora/guideline_library.corpus \
+        data/dummy_corpora/dummy_S3_guidelines_*.json data/dummy_corpora/dummy_NCCN_guidelines_*.json
+"""
+
+import os
+import json
+import mmap
+import shutil
+import argparse
+import numpy as np
+from typing import List, Dict, Optional, Tuple
+
+from retrieval import CorpusIndex, normalize_rows, quantized_scores
+from ann_index import IVFIndex
+from sparse_index import SparseIndex
+
+FORMAT_VERSION = 1
+CORPUS_SUFFIX = ".corpus"
+
+EMBEDDINGS_FILE = "embeddings.npy"
+ROWS_FILE = "rows.npz"
+TEXTS_FILE = "texts.bin"
+MANIFEST_FILE = "manifest.json"
+FILTERS_FILE = "filters.npz"
+SCALES_FILE = "scales.npy"
+
+# Storage types of the embedding matrix
+DTYPES = ("float32", "float16", "int8")
+
+# Recall check of a quantized matrix against float32 at compile time
+RECALL_K = 10
+RECALL_QUERIES = 256
+MIN_RECALL = 0.95
+
+ORGANS = ["esophageal", "gastric", "hepatic", "pancreatic", "colorectal"]
+SOURCE_TYPES = ["S3", "NCCN"]
+
+
+# ------------------------------------------------------------------
+# Lazy columns
+# ------------------------------------------------------------------
+class TextColumn:
+    """Chunk texts decoded on demand from a memory-mapped UTF-8 blob."""
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        self.offsets = offsets
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._buffer = b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row: int) -> str:
+        start, end = self.offsets[row], self.offsets[row + 1]
+        return self._buffer[start:end].decode("utf-8")
+
+
+class CodedColumn:
+    """Per-row values stored as integer codes, optionally into a lookup table."""
+
+    def __init__(self, codes: np.ndarray, table: Optional[List] = None):
+        self.codes = codes
+        self.table = table
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, row: int):
+        code = self.codes[row].item()
+        return code if self.table is None else self.table[code]
+
+
+# ------------------------------------------------------------------
+# Paths
+# ------------------------------------------------------------------
+def compiled_path_for(json_path: str) -> str:
+    """Return the compiled store directory that belongs to a corpus JSON file."""
+    return os.path.splitext(json_path)[0] + CORPUS_SUFFIX
+
+
+def find_compiled_corpus(json_path: str) -> Optional[str]:
+    """
+    Return the compiled store for `json_path` if it exists and is not older
+    than the JSON file, otherwise None.
+    """
+    store_dir = compiled_path_for(json_path)
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    if os.path.exists(json_path) and os.path.getmtime(json_path) > os.path.getmtime(manifest_path):
+        return None
+    return store_dir
+
+
+def labels_from_filename(json_path: str) -> Dict[str, str]:
+    """
+    Derive organ and source type labels from a guideline JSON filename,
+    e.g. dummy_NCCN_guidelines_gastric.json -> {"organ": "gastric", "source_type": "NCCN"}.
+    """
+    name = os.path.basename(json_path)
+    labels = {}
+    for organ in ORGANS:
+        if organ in name:
+            labels["organ"] = organ
+    for source_type in SOURCE_TYPES:
+        if f"_{source_type}_" in name:
+            labels["source_type"] = source_type
+    return labels
+
+
+# ------------------------------------------------------------------
+# Write
+# ------------------------------------------------------------------
+def build_filter_index(corpora: List[Dict], labels: Optional[List[Dict[str, str]]] = None) -> Dict[str, np.ndarray]:
+    """
+    Group row ids by metadata value: `selected=0/1` for every store plus one
+    entry per label value (`organ=...`, `source_type=...`) when labels are given.
+    """
+    groups = {}
+    for row, chunk in enumerate(corpora):
+        keys = [f"selected={chunk.get('selected_corpora', 0)}"]
+        if labels is not None:
+            keys += [f"{name}={value}" for name, value in labels[row].items()]
+        for key in keys:
+            groups.setdefault(key, []).append(row)
+    return {key: np.array(rows, dtype=np.int64) for key, rows in groups.items()}
+
+
+# Rows normalized (and quantized) per block when writing the matrix
+WRITE_BLOCK_ROWS = 65536
+
+
+# ------------------------------------------------------------------
+# Quantization
+# ------------------------------------------------------------------
+def quantize_rows(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Quantize L2-normalized float32 rows for storage.
+
+    "int8" is symmetric scalar quantization per row: each row is divided by
+    `max(|row|) / 127` and rounded, and that scale is returned alongside.
+
+    Returns:
+        Tuple of the stored rows and the per-row scales (None unless int8).
+    """
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    scales = (np.abs(vectors).max(axis=1) / 127).astype(np.float32)
+    codes = np.rint(vectors / np.where(scales > 0, scales, 1)[:, None]).astype(np.int8)
+    return codes, scales
+
+
+def write_quantized_matrix(matrix: np.ndarray, store_dir: str, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Normalize and quantize `matrix` block by block into the store's embeddings (and scales) file."""
+    stored = np.lib.format.open_memmap(
+        os.path.join(store_dir, EMBEDDINGS_FILE), mode="w+", dtype=dtype, shape=matrix.shape
+    )
+    scales = np.empty(len(matrix), dtype=np.float32) if dtype == "int8" else None
+    for start in range(0, len(matrix), WRITE_BLOCK_ROWS):
+        codes, block_scales = quantize_rows(normalize_rows(matrix[start:start + WRITE_BLOCK_ROWS]), dtype)
+        stored[start:start + len(codes)] = codes
+        if scales is not None:
+            scales[start:start + len(codes)] = block_scales
+    stored.flush()
+    if scales is not None:
+        np.save(os.path.join(store_dir, SCALES_FILE), scales)
+    return stored, scales
+
+
+def _merge_top_k(best: Tuple[np.ndarray, np.ndarray], block_scores: np.ndarray, start: int, k: int):
+    """Merge the (block, n_queries) scores of rows `start...` into the running top-k (scores, rows) per query."""
+    block_scores = block_scores.T
+    block_rows = np.broadcast_to(np.arange(start, start + block_scores.shape[1]), block_scores.shape)
+    scores = np.concatenate([best[0], block_scores], axis=1)
+    rows = np.concatenate([best[1], block_rows], axis=1)
+    if scores.shape[1] > k:
+        keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores, rows = np.take_along_axis(scores, keep, axis=1), np.take_along_axis(rows, keep, axis=1)
+    return scores, rows
+
+
+def quantized_recall(
+    matrix: np.ndarray,
+    stored: np.ndarray,
+    scales: Optional[np.ndarray],
+    k: int = RECALL_K,
+    n_queries: int = RECALL_QUERIES,
+    seed: int = 0
+) -> Dict:
+    """
+    Recall@k of exact search on the quantized matrix against float32.
+
+    Queries are the normalized sums of two random corpus embeddings, so they
+    have true neighbours in the corpus without being corpus rows themselves.
+    Both searches run block by block.
+    """
+    rng = np.random.default_rng(seed)
+    n_rows = len(matrix)
+    k = min(k, n_rows)
+    pairs = rng.integers(0, n_rows, size=(n_queries, 2))
+    queries = normalize_rows(normalize_rows(np.asarray(matrix[pairs[:, 0]])) +
+                             normalize_rows(np.asarray(matrix[pairs[:, 1]])))
+
+    empty = (np.empty((n_queries, 0), dtype=np.float32), np.empty((n_queries, 0), dtype=np.int64))
+    exact, approx = empty, empty
+    for start in range(0, n_rows, WRITE_BLOCK_ROWS):
+        block = slice(start, start + WRITE_BLOCK_ROWS)
+        exact = _merge_top_k(exact, normalize_rows(matrix[block]) @ queries.T, start, k)
+        block_scales = None if scales is None else scales[block]
+        approx = _merge_top_k(approx, quantized_scores(stored[block], queries, block_scales), start, k)
+    hits = [len(np.intersect1d(e, a)) for e, a in zip(exact[1], approx[1])]
+    return {"k": k, "queries": n_queries, "recall_at_k": float(np.mean(hits)) / k}
+
+
+def write_compiled_corpus(
+    corpora: List[Dict],
+    output_dir: str,
+    labels: Optional[List[Dict[str, str]]] = None,
+    matrix: Optional[np.ndarray] = None,
+    sparse: bool = True,
+    dtype: str = "float32"
+) -> str:
+    """
+    Compile chunk dictionaries (with embeddings) into a store at `output_dir`.
+
+    `labels` optionally gives per-chunk metadata (e.g. organ, source_type)
+    for the filter index. `matrix` optionally gives the (n_chunks, dim)
+    embeddings instead of the chunks' "embedding" lists; it may be
+    memory-mapped and is normalized block by block, so very large corpora
+    are written without a full copy in memory. The store is written to a
+    temporary directory first and moved into place, so readers never see a
+    half-written corpus. With `sparse`, a BM25 index over the chunk texts is
+    built into the store as well.
+
+    `dtype` "float16" or "int8" stores the matrix quantized (see
+    `quantize_rows`); the recall@k of the quantized matrix against float32
+    is then measured and recorded in the manifest.
+
+    Raises:
+        ValueError: If a chunk has no embedding or a non-integer chunk_id, or
+            `dtype` is not one of DTYPES
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"Invalid dtype: {dtype}. Must be one of: {', '.join(DTYPES)}")
+    if matrix is not None:
+        if len(matrix) != len(corpora):
+            raise ValueError(f"matrix has {len(matrix)} rows for {len(corpora)} chunks.")
+    elif any("embedding" not in chunk for chunk in corpora):
+        raise ValueError("All chunks need an 'embedding'. Run corpora_embedding.py first.")
+
+    source_codes = {}
+    for chunk in corpora:
+        source_codes.setdefault(chunk.get("source"), len(source_codes))
+    source_table = list(source_codes)
+
+    # Strings or floats would otherwise be converted silently ("101" -> 101, 101.5 -> 101)
+    if any(not isinstance(chunk.get("chunk_id"), (int, np.integer)) or isinstance(chunk["chunk_id"], bool)
+           for chunk in corpora):
+        raise ValueError("Every chunk needs an integer 'chunk_id' to be compiled.")
+    chunk_ids = np.array([chunk["chunk_id"] for chunk in corpora], dtype=np.int64)
+
+    encoded_texts = [(chunk.get("text") or "").encode("utf-8") for chunk in corpora]
+    offsets = np.zeros(len(encoded_texts) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in encoded_texts], out=offsets[1:])
+
+    tmp_dir = output_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    if matrix is None and corpora:
+        matrix = np.asarray([chunk["embedding"] for chunk in corpora], dtype=np.float32)
+    recall = None
+    if corpora:
+        stored, scales = write_quantized_matrix(matrix, tmp_dir, dtype)
+        if dtype != "float32":
+            recall = quantized_recall(matrix, stored, scales)
+    else:
+        stored = np.zeros((0, 0), dtype=dtype)
+        np.save(os.path.join(tmp_dir, EMBEDDINGS_FILE), stored)
+        if dtype == "int8":
+            np.save(os.path.join(tmp_dir, SCALES_FILE), np.zeros(0, dtype=np.float32))
+    np.savez(
+        os.path.join(tmp_dir, ROWS_FILE),
+        chunk_ids=chunk_ids,
+        source_codes=np.array([source_codes[c.get("source")] for c in corpora], dtype=np.int32),
+        selected=np.array([c.get("selected_corpora", 0) for c in corpora], dtype=np.int8),
+        text_offsets=offsets
+    )
+    with open(os.path.join(tmp_dir, TEXTS_FILE), "wb") as f:
+        for text in encoded_texts:
+            f.write(text)
+    np.savez(os.path.join(tmp_dir, FILTERS_FILE), **build_filter_index(corpora, labels))
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "count": int(stored.shape[0]),
+        "dim": int(stored.shape[1]),
+        "dtype": dtype,
+        "sources": source_table,
+    }
+    if recall is not None:
+        manifest["recall"] = recall
+        if recall["recall_at_k"] < MIN_RECALL:
+            print(f"WARNING: {dtype} recall@{recall['k']} against float32 is {recall['recall_at_k']:.3f} "
+                  f"(< {MIN_RECALL}) for {output_dir}. Consider a wider dtype.")
+    if sparse:
+        bm25 = SparseIndex.build(chunk.get("text") or "" for chunk in corpora)
+        bm25.save(tmp_dir)
+        manifest["sparse"] = {"type": "bm25", "terms": bm25.n_terms, "postings": int(len(bm25.rows))}
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    return output_dir
+
+
+def compile_json_corpus(json_path: str, dtype: str = "float32") -> str:
+    """Compile a corpus JSON file with embeddings into its sibling store."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        corpora = json.load(f)
+    return write_compiled_corpus(corpora, compiled_path_for(json_path), dtype=dtype)
+
+
+def compile_guideline_library(json_paths: List[str], output_dir: str, dtype: str = "float32") -> str:
+    """
+    Compile several guideline JSON files (all organs, S3 and NCCN) into one
+    store whose filter index holds organ and source type labels taken from
+    the filenames.
+    """
+    corpora, labels = [], []
+    for path in json_paths:
+        with open(path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        corpora.extend(chunks)
+        labels.extend([labels_from_filename(path)] * len(chunks))
+    return write_compiled_corpus(corpora, output_dir, labels=labels, dtype=dtype)
+
+
+def add_ivf_index(store_dir: str, n_lists: Optional[int] = None, nprobe: int = 8) -> IVFIndex:
+    """Build an IVF index over a compiled store and save it inside the store."""
+    matrix = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    ivf = IVFIndex.build(matrix, n_lists=n_lists, nprobe=nprobe)
+    ivf.save(store_dir)
+
+    manifest_path = os.path.join(store_dir, MANIFEST_FILE)
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["ann"] = {"type": "ivf", "n_lists": ivf.n_lists, "nprobe": nprobe}
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return ivf
+
+
+# ------------------------------------------------------------------
+# Read
+# ------------------------------------------------------------------
+def load_compiled_corpus(store_dir: str, use_ann: bool = True) -> CorpusIndex:
+    """
+    Open a compiled store without copying the embedding matrix.
+
+    If the store contains an IVF index and `use_ann` is True, searches on the
+    returned index are approximate. Quantized (float16/int8) matrices are
+    scored directly, without converting them to float32.
+
+    Raises:
+        ValueError: If the store was written by an incompatible format version
+    """
+    with open(os.path.join(store_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported corpus format {manifest.get('format_version')} in {store_dir}. "
+            f"Recompile it with corpus_store.py."
+        )
+
+    matrix = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    scales = None
+    if manifest.get("dtype") == "int8":
+        scales = np.load(os.path.join(store_dir, SCALES_FILE))
+    with np.load(os.path.join(store_dir, ROWS_FILE)) as rows:
+        chunk_ids = rows["chunk_ids"]
+        source_codes = rows["source_codes"]
+        selected = rows["selected"]
+        offsets = rows["text_offsets"]
+
+    filters = {}
+    if os.path.exists(os.path.join(store_dir, FILTERS_FILE)):
+        with np.load(os.path.join(store_dir, FILTERS_FILE)) as npz:
+            filters = {key: npz[key] for key in npz.files}
+
+    ann = None
+    if use_ann and "ann" in manifest:
+        ann = IVFIndex.load(store_dir, nprobe=manifest["ann"].get("nprobe", 8))
+
+    return CorpusIndex(
+        matrix=matrix,
+        chunk_ids=CodedColumn(chunk_ids),
+        sources=CodedColumn(source_codes, manifest["sources"]),
+        texts=TextColumn(os.path.join(store_dir, TEXTS_FILE), offsets),
+        selected=selected,
+        ann=ann,
+        filters=filters,
+        sparse=SparseIndex.load(store_dir) if "sparse" in manifest else None,
+        scales=scales
+    )
+
+
+# ------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile corpus JSON files with embeddings into binary stores.")
+    parser.add_argument("json_paths", nargs="+", help="Corpus JSON files that already contain embeddings.")
+    parser.add_argument("--library", metavar="STORE_DIR",
+                        help="Compile all JSON files into this single store with organ/source filters.")
+    parser.add_argument("--ivf-lists", type=int, default=None,
+                        help="Also build an IVF approximate index with this many clusters.")
+    parser.add_argument("--nprobe", type=int, default=8,
+                        help="Default number of IVF clusters probed per query.")
+    parser.add_argument("--dtype", choices=DTYPES, default="float32",
+                        help="Storage type of the embedding matrix (float16/int8 are checked for recall@k).")
+    args = parser.parse_args()
+
+    if args.library:
+        stores = [compile_guideline_library(args.json_paths, args.library, dtype=args.dtype)]
+        print(f"Compiled {len(args.json_paths)} file(s) -> {args.library}")
+    else:
+        stores = []
+        for path in args.json_paths:
+            stores.append(compile_json_corpus(path, dtype=args.dtype))
+            print(f"Compiled {path} -> {stores[-1]}")
+    for store in stores:
+        with open(os.path.join(store, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            recall = json.load(f).get("recall")
+        if recall:
+            print(f"{store}: {args.dtype} recall@{recall['k']} against float32 = {recall['recall_at_k']:.3f}")
+
+    for store in stores:
+        if args.ivf_lists:
+            ivf = add_ivf_index(store, n_lists=args.ivf_lists, nprobe=args.nprobe)
+            print(f"Built IVF index with {ivf.n_lists} lists (nprobe={args.nprobe})")
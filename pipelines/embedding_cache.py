@@ -0,0 +1,92 @@
+"""
+Persistent on-disk cache for query embeddings.
+
+Patient-case embeddings are keyed by the SHA-256 of the text together with
+the embedding model identity (name and version), so the same case is only
+embedded once across framework runs, configurations and models. Entries are
+stored as float32 blobs in a SQLite file and evicted least-recently-used
+once the cache exceeds `max_entries`.
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Optional
+
+
+class EmbeddingCache:
+    """
+    Size-bounded LRU cache of text embeddings backed by SQLite.
+
+    Attributes:
+        hits: number of lookups answered from the cache
+        misses: number of lookups that had to be computed
+    """
+
+    def __init__(self, path: str, model_id: str, max_entries: int = 10000):
+        self.path = path
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        """Cache key of `text` for this cache's embedding model."""
+        return hashlib.sha256(f"{self.model_id}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[List[float]]:
+        """Return the cached embedding of `text`, or None on a miss."""
+        key = self.key(text)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put(self, text: str, embedding) -> None:
+        """Store the embedding of `text` and evict the least recently used entries."""
+        vector = np.asarray(embedding, dtype=np.float32).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_access) VALUES (?, ?, ?)",
+                (self.key(text), vector, time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN ("
+                " SELECT key FROM embeddings ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
@@ -1,23 +1,99 @@
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core import Settings
 import os
+import yaml
+
+import resources
+import tracing
+from embedding_cache import EmbeddingCache
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.abspath(os.path.join(current_dir, '..', 'config', 'hyperparameters.yaml'))
+
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    EMBEDDING_CONFIG = yaml.safe_load(f)["embedding"]
+
+# -------------------------------
+# 1. Embedding model (loaded on first use)
+# -------------------------------
+def _load_embed_model():
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    from llama_index.core import Settings
+
+    embed_model = Settings.embed_model = HuggingFaceEmbedding(
+        model_name=EMBEDDING_CONFIG["model"],
+        embed_batch_size=EMBEDDING_CONFIG.get("batch_size", 32)
+    )
+    print("Embedding model loaded!")
+    return embed_model
+
+resources.register("embed_model", _load_embed_model)
+
+def get_embed_model():
+    return resources.get("embed_model")
 
 # -------------------------------
-# 1. Load embedding model
+# 1b. Persistent query embedding cache
 # -------------------------------
-embed_model = Settings.embed_model = HuggingFaceEmbedding(
-    model_name="BAAI/bge-m3"
+# Keyed by text hash + model name/version; set cache_max_entries to 0 to disable.
+CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH",
+    os.path.abspath(os.path.join(current_dir, '..', '.cache', 'query_embeddings.sqlite'))
 )
-print("Embedding model loaded!")
+CACHE_MAX_ENTRIES = EMBEDDING_CONFIG.get("cache_max_entries", 10000)
+
+def _open_embedding_cache():
+    return EmbeddingCache(
+        CACHE_PATH,
+        model_id=f"{EMBEDDING_CONFIG['model']}@{EMBEDDING_CONFIG['version']}",
+        max_entries=CACHE_MAX_ENTRIES
+    )
+
+resources.register("query_embedding_cache", _open_embedding_cache)
+
+def get_embedding_cache():
+    """Return the query embedding cache, or None if it is disabled."""
+    if CACHE_MAX_ENTRIES <= 0:
+        return None
+    return resources.get("query_embedding_cache")
 
 # -------------------------------
 # 2a. Embed from TEXT
 # -------------------------------
 def embed_text(text: str):
-    return embed_model.get_text_embedding(text)
+    with tracing.span("embed_text", chars=len(text)) as span:
+        embedding_cache = get_embedding_cache()
+        if embedding_cache is None:
+            return get_embed_model().get_text_embedding(text)
+
+        embedding = embedding_cache.get(text)
+        span.set("cache_hit", embedding is not None)
+        if embedding is None:
+            embedding = get_embed_model().get_text_embedding(text)
+            embedding_cache.put(text, embedding)
+        return embedding
+
+# -------------------------------
+# 2b. Embed several TEXTS in one batch
+# -------------------------------
+def embed_texts(texts):
+    """
+    Embed `texts` with one batched model call, reusing cached embeddings.
+    Returns the vectors in input order.
+    """
+    with tracing.span("embed_texts", texts=len(texts), chars=sum(len(text) for text in texts)) as span:
+        embedding_cache = get_embedding_cache()
+        embeddings = [embedding_cache.get(text) if embedding_cache is not None else None for text in texts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        span.set("cache_hits", len(texts) - len(missing))
+        if missing:
+            vectors = get_embed_model().get_text_embedding_batch([texts[i] for i in missing])
+            for i, vector in zip(missing, vectors):
+                embeddings[i] = vector
+                if embedding_cache is not None:
+                    embedding_cache.put(texts[i], vector)
+        return embeddings
 
 # -------------------------------
-# 2b. Embed from FILE
+# 2c. Embed from FILE
 # -------------------------------
 def embed_text_from_file(txt_path: str):
     with open(txt_path, "r", encoding="utf-8") as f:
@@ -35,6 +35,13 @@ print("Ensure any guideline PDFs are uploaded to the Assistant if you want them
 # User configuration
 # -----------------------------
 use_rewritten = input("Use rewritten case? (y/n): ").strip().lower() == "y"
+if use_rewritten:
+    # The Assistant selects its own model; this one is only used for rewriting
+    print("Select rewrite model (1 or 2):")
+    print("1) gpt-4o-mini")
+    print("2) gpt-4o")
+    model_choice = input("Enter choice [1 or 2]: ").strip()
+    REWRITE_MODEL_NAME = "gpt-4o" if model_choice == "2" else "gpt-4o-mini"
 
 # -----------------------------
 # Load original patient case
@@ -52,7 +59,7 @@ if use_rewritten:
     sys.path.append(current_dir)
     try:
         from rewrite import rewrite_case_from_txt
-        case_text = rewrite_case_from_txt(case_txt_path)
+        case_text = rewrite_case_from_txt(case_txt_path, model=REWRITE_MODEL_NAME)
         print("=== Using rewritten case ===\n")
     except ImportError:
         print("Rewrite function not found. Using original case.\n")
@@ -14,7 +14,7 @@ import os
 import sys
 import json
 import numpy as np
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Union
 
 # ------------------------------------------------------------------
 # Path setup: allow imports from parallel folders
@@ -31,9 +31,13 @@ sys.path.append(dummy_corpora_dir)
 # ------------------------------------------------------------------
 # Imports
 # ------------------------------------------------------------------
-from prompt_templates import get_prompt_for_configuration
+from prompt_templates import CONTEXT_TOKEN_BUDGET, count_tokens, get_prompt_for_configuration
 from chatgpt import chatgpt_chat_completion
-from embeddings import embed_text
+from query_vectors import QUERY_AGGREGATION, QUERY_MODE, embed_query
+from retrieval import MMR_LAMBDA, MMR_POOL, CorpusIndex
+from sparse_index import FUSION, FUSION_PARAMS, SPARSE_CANDIDATES
+import tracing
+from corpus_store import ORGANS, MANIFEST_FILE, find_compiled_corpus, load_compiled_corpus
 from guideline_dictionary_dummy import guidelines_s3_dict
 
 # ------------------------------------------------------------------
@@ -45,6 +49,10 @@ CASE_PATH = os.path.abspath(
     os.path.join(current_dir, '..', 'data', 'dummy_patients', 'example_case_de.txt')
 )
 
+# Compiled store with all organ/source guidelines and a metadata filter index
+# (built with: python pipelines/corpus_store.py --library <this path> <guideline JSON files>)
+LIBRARY_STORE = os.path.join(dummy_corpora_dir, 'guideline_library.corpus')
+
 # ------------------------------------------------------------------
 # Helper functions
 # ------------------------------------------------------------------
@@ -53,39 +61,84 @@ def load_case_text(path: str) -> str:
         return f.read().strip()
 
 
+@tracing.traced()
 def load_guideline_corpora(json_paths: List[str]) -> List[Dict]:
     merged = []
     for path in json_paths:
         with open(path, 'r', encoding='utf-8') as f:
             merged.extend(json.load(f))
+    tracing.current_span().set("chunks", len(merged))
     return merged
 
 
-def cosine_similarity(vec1: np.ndarray, vec2: np.ndarray) -> float:
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-    if norm1 == 0 or norm2 == 0:
-        return 0.0
-    return float(np.dot(vec1, vec2) / (norm1 * norm2))
+@tracing.traced()
+def load_guideline_index(json_paths: List[str]) -> CorpusIndex:
+    """
+    Load guideline corpora as a `CorpusIndex`.
+
+    Each JSON file is read from its compiled, memory-mapped store when one is
+    available and up to date (see corpus_store.py); otherwise the JSON file
+    itself is parsed.
+    """
+    indexes = []
+    compiled = 0
+    for path in json_paths:
+        store_dir = find_compiled_corpus(path)
+        if store_dir is not None:
+            indexes.append(load_compiled_corpus(store_dir))
+            compiled += 1
+        else:
+            indexes.append(CorpusIndex.from_chunks(load_guideline_corpora([path])))
+    corpus_index = CorpusIndex.concatenate(indexes)
+    span = tracing.current_span()
+    span.set("files", len(json_paths))
+    span.set("compiled_stores", compiled)
+    span.set("chunks", len(corpus_index))
+    return corpus_index
 
 
 def retrieve_top_k_chunks(
     query_embedding: np.ndarray,
-    corpora: Optional[List[Dict]],
-    top_k: int = 5
+    corpora: Union[CorpusIndex, List[Dict], None],
+    top_k: int = 5,
+    exact: bool = False,
+    rows: Optional[np.ndarray] = None,
+    aggregation: str = QUERY_AGGREGATION,
+    weights: Optional[np.ndarray] = None,
+    query_text: Optional[str] = None,
+    fusion: str = FUSION,
+    sparse_candidates: int = SPARSE_CANDIDATES,
+    mmr_lambda: Optional[float] = MMR_LAMBDA,
+    mmr_pool: int = MMR_POOL
 ) -> List[Dict]:
-    scored_chunks = []
-    for chunk in corpora:
-        chunk_embedding = np.array(chunk["embedding"], dtype=float)
-        score = cosine_similarity(query_embedding, chunk_embedding)
-        scored_chunks.append({
-            "chunk_id": chunk.get("chunk_id"),
-            "source": chunk.get("source"),
-            "text": chunk.get("text"),
-            "score": score
-        })
-    scored_chunks.sort(key=lambda x: x["score"], reverse=True)
-    return scored_chunks[:top_k]
+    """
+    Retrieve the `top_k` guideline chunks most similar to the query.
+
+    `corpora` is preferably a prebuilt `CorpusIndex`; a list of chunk
+    dictionaries is still accepted and indexed on the fly. `rows` restricts
+    scoring to a metadata filter (see `CorpusIndex.filter_rows`). Compiled
+    stores with an IVF index are searched approximately unless `exact` is True.
+    A 2-D `query_embedding` (see `query_vectors.embed_query`) is aggregated
+    per chunk with `aggregation` ("max" or "weighted" with `weights`).
+    With `query_text`, the dense scores are fused with BM25 scores (`fusion`
+    and `sparse_candidates` from retrieval.sparse, see sparse_index.py).
+    With `mmr_lambda`, near-duplicate chunks are diversified away by MMR
+    over the best `mmr_pool` chunks.
+    """
+    with tracing.span("retrieve_top_k_chunks", top_k=top_k, exact=exact) as span:
+        if not isinstance(corpora, CorpusIndex):
+            corpora = CorpusIndex.from_chunks(corpora or [])
+        span.set("corpus_chunks", len(corpora))
+        span.set("filtered_rows", len(rows) if rows is not None else None)
+        span.set("ann", corpora.ann is not None and not exact)
+        span.set("query_vectors", len(query_embedding) if np.ndim(query_embedding) == 2 else 1)
+        span.set("fusion", fusion if query_text is not None else "none")
+        span.set("sparse_candidates", sparse_candidates if query_text is not None else 0)
+        span.set("mmr_lambda", mmr_lambda)
+        return corpora.search(query_embedding, top_k=top_k, exact=exact, rows=rows,
+                              aggregation=aggregation, weights=weights, query_text=query_text,
+                              fusion=fusion, sparse_candidates=sparse_candidates,
+                              mmr_lambda=mmr_lambda, mmr_pool=mmr_pool, **FUSION_PARAMS)
 
 # ------------------------------------------------------------------
 # Main pipeline
@@ -116,7 +169,7 @@ if __name__ == "__main__":
     if use_rewritten:
         try:
             from rewrite import rewrite_case_from_txt
-            case_text = rewrite_case_from_txt(CASE_PATH)
+            case_text = rewrite_case_from_txt(CASE_PATH, model=MODEL_NAME)
             print("\n=== Using rewritten case ===\n")
         except ImportError:
             print("WARNING: Rewrite function not found. Using original case.\n")
@@ -128,12 +181,21 @@ if __name__ == "__main__":
     use_real = input("Do you want to use real guidelines that have already been digested? (y/n): ").strip().lower() == "y"
 
     selected_json_files = []
+    corpus_index = None
+    organ_filter = None
     if use_real:
         print("\nSelect organ/system for corpus:")
         print("Options: esophageal, gastric, hepatic, pancreatic, colorectal, abort")
         organ_choice = input("Enter your choice: ").strip().lower()
 
-        if organ_choice in ["esophageal", "gastric", "hepatic", "pancreatic", "colorectal"]:
+        if organ_choice in ORGANS and os.path.exists(os.path.join(LIBRARY_STORE, MANIFEST_FILE)):
+            # Compiled library: select the organ through its metadata index
+            corpus_index = load_compiled_corpus(LIBRARY_STORE)
+            organ_filter = organ_choice
+            if corpus_index.filter_rows(organ=organ_filter).size == 0:
+                print(f"No chunks found for {organ_choice} in the guideline library, using dummy corpus instead.\n")
+                corpus_index = organ_filter = None
+        elif organ_choice in ORGANS:
             # Search all JSON files in dummy_corpora folder containing the keyword
             selected_json_files = [
                 os.path.join(dummy_corpora_dir, f)
@@ -147,7 +209,7 @@ if __name__ == "__main__":
             print("Abort or invalid choice, using dummy corpus.\n")
 
 
-    if not selected_json_files:
+    if corpus_index is None and not selected_json_files:
         if use_real:
             # Fallback to dummy S3 guidelines
             selected_json_files = [
@@ -157,26 +219,33 @@ if __name__ == "__main__":
         else:
             selected_json_files = [os.path.join(current_dir, '..', 'data', 'dummy_corpora', 'dummy_guidelines_with_embeddings.json')]
 
-    # Load and merge JSON files
-    corpora = load_guideline_corpora(selected_json_files)
-    print(f"Loaded {len(corpora)} chunks from {len(selected_json_files)} JSON file(s).\n")
+    if corpus_index is None:
+        # Load and merge corpora (compiled stores are memory-mapped, JSON is parsed)
+        corpus_index = load_guideline_index(selected_json_files)
+        print(f"Loaded {len(corpus_index)} chunks from {len(selected_json_files)} corpus file(s).\n")
+    else:
+        print(f"Using guideline library with {len(corpus_index)} chunks, filtered to organ '{organ_filter}'.\n")
 
-    # Optionally filter by selected_corpora
+    # Optionally filter by selected_corpora (applied as a row filter during scoring)
     use_selected_corpora = input("Use only selected corpora chunks? (y/n): ").strip().lower() == "y"
+    filter_rows = corpus_index.filter_rows(organ=organ_filter, selected_only=use_selected_corpora)
     if use_selected_corpora:
-        corpora = [chunk for chunk in corpora if chunk.get("selected_corpora", 0) == 1]
-        print(f"Using only selected corpora chunks: {len(corpora)} available\n")
+        print(f"Using only selected corpora chunks: {len(filter_rows)} available\n")
 
     # -----------------------------
     # Embed patient case
     # -----------------------------
-    query_embedding = np.array(embed_text(case_text), dtype=float)
+    # (one vector per section or sentence with retrieval.query_mode, see query_vectors.py)
+    query_embedding, query_weights = embed_query(case_text, mode=QUERY_MODE)
+    if len(query_embedding) > 1:
+        print(f"Query: {len(query_embedding)} vectors ({QUERY_MODE}, {QUERY_AGGREGATION} aggregation).\n")
 
     # -----------------------------
     # Retrieve top-k chunks
     # -----------------------------
     try:
-        retrieved_chunks = retrieve_top_k_chunks(query_embedding, corpora, top_k=TOP_K)
+        retrieved_chunks = retrieve_top_k_chunks(query_embedding, corpus_index, top_k=TOP_K, rows=filter_rows,
+                                                 weights=query_weights, query_text=case_text)
     except ValueError as e:
         if "shapes" in str(e) and "not aligned" in str(e):
             print("ERROR: Embedding dimension mismatch detected.")
@@ -186,13 +255,21 @@ if __name__ == "__main__":
             raise
 
     # -----------------------------
-    # Build RAG prompt
+    # Build RAG prompt (packed into the context token budget, if set)
     # -----------------------------
+    packing = {}
     prompt = get_prompt_for_configuration(
         case_text=case_text,
         config_type="rag_full",
-        retrieved_chunks=retrieved_chunks
+        retrieved_chunks=retrieved_chunks,
+        context_token_budget=CONTEXT_TOKEN_BUDGET,
+        packing_stats=packing
     )
+    if packing:
+        print(f"Context: {packing['tokens_used']}/{packing['token_budget']} tokens "
+              f"({packing['tokens_before']} before packing; {packing['chunks_full']} full, "
+              f"{packing['chunks_trimmed']} trimmed, {packing['chunks_dropped']} dropped chunk(s)).")
+        print(f"Prompt: {count_tokens(prompt)} tokens.\n")
 
     # -----------------------------
     # Run model
@@ -0,0 +1,118 @@
+"""
+Multi-vector queries for long patient cases.
+
+Instead of pushing a whole tumor-board narrative (history, imaging,
+pathology, ...) through the encoder as one sequence, the case is split into
+sections or sentences that are embedded in one batch. Retrieval then scores
+the corpus against all query vectors in one pass and aggregates per chunk
+(max-sim or a length-weighted mean, see `retrieval.aggregate_scores`), so a
+single finding is not diluted by the rest of the case.
+
+Query modes (`retrieval.query_mode` in config/hyperparameters.yaml):
+- `single`: the whole case as one vector (former behaviour),
+- `sections`: blocks separated by blank lines; overly long blocks are split
+  into sentences,
+- `sentences`: lines and sentences.
+Segments shorter than `retrieval.min_query_segment_chars` are merged into
+the next one (headings such as "Histologie" stay with their content).
+"""
+
+import os
+import re
+import yaml
+import numpy as np
+from typing import List, Tuple
+
+import embeddings
+import tracing
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.abspath(os.path.join(current_dir, '..', 'config', 'hyperparameters.yaml'))
+
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    RETRIEVAL_CONFIG = yaml.safe_load(f)["retrieval"]
+
+QUERY_MODES = ("single", "sections", "sentences")
+QUERY_MODE = RETRIEVAL_CONFIG.get("query_mode", "single")
+QUERY_AGGREGATION = RETRIEVAL_CONFIG.get("query_aggregation", "max")
+MIN_SEGMENT_CHARS = RETRIEVAL_CONFIG.get("min_query_segment_chars", 40)
+MAX_SECTION_CHARS = RETRIEVAL_CONFIG.get("max_query_section_chars", 1500)
+
+_BLOCK_SEPARATOR = re.compile(r"\n\s*\n")
+# Sentence ends followed by whitespace, or line breaks
+_SENTENCE_SEPARATOR = re.compile(r"(?<=[.!?;])\s+|\n")
+
+
+# ------------------------------------------------------------------
+# Case splitting
+# ------------------------------------------------------------------
+def _sentences(text: str) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_SEPARATOR.split(text) if sentence.strip()]
+
+
+def _merge_short(segments: List[str], min_chars: int) -> List[str]:
+    """Merge segments shorter than `min_chars` into the following one (the last into the previous one)."""
+    merged = []
+    pending = ""
+    for segment in segments:
+        pending = f"{pending}\n{segment}" if pending else segment
+        if len(pending) >= min_chars:
+            merged.append(pending)
+            pending = ""
+    if pending:
+        if merged:
+            merged[-1] = f"{merged[-1]}\n{pending}"
+        else:
+            merged.append(pending)
+    return merged
+
+
+def split_case(
+    text: str,
+    mode: str = QUERY_MODE,
+    min_chars: int = MIN_SEGMENT_CHARS,
+    max_section_chars: int = MAX_SECTION_CHARS
+) -> List[str]:
+    """
+    Split a patient case into query segments according to `mode`.
+
+    Raises:
+        ValueError: If `mode` is not one of QUERY_MODES
+    """
+    text = text.strip()
+    if mode == "single":
+        return [text] if text else []
+    if mode == "sections":
+        segments = []
+        for block in _BLOCK_SEPARATOR.split(text):
+            block = block.strip()
+            if len(block) > max_section_chars:
+                segments.extend(_sentences(block))
+            elif block:
+                segments.append(block)
+    elif mode == "sentences":
+        segments = _sentences(text)
+    else:
+        raise ValueError(f"Invalid query mode: {mode}. Must be one of: {', '.join(QUERY_MODES)}")
+    return _merge_short(segments, min_chars)
+
+
+# ------------------------------------------------------------------
+# Query embedding
+# ------------------------------------------------------------------
+def embed_query(text: str, mode: str = QUERY_MODE) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Embed a case as one or several query vectors.
+
+    Returns:
+        Tuple of the (n_segments, dim) float32 query matrix and the segment
+        weights (proportional to segment length) for weighted aggregation.
+    """
+    with tracing.span("embed_query", mode=mode) as span:
+        segments = split_case(text, mode) if mode != "single" else []
+        if len(segments) <= 1:
+            return np.asarray([embeddings.embed_text(text)], dtype=np.float32), np.ones(1, dtype=np.float32)
+        span.set("segments", len(segments))
+        vectors = np.asarray(embeddings.embed_texts(segments), dtype=np.float32)
+        weights = np.array([len(segment) for segment in segments], dtype=np.float32)
+        return vectors, weights
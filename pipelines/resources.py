@@ -0,0 +1,63 @@
+"""
+Registry of lazily created heavy resources.
+
+Embedding models and API clients are expensive to construct (loading bge-m3
+alone takes several seconds). Modules register a factory under a name at
+import time, and the resource is only built on the first `get()` call, once
+per process. Importing a module to format a prompt or run the simple-request
+pipeline therefore no longer pays for the embedding model.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional
+
+import tracing
+
+_factories: Dict[str, Callable[[], Any]] = {}
+_instances: Dict[str, Any] = {}
+_lock = threading.RLock()
+
+
+def register(name: str, factory: Callable[[], Any]) -> None:
+    """
+    Register `factory` to build the resource `name` on first use.
+
+    Re-registering a name that has already been built keeps the existing
+    instance, so several modules can share one resource.
+    """
+    with _lock:
+        if name not in _instances:
+            _factories[name] = factory
+
+
+def get(name: str) -> Any:
+    """
+    Return the resource `name`, building it on the first call.
+
+    Raises:
+        KeyError: If no factory is registered under `name`
+    """
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+    with _lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"No resource registered under '{name}'")
+            with tracing.span("resources.load", resource=name):
+                _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def is_loaded(name: str) -> bool:
+    """Whether the resource `name` has already been built."""
+    return name in _instances
+
+
+def reset(name: Optional[str] = None) -> None:
+    """Drop one (or every) built resource so that it is rebuilt on next use."""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
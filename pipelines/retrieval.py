@@ -0,0 +1,509 @@
+"""
+Vectorized retrieval engine for the custom RAG pipeline.
+
+The guideline corpus is held as one L2-normalized float32 matrix, so cosine
+similarity against every chunk reduces to a single matrix-vector product.
+Top-k selection uses a partial sort and result dictionaries are only built
+for the k winning chunks.
+
+A query can also be several vectors (e.g. one per section of a long case,
+see query_vectors.py). All of them are scored in one matrix-matrix product
+and the per-chunk scores are aggregated by max-sim or a weighted mean.
+
+Given the query text, dense scores are fused with BM25 scores from a sparse
+index (see sparse_index.py), which can also prune the rows scored densely.
+
+An optional maximal-marginal-relevance (MMR) stage picks the final chunks
+from a larger candidate pool, trading relevance against redundancy with the
+chunks already picked (e.g. the same recommendation in the S3 and NCCN
+guidelines), using the candidates' stored embeddings.
+
+Compiled stores may hold the matrix as float16 or as int8 with one scale per
+row (see corpus_store.py). Such matrices are scored block by block in
+float32, so no full-precision copy of the corpus is ever made.
+"""
+
+import os
+import yaml
+import numpy as np
+from typing import List, Dict, Optional, Sequence
+
+from sparse_index import SparseIndex
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.abspath(os.path.join(current_dir, '..', 'config', 'hyperparameters.yaml'))
+
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    RETRIEVAL_CONFIG = yaml.safe_load(f)["retrieval"]
+
+# MMR trade-off (1.0 = relevance only, 0.0 = diversity only; None disables MMR)
+MMR_LAMBDA = RETRIEVAL_CONFIG.get("mmr_lambda")
+MMR_POOL = RETRIEVAL_CONFIG.get("mmr_pool", 20)
+
+# Rows converted to float32 per block when scoring a float16/int8 matrix
+SCORE_BLOCK_ROWS = 16384
+
+
+# ------------------------------------------------------------------
+# Helper functions
+# ------------------------------------------------------------------
+def normalize_rows(vectors) -> np.ndarray:
+    """
+    Return float32 copies of `vectors` scaled to unit L2 norm along the last axis.
+
+    Zero vectors are left at zero so that they score 0.0 against any query,
+    matching the behaviour of the former per-chunk cosine similarity.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantized_scores(
+    matrix: np.ndarray,
+    query: np.ndarray,
+    scales: Optional[np.ndarray] = None,
+    rows: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Dot products of a normalized float32 `query` (1-D or 2-D) with the rows of
+    a float16 or int8 `matrix` (or only `rows`), converted to float32 block
+    by block. int8 scores are multiplied by the per-row `scales`.
+    """
+    n = matrix.shape[0] if rows is None else len(rows)
+    scores = np.empty((n,) + query.shape[:-1], dtype=np.float32)
+    for start in range(0, n, SCORE_BLOCK_ROWS):
+        block = slice(start, start + SCORE_BLOCK_ROWS) if rows is None else rows[start:start + SCORE_BLOCK_ROWS]
+        block_scores = np.asarray(matrix[block], dtype=np.float32) @ query.T
+        if scales is not None:
+            block_scales = scales[block]
+            block_scores *= block_scales[:, None] if block_scores.ndim == 2 else block_scales
+        scores[start:start + len(block_scores)] = block_scores
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Return the indices of the `top_k` highest scores, best first.
+
+    Uses `np.argpartition` so only the winners are fully sorted. Ties are
+    broken by position, which keeps results deterministic.
+    """
+    n = scores.shape[0]
+    top_k = min(top_k, n)
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < n:
+        candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+AGGREGATIONS = ("max", "weighted")
+
+
+def aggregate_scores(scores: np.ndarray, aggregation: str = "max", weights=None) -> np.ndarray:
+    """
+    Combine (n_chunks, n_query_vectors) similarity scores into one score per chunk.
+
+    "max" keeps each chunk's best match with any query vector (max-sim);
+    "weighted" is the mean weighted by `weights` (uniform if None).
+    """
+    if aggregation == "max":
+        return scores.max(axis=1)
+    if aggregation == "weighted":
+        weights = np.ones(scores.shape[1], dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32)
+        return scores @ (weights / weights.sum())
+    raise ValueError(f"Invalid aggregation: {aggregation}. Must be one of: {', '.join(AGGREGATIONS)}")
+
+
+FUSIONS = ("rrf", "linear", "none")
+
+
+def fuse_scores(
+    dense: np.ndarray,
+    sparse: np.ndarray,
+    fusion: str = "rrf",
+    rrf_k: int = 60,
+    depth: int = 100,
+    dense_weight: float = 1.0,
+    sparse_weight: float = 1.0
+) -> np.ndarray:
+    """
+    Fuse dense and sparse (BM25) scores of the same rows into one score per row.
+
+    - "rrf": reciprocal rank fusion of the top `depth` rows of each ranking,
+      `weight / (rrf_k + rank)`; chunks without any query term get no sparse share,
+    - "linear": `dense_weight * dense + sparse_weight * sparse / max(sparse)`,
+    - "none": the dense scores.
+    """
+    if fusion == "none":
+        return dense
+    if fusion == "linear":
+        max_sparse = float(sparse.max()) if len(sparse) else 0.0
+        return dense_weight * dense + sparse_weight * (sparse / max_sparse if max_sparse > 0 else sparse)
+    if fusion == "rrf":
+        fused = np.zeros(len(dense), dtype=np.float32)
+        dense_top = top_k_indices(dense, depth)
+        fused[dense_top] += dense_weight / (rrf_k + 1 + np.arange(len(dense_top)))
+        sparse_top = top_k_indices(sparse, min(depth, int(np.count_nonzero(sparse))))
+        fused[sparse_top] += sparse_weight / (rrf_k + 1 + np.arange(len(sparse_top)))
+        return fused
+    raise ValueError(f"Invalid fusion: {fusion}. Must be one of: {', '.join(FUSIONS)}")
+
+
+def mmr_select(vectors: np.ndarray, relevance: np.ndarray, top_k: int, mmr_lambda: float) -> np.ndarray:
+    """
+    Greedy maximal-marginal-relevance selection over a candidate pool.
+
+    Each step picks the candidate maximizing
+    `mmr_lambda * relevance - (1 - mmr_lambda) * max cosine similarity to the
+    candidates already picked`. The pool's pairwise similarities come from one
+    matrix product and the redundancy of every candidate is updated with one
+    vector maximum per step. Relevance is rescaled to [0, 1] over the pool, so
+    `mmr_lambda` means the same for cosine and fused scores.
+
+    Args:
+        vectors: (pool, dim) L2-normalized candidate embeddings
+        relevance: (pool,) ranking score of each candidate
+        top_k: number of candidates to pick
+        mmr_lambda: relevance/diversity trade-off in [0, 1]
+
+    Returns:
+        Positions into the pool, in selection order.
+
+    Raises:
+        ValueError: If `mmr_lambda` is not in [0, 1]
+    """
+    if not 0.0 <= mmr_lambda <= 1.0:
+        raise ValueError(f"mmr_lambda must be between 0 and 1, got {mmr_lambda}.")
+    n = len(relevance)
+    top_k = min(top_k, n)
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    relevance = np.asarray(relevance, dtype=np.float32)
+    spread = float(relevance.max() - relevance.min())
+    relevance = (relevance - relevance.min()) / spread if spread > 0 else np.ones(n, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    similarity = vectors @ vectors.T
+
+    selected = np.empty(top_k, dtype=np.int64)
+    redundancy = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for i in range(top_k):
+        gains = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(gains))
+        selected[i] = best
+        available[best] = False
+        redundancy = similarity[best] if i == 0 else np.maximum(redundancy, similarity[best])
+    return selected
+
+
+# ------------------------------------------------------------------
+# Corpus index
+# ------------------------------------------------------------------
+class CorpusIndex:
+    """
+    In-memory guideline corpus prepared for similarity search.
+
+    Attributes:
+        matrix: (n_chunks, dim) float32 matrix of unit-norm chunk embeddings
+        chunk_ids: chunk identifiers, one per row
+        sources: source names, one per row
+        texts: chunk texts, one per row (any indexable sequence)
+        selected: int8 array with the `selected_corpora` flag of each row
+        ann: optional approximate nearest-neighbour index (see ann_index.py);
+            when set, `search` only scores the chunks it proposes
+        filters: metadata filter index, mapping "name=value" keys
+            (e.g. "organ=gastric", "source_type=S3", "selected=1") to sorted row ids
+        sparse: optional BM25 index over the chunk texts (see sparse_index.py);
+            built on first use by `sparse_index()` when not loaded from a store
+        scales: per-row scales of an int8 `matrix` (a float16 matrix needs none)
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        chunk_ids: Sequence,
+        sources: Sequence,
+        texts: Sequence,
+        selected: Optional[np.ndarray] = None,
+        ann=None,
+        filters: Optional[Dict[str, np.ndarray]] = None,
+        sparse: Optional[SparseIndex] = None,
+        scales: Optional[np.ndarray] = None
+    ):
+        self.matrix = matrix
+        self.chunk_ids = chunk_ids
+        self.sources = sources
+        self.texts = texts
+        if selected is None:
+            selected = np.zeros(len(chunk_ids), dtype=np.int8)
+        self.selected = selected
+        self.ann = ann
+        self.filters = filters if filters is not None else {}
+        self.sparse = sparse
+        self.scales = scales
+
+    @classmethod
+    def from_chunks(cls, corpora: List[Dict]) -> "CorpusIndex":
+        """
+        Build an index from chunk dictionaries as stored in the guideline JSON files.
+        """
+        if corpora:
+            matrix = normalize_rows([chunk["embedding"] for chunk in corpora])
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        return cls(
+            matrix=matrix,
+            chunk_ids=[chunk.get("chunk_id") for chunk in corpora],
+            sources=[chunk.get("source") for chunk in corpora],
+            texts=[chunk.get("text") for chunk in corpora],
+            selected=np.array([chunk.get("selected_corpora", 0) for chunk in corpora], dtype=np.int8)
+        )
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    @property
+    def quantized(self) -> bool:
+        return self.matrix.dtype != np.float32 or self.scales is not None
+
+    def vectors(self, rows) -> np.ndarray:
+        """Float32 embeddings of `rows` (dequantized for float16/int8 matrices)."""
+        vectors = np.asarray(self.matrix[rows], dtype=np.float32)
+        if self.scales is not None:
+            vectors = vectors * np.asarray(self.scales[rows])[..., None]
+        return vectors
+
+    def subset(self, rows) -> "CorpusIndex":
+        """Return a new in-memory index restricted to the given (sorted) row ids."""
+        rows = np.asarray(rows, dtype=np.int64)
+        filters = {}
+        for key, filter_rows in self.filters.items():
+            kept = np.intersect1d(filter_rows, rows, assume_unique=True)
+            filters[key] = np.searchsorted(rows, kept)
+        return CorpusIndex(
+            matrix=np.asarray(self.matrix[rows]),
+            chunk_ids=[self.chunk_ids[row] for row in rows],
+            sources=[self.sources[row] for row in rows],
+            texts=[self.texts[row] for row in rows],
+            selected=np.asarray(self.selected[rows]),
+            filters=filters,
+            scales=None if self.scales is None else np.asarray(self.scales[rows])
+        )
+
+    @classmethod
+    def concatenate(cls, indexes: List["CorpusIndex"]) -> "CorpusIndex":
+        """
+        Merge several indexes into one. A single index is returned unchanged;
+        otherwise the matrices are copied into one contiguous array (kept
+        quantized if all indexes share the storage type, else dequantized).
+        """
+        indexes = [index for index in indexes if len(index)]
+        if len(indexes) == 1:
+            return indexes[0]
+        if not indexes:
+            return cls.from_chunks([])
+        dims = {index.dim for index in indexes}
+        if len(dims) > 1:
+            raise ValueError(f"shapes not aligned: corpora have different embedding dimensions {sorted(dims)}")
+        if len({(index.matrix.dtype, index.scales is None) for index in indexes}) == 1:
+            matrix = np.concatenate([np.asarray(index.matrix) for index in indexes])
+            scales = None if indexes[0].scales is None else np.concatenate([index.scales for index in indexes])
+        else:
+            matrix = np.concatenate([index.vectors(slice(None)) for index in indexes])
+            scales = None
+        filters = {}
+        offset = 0
+        for index in indexes:
+            for key, filter_rows in index.filters.items():
+                filters.setdefault(key, []).append(np.asarray(filter_rows) + offset)
+            offset += len(index)
+        return cls(
+            matrix=matrix,
+            chunk_ids=[index.chunk_ids[row] for index in indexes for row in range(len(index))],
+            sources=[index.sources[row] for index in indexes for row in range(len(index))],
+            texts=[index.texts[row] for index in indexes for row in range(len(index))],
+            selected=np.concatenate([np.asarray(index.selected) for index in indexes]),
+            filters={key: np.concatenate(parts) for key, parts in filters.items()},
+            scales=scales
+        )
+
+    def filter_rows(
+        self,
+        organ: Optional[str] = None,
+        source_type: Optional[str] = None,
+        selected_only: bool = False
+    ) -> Optional[np.ndarray]:
+        """
+        Sorted row ids matching all given metadata filters, or None if no filter is set.
+
+        Organ and source type filters need a store compiled with labels
+        (see `compile_guideline_library`); unknown values match no rows.
+        """
+        keys = []
+        if organ:
+            keys.append(f"organ={organ}")
+        if source_type:
+            keys.append(f"source_type={source_type}")
+        if selected_only:
+            keys.append("selected=1")
+        if not keys:
+            return None
+
+        rows = None
+        for key in keys:
+            if key in self.filters:
+                key_rows = np.asarray(self.filters[key])
+            elif key == "selected=1":
+                key_rows = np.flatnonzero(np.asarray(self.selected) == 1)
+            else:
+                key_rows = np.empty(0, dtype=np.int64)
+            rows = key_rows if rows is None else np.intersect1d(rows, key_rows, assume_unique=True)
+        return rows
+
+    def sparse_index(self) -> SparseIndex:
+        """The BM25 index of this corpus, built from the chunk texts on first use."""
+        if self.sparse is None:
+            self.sparse = SparseIndex.build(self.texts[row] for row in range(len(self)))
+        return self.sparse
+
+    def record(self, row: int, score: float) -> Dict:
+        """Build the result dictionary for a single row."""
+        return {
+            "chunk_id": self.chunk_ids[row],
+            "source": self.sources[row],
+            "text": self.texts[row],
+            "score": float(score)
+        }
+
+    def score(self, query_embedding, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Cosine similarity of the query against every chunk (or only `rows`), as one matmul
+        (block by block for a float16/int8 matrix, see `quantized_scores`).
+
+        A 2-D `query_embedding` holds several query vectors and gives an
+        (n_chunks, n_query_vectors) score matrix.
+
+        Raises:
+            ValueError: If the query dimension does not match the corpus dimension
+        """
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        query = normalize_rows(query_embedding if query_embedding.ndim == 2 else np.ravel(query_embedding))
+        if query.shape[-1] != self.dim:
+            raise ValueError(
+                f"shapes {query.shape} and {self.matrix.shape} not aligned: "
+                f"query embedding has dimension {query.shape[-1]}, corpus has {self.dim}"
+            )
+        if self.quantized:
+            return quantized_scores(self.matrix, query, self.scales, rows)
+        matrix = self.matrix if rows is None else np.asarray(self.matrix[rows])
+        return matrix @ query.T if query.ndim == 2 else matrix @ query
+
+    def search(
+        self,
+        query_embedding,
+        top_k: int = 5,
+        exact: bool = False,
+        rows: Optional[np.ndarray] = None,
+        aggregation: str = "max",
+        weights=None,
+        query_text: Optional[str] = None,
+        fusion: str = "none",
+        sparse_candidates: int = 0,
+        mmr_lambda: Optional[float] = None,
+        mmr_pool: int = MMR_POOL,
+        **fusion_params
+    ) -> List[Dict]:
+        """
+        Return the `top_k` most similar chunks, best first.
+
+        `rows` restricts scoring to those (sorted) row ids, e.g. from
+        `filter_rows`. If the index has an ANN structure, only its candidate
+        rows are scored unless `exact` is True.
+
+        A 2-D `query_embedding` (one row per query vector) is scored in one
+        pass and aggregated per chunk with `aggregation` ("max" or "weighted"
+        with optional `weights`, see `aggregate_scores`).
+
+        With `query_text`, the dense scores are fused with BM25 scores
+        (`fusion` "rrf" or "linear", `fusion_params` passed to `fuse_scores`)
+        and results carry "bm25_score" and "fused_score"; "score" stays the
+        cosine similarity. `sparse_candidates` > 0 only scores the rows of
+        the best BM25 matches densely (together with the ANN candidates),
+        falling back to all rows if fewer than `top_k` match.
+
+        With `mmr_lambda`, the `top_k` results are picked by MMR (see
+        `mmr_select`) from the best `mmr_pool` chunks of the ranking.
+        """
+        if len(self) == 0 or (rows is not None and len(rows) == 0):
+            return []
+        query_embedding = np.asarray(query_embedding, dtype=np.float32)
+        if query_embedding.ndim == 2 and query_embedding.shape[0] == 1:
+            query_embedding = query_embedding[0]
+        # Rows ranked before the final selection (the MMR pool, if any)
+        n_ranked = top_k if mmr_lambda is None else max(top_k, mmr_pool)
+
+        use_sparse = query_text is not None and (fusion != "none" or sparse_candidates > 0)
+        sparse_scores = self.sparse_index().scores(query_text) if use_sparse else None
+        pruned = None
+        if use_sparse and sparse_candidates > 0:
+            matching = np.flatnonzero(sparse_scores)
+            if rows is not None:
+                matching = matching[np.isin(matching, rows, assume_unique=True)]
+            if len(matching) >= n_ranked:
+                pruned = np.sort(matching[top_k_indices(sparse_scores[matching], sparse_candidates)])
+
+        if self.ann is not None and not exact:
+            query = normalize_rows(query_embedding if query_embedding.ndim == 2 else np.ravel(query_embedding))
+            if query.shape[-1] == self.dim:
+                # Union of the candidates of every query vector; sorted row ids keep
+                # reads from the memory-mapped matrix sequential
+                if query.ndim == 2:
+                    candidates = np.unique(np.concatenate([self.ann.candidates(q, n_ranked) for q in query]))
+                else:
+                    candidates = np.sort(self.ann.candidates(query, n_ranked))
+                if rows is not None:
+                    candidates = candidates[np.isin(candidates, rows, assume_unique=True)]
+                if pruned is not None:
+                    pruned = np.union1d(pruned, candidates)
+                # Too few candidates survive the filter: score the filtered rows exhaustively
+                elif len(candidates) >= n_ranked or rows is None:
+                    rows = candidates
+        if pruned is not None:
+            rows = pruned
+        scores = self.score(query_embedding, rows)
+        if scores.ndim == 2:
+            scores = aggregate_scores(scores, aggregation, weights)
+        if use_sparse:
+            row_sparse = sparse_scores if rows is None else sparse_scores[rows]
+            # Rank fusion needs at least the ranked rows from each ranking
+            fusion_params["depth"] = max(fusion_params.get("depth", 100), n_ranked)
+            ranking = fuse_scores(scores, row_sparse, fusion, **fusion_params)
+        else:
+            ranking = scores
+
+        winners = top_k_indices(ranking, n_ranked)
+        if mmr_lambda is not None:
+            pool_rows = winners if rows is None else np.asarray(rows)[winners]
+            winners = winners[mmr_select(self.vectors(pool_rows), ranking[winners], top_k, mmr_lambda)]
+        row_ids = winners if rows is None else np.asarray(rows)[winners]
+        if not use_sparse:
+            return [self.record(row, score) for row, score in zip(row_ids, scores[winners])]
+
+        results = []
+        for position, row in zip(winners, row_ids):
+            result = self.record(row, scores[position])
+            result["bm25_score"] = float(row_sparse[position])
+            result["fused_score"] = float(ranking[position])
+            results.append(result)
+        return results
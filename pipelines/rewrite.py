@@ -4,11 +4,32 @@ Clinical case rewriting module for pipeline.
 
 This script exposes a function `rewrite_case_from_txt` that takes a TXT file
 with the patient case and a model name, and returns a rewritten case in
-guideline-style format.
+guideline-style format (`rewrite_case_text` does the same for a case text).
+
+Rewritten cases are persisted in a shared store (`.cache/rewritten_cases`)
+keyed by the SHA-256 of the case file, the rewrite model and the SHA-256 of
+`REWRITING_PROMPT`. All frameworks and the batch runner reuse the stored
+rewrite instead of calling the model again, so every configuration of a
+case sees the same rewritten text. Editing the case file or the prompt
+invalidates the entry.
+
+IMPORTANT:
+- The store contains patient case texts. Keep it local and delete it when
+  the data must not be retained.
+
+Usage (pre-rewrite a whole directory of cases in parallel):
+    python pipelines/rewrite.py --cases data/dummy_patients --model gpt-4o-mini
 """
 
 import os
 import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import concurrent.futures
+from typing import Dict, Optional
 
 # -----------------------------
 # Add the 'prompts' folder to sys.path
@@ -22,39 +43,157 @@ sys.path.append(prompts_dir)
 # -----------------------------
 from prompt_templates import REWRITING_PROMPT
 from chatgpt import chatgpt_chat_completion
+import tracing
+
+# -----------------------------
+# Rewritten-case store
+# -----------------------------
+REWRITE_STORE_DIR = os.environ.get(
+    "REWRITE_STORE_DIR",
+    os.path.abspath(os.path.join(current_dir, '..', '.cache', 'rewritten_cases'))
+)
+PROMPT_SHA256 = hashlib.sha256(REWRITING_PROMPT.encode("utf-8")).hexdigest()
+
+# Fixed pool of striped locks: concurrent callers with the same store key share
+# a lock and rewrite a case only once, while memory stays bounded in long runs
+KEY_LOCK_STRIPES = 64
+_key_locks = [threading.Lock() for _ in range(KEY_LOCK_STRIPES)]
+
+
+def rewrite_key(case_bytes: bytes, model: str) -> str:
+    """Store key of a case file's content for a rewrite model and the current prompt."""
+    source_sha256 = hashlib.sha256(case_bytes).hexdigest()
+    return hashlib.sha256(f"{source_sha256}\0{model}\0{PROMPT_SHA256}".encode("utf-8")).hexdigest()
+
+
+def load_rewritten_case(key: str, store_dir: str = REWRITE_STORE_DIR) -> Optional[str]:
+    """Return the stored rewritten case for `key`, or None if there is none."""
+    path = os.path.join(store_dir, f"{key}.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)["rewritten_case"]
+
+
+def save_rewritten_case(key: str, record: dict, store_dir: str = REWRITE_STORE_DIR) -> None:
+    """Write a store entry atomically (readers never see a partial file)."""
+    os.makedirs(store_dir, exist_ok=True)
+    path = os.path.join(store_dir, f"{key}.json")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(record, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _lock_for(key: str) -> threading.Lock:
+    # Keys are SHA-256 hex digests, so their leading digits are evenly spread
+    return _key_locks[int(key[:8], 16) % KEY_LOCK_STRIPES]
+
 
 # -----------------------------
 # Main function
 # -----------------------------
-def rewrite_case_from_txt(txt_path: str, model: str = "gpt-4o-mini") -> str:
+@tracing.traced()
+def rewrite_case_from_txt(txt_path: str, model: str = "gpt-4o-mini", use_store: bool = True) -> str:
     """
     Rewrites a patient case from a TXT file using a guideline-style prompt.
 
     Args:
         txt_path: path to the TXT file containing the original patient case.
         model: model name to use for ChatCompletion (default: "gpt-4o-mini").
+        use_store: reuse and persist the rewrite in the rewritten-case store.
 
     Returns:
         Rewritten patient case as a string.
     """
     # Load original case
-    with open(txt_path, 'r', encoding='utf-8') as f:
-        original_case = f.read().strip()
+    with open(txt_path, 'rb') as f:
+        case_bytes = f.read()
+    return _rewrite_case(case_bytes, model, use_store, source_path=os.path.abspath(txt_path))
+
 
-    # Format prompt
-    formatted_prompt = REWRITING_PROMPT.format(original_case=original_case)
+@tracing.traced()
+def rewrite_case_text(case_text: str, model: str = "gpt-4o-mini", use_store: bool = True) -> str:
+    """
+    Rewrites a patient case given as text (e.g. received by the tumor-board
+    service), sharing the rewritten-case store with `rewrite_case_from_txt`.
+    """
+    return _rewrite_case(case_text.encode('utf-8'), model, use_store, source_path=None)
+
+
+def _rewrite_case(case_bytes: bytes, model: str, use_store: bool, source_path: Optional[str]) -> str:
+    original_case = case_bytes.decode('utf-8').strip()
+    span = tracing.current_span()
+    span.set("model", model)
+
+    if not use_store:
+        return chatgpt_chat_completion(REWRITING_PROMPT.format(original_case=original_case), model=model)
 
-    # Run model
-    rewritten_case = chatgpt_chat_completion(formatted_prompt, model=model)
+    key = rewrite_key(case_bytes, model)
+    with _lock_for(key):
+        rewritten_case = load_rewritten_case(key)
+        span.set("store_hit", rewritten_case is not None)
+        if rewritten_case is not None:
+            return rewritten_case
+
+        # Format prompt
+        formatted_prompt = REWRITING_PROMPT.format(original_case=original_case)
+
+        # Run model
+        rewritten_case = chatgpt_chat_completion(formatted_prompt, model=model)
+
+        save_rewritten_case(key, {
+            "source_path": source_path,
+            "source_sha256": hashlib.sha256(case_bytes).hexdigest(),
+            "model": model,
+            "prompt_sha256": PROMPT_SHA256,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "rewritten_case": rewritten_case,
+        })
 
     return rewritten_case
 
 
+def rewrite_directory(cases_dir: str, model: str = "gpt-4o-mini", workers: int = 8) -> Dict[str, str]:
+    """
+    Rewrite every .txt case in `cases_dir` in parallel, filling the store.
+
+    Args:
+        cases_dir: directory of patient case TXT files.
+        model: rewrite model.
+        workers: number of concurrent rewrite requests.
+
+    Returns:
+        Mapping of case file path to rewritten case (cases that failed are
+        reported and left out).
+    """
+    case_paths = sorted(
+        os.path.join(cases_dir, f) for f in os.listdir(cases_dir) if f.endswith(".txt")
+    )
+    rewritten = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(rewrite_case_from_txt, path, model): path for path in case_paths}
+        for future in concurrent.futures.as_completed(futures):
+            path = futures[future]
+            try:
+                rewritten[path] = future.result()
+                print(f"[{len(rewritten)}/{len(case_paths)}] {os.path.basename(path)}")
+            except Exception as e:
+                print(f"ERROR rewriting {os.path.basename(path)}: {type(e).__name__}: {e}")
+    return rewritten
+
+
 # -----------------------------
-# Example usage
+# Main
 # -----------------------------
-# if __name__ == "__main__":
-#     case_txt_path = os.path.abspath(os.path.join(current_dir, '..', 'data', 'dummy_patients', 'example_case_de.txt'))
-#     rewritten = rewrite_case_from_txt(case_txt_path)
-#     print("=== Rewritten Case ===")
-#     print(rewritten)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-rewrite a directory of patient cases into the rewritten-case store.")
+    parser.add_argument("--cases", default=os.path.abspath(os.path.join(current_dir, '..', 'data', 'dummy_patients')),
+                        help="Directory of patient case .txt files.")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Rewrite model.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent rewrite requests.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rewritten = rewrite_directory(args.cases, model=args.model, workers=args.workers)
+    print(f"\nRewrote {len(rewritten)} case(s) in {time.perf_counter() - start:.1f}s. Store: {REWRITE_STORE_DIR}")
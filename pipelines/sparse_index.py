@@ -0,0 +1,197 @@
+"""
+BM25 inverted index over the guideline chunk texts.
+
+Dense retrieval can miss exact clinical tokens (TNM stages such as "cT3
+cN1", biomarkers such as "HER2" or "MSI-high", drug names). The sparse index
+scores them with BM25 and is fused with the dense scores in
+`CorpusIndex.search` (reciprocal rank fusion or a linear combination). On
+large corpora it can also prune the rows that are scored densely.
+
+Postings are stored in compressed sparse row layout: the postings of term
+`t` are `rows[offsets[t]:offsets[t + 1]]` with their term frequencies in
+`tfs`, so scoring a query only touches the postings of its terms. The index
+is built at compile time inside a compiled corpus store (see
+corpus_store.py) and memory-mapped when the store is opened; corpora loaded
+from JSON build it on the first hybrid query.
+
+Tokenization (German and English): lower-cased runs of letters (including
+umlauts and ß) and digits. Tokens joined by "-", "/" or "+" are kept as a
+whole ("msi-high", "5-fu", "pd-l1") and also split into their parts, so
+"cT3 cN1" gives "ct3", "cn1" and "HER2-positiv" gives "her2-positiv",
+"her2", "positiv". Single characters and common German/English stop words
+are dropped.
+"""
+
+import os
+import re
+import json
+import yaml
+import collections
+import numpy as np
+from typing import Iterable, List, Optional
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.abspath(os.path.join(current_dir, '..', 'config', 'hyperparameters.yaml'))
+
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    SPARSE_CONFIG = yaml.safe_load(f)["retrieval"].get("sparse", {})
+
+# Fusion of dense and BM25 scores in retrieval (see retrieval.fuse_scores)
+FUSION = SPARSE_CONFIG.get("fusion", "none")
+SPARSE_CANDIDATES = SPARSE_CONFIG.get("candidates", 0)
+FUSION_PARAMS = {
+    "rrf_k": SPARSE_CONFIG.get("rrf_k", 60),
+    "depth": SPARSE_CONFIG.get("depth", 100),
+    "dense_weight": SPARSE_CONFIG.get("dense_weight", 1.0),
+    "sparse_weight": SPARSE_CONFIG.get("sparse_weight", 1.0),
+}
+
+VOCAB_FILE = "bm25_vocab.json"
+OFFSETS_FILE = "bm25_offsets.npy"
+ROWS_FILE = "bm25_rows.npy"
+TFS_FILE = "bm25_tfs.npy"
+DOC_LENGTHS_FILE = "bm25_doc_lengths.npy"
+
+DEFAULT_K1 = SPARSE_CONFIG.get("k1", 1.2)
+DEFAULT_B = SPARSE_CONFIG.get("b", 0.75)
+
+_TOKEN_PATTERN = re.compile(r"[0-9a-zà-öø-ÿß]+(?:[-/+][0-9a-zà-öø-ÿß]+)*")
+_PART_SEPARATOR = re.compile(r"[-/+]")
+
+STOP_WORDS = frozenset("""
+der die das den dem des ein eine einer eines einem einen und oder aber mit ohne bei von vom zu zur zum
+im in ins an am auf aus für über unter nach vor durch als wie auch nicht kein keine ist sind war waren
+wird werden wurde wurden kann können soll sollte sollen sollten sich es sie er wir ihr so da dass
+nur noch bzw ggf sowie mehr sehr
+the a an and or but with without at by of from to in into on for over under after before through
+as like also not no is are was were be been being can could should shall will would may might it its
+this that these those which who whom than then there their they we you he she
+""".split())
+
+
+# ------------------------------------------------------------------
+# Tokenization
+# ------------------------------------------------------------------
+def tokenize(text: str) -> List[str]:
+    """Split German/English clinical text into index terms (see module docstring)."""
+    terms = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if len(token) > 1 and token not in STOP_WORDS:
+            terms.append(token)
+        if _PART_SEPARATOR.search(token):
+            terms.extend(part for part in _PART_SEPARATOR.split(token)
+                         if len(part) > 1 and part not in STOP_WORDS)
+    return terms
+
+
+# ------------------------------------------------------------------
+# BM25 index
+# ------------------------------------------------------------------
+class SparseIndex:
+    """
+    BM25 index with postings in CSR layout (`offsets`, `rows`, `tfs`) and
+    one length per chunk (`doc_lengths`), plus the term -> id vocabulary.
+    """
+
+    def __init__(
+        self,
+        vocabulary: dict,
+        offsets: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = DEFAULT_K1,
+        b: float = DEFAULT_B
+    ):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        n_docs = len(doc_lengths)
+        self.avg_doc_length = float(np.mean(doc_lengths)) if n_docs else 0.0
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p((n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.vocabulary)
+
+    @classmethod
+    def build(cls, texts: Iterable[str], k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> "SparseIndex":
+        """Tokenize every chunk text and build the postings arrays."""
+        vocabulary = {}
+        term_ids, doc_rows, counts, doc_lengths = [], [], [], []
+        for row, text in enumerate(texts):
+            terms = tokenize(text or "")
+            doc_lengths.append(len(terms))
+            for term, count in collections.Counter(terms).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_rows.append(row)
+                counts.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        # Stable sort keeps the rows of each posting list in ascending order
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(
+            vocabulary,
+            offsets,
+            np.asarray(doc_rows, dtype=np.int32)[order],
+            np.minimum(np.asarray(counts, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)[order],
+            np.asarray(doc_lengths, dtype=np.float32),
+            k1=k1,
+            b=b
+        )
+
+    def scores(self, query_text: str) -> np.ndarray:
+        """BM25 score of every chunk for `query_text` (0 for chunks without a query term)."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.avg_doc_length, 1e-9))
+        for term in set(tokenize(query_text)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.rows[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            # Rows are unique within a posting list, so fancy-index addition is safe
+            scores[rows] += self.idf[term_id] * tfs * (self.k1 + 1) / (tfs + length_norm[rows])
+        return scores
+
+    def save(self, store_dir: str) -> None:
+        terms = [None] * len(self.vocabulary)
+        for term, term_id in self.vocabulary.items():
+            terms[term_id] = term
+        with open(os.path.join(store_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(terms, f, ensure_ascii=False)
+        np.save(os.path.join(store_dir, OFFSETS_FILE), self.offsets)
+        np.save(os.path.join(store_dir, ROWS_FILE), self.rows)
+        np.save(os.path.join(store_dir, TFS_FILE), self.tfs)
+        np.save(os.path.join(store_dir, DOC_LENGTHS_FILE), self.doc_lengths)
+
+    @classmethod
+    def load(cls, store_dir: str, k1: float = DEFAULT_K1, b: float = DEFAULT_B) -> Optional["SparseIndex"]:
+        """Open the index saved in a compiled store (postings memory-mapped), or None if there is none."""
+        vocab_path = os.path.join(store_dir, VOCAB_FILE)
+        if not os.path.exists(vocab_path):
+            return None
+        with open(vocab_path, "r", encoding="utf-8") as f:
+            vocabulary = {term: term_id for term_id, term in enumerate(json.load(f))}
+        return cls(
+            vocabulary,
+            np.load(os.path.join(store_dir, OFFSETS_FILE)),
+            np.load(os.path.join(store_dir, ROWS_FILE), mmap_mode="r"),
+            np.load(os.path.join(store_dir, TFS_FILE), mmap_mode="r"),
+            np.load(os.path.join(store_dir, DOC_LENGTHS_FILE)),
+            k1=k1,
+            b=b
+        )
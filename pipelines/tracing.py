@@ -0,0 +1,302 @@
+"""
+Lightweight per-stage tracing for the RAG pipeline.
+
+Spans are opened around the pipeline stages (corpus loading, resource
+loading, query embedding, retrieval, prompt formatting, rewriting and the
+OpenAI calls) and record their duration, nesting and attributes such as
+token usage and cache hits. Tracing is off unless an export file is set:
+
+- `TRACE_EXPORT=trace.jsonl`: one JSON line per finished span,
+- `TRACE_FORMAT=otlp`: OpenTelemetry OTLP/JSON (`resourceSpans`) written when
+  the process exits, importable by OpenTelemetry collectors and viewers.
+
+Spans nest across threads started with `asyncio.to_thread` and across
+asyncio tasks (context variables). Summarize an exported trace per stage:
+    python pipelines/tracing.py trace.jsonl
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import secrets
+import inspect
+import collections
+import argparse
+import threading
+import functools
+import contextlib
+import contextvars
+from typing import Dict, List, Optional
+
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT")
+TRACE_FORMAT = os.environ.get("TRACE_FORMAT", "jsonl")
+TRACE_FORMATS = ("jsonl", "otlp")
+SERVICE_NAME = "gi-rag-tumor-board"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+# ------------------------------------------------------------------
+# Spans
+# ------------------------------------------------------------------
+class Span:
+    """One timed stage with its parent, attributes and status."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes", "error", "_start_perf")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._start_perf = time.perf_counter_ns()
+        self.attributes = dict(attributes)
+        self.error = None
+
+    def set(self, key: str, value) -> None:
+        """Set an attribute (None values are ignored)."""
+        if value is not None:
+            self.attributes[key] = value
+
+    def end(self) -> None:
+        # Wall-clock start, monotonic duration
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._start_perf)
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def to_record(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_unix_ns": self.start_ns,
+            "duration_ms": self.duration_ms,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NullSpan:
+    """Span used while tracing is disabled; attributes are discarded."""
+
+    def set(self, key: str, value) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# ------------------------------------------------------------------
+# Export
+# ------------------------------------------------------------------
+# Finished spans kept in memory for `finished_spans()` with JSON lines export
+# (OTLP keeps all of them until they are written at exit)
+MAX_KEPT_SPANS = 10000
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(records: List[Dict]) -> Dict:
+    """Convert span records to an OTLP/JSON `ExportTraceServiceRequest`."""
+    spans = []
+    for record in records:
+        span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(record["start_unix_ns"]),
+            "endTimeUnixNano": str(record["start_unix_ns"] + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in record["attributes"].items()],
+            "status": {"code": 2, "message": record["error"]} if record["error"] else {"code": 1},
+        }
+        if record["parent_id"]:
+            span["parentSpanId"] = record["parent_id"]
+        spans.append(span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+    }]}
+
+
+class _Exporter:
+    """Appends span records as JSON lines, or collects them for one OTLP file at exit."""
+
+    def __init__(self, path: str, fmt: str):
+        if fmt not in TRACE_FORMATS:
+            raise ValueError(f"Invalid trace format: {fmt}. Must be one of: {', '.join(TRACE_FORMATS)}")
+        self.path = path
+        self.fmt = fmt
+        self.records = collections.deque(maxlen=None if fmt == "otlp" else MAX_KEPT_SPANS)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def export(self, span: Span) -> None:
+        record = span.to_record()
+        with self._lock:
+            self.records.append(record)
+            if self.fmt == "jsonl":
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def flush(self) -> None:
+        if self.fmt != "otlp":
+            return
+        with self._lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(to_otlp(self.records), f, default=str)
+
+
+_exporter: Optional[_Exporter] = None
+
+
+def configure(path: Optional[str], fmt: str = "jsonl") -> None:
+    """Enable tracing to `path` in `fmt` ("jsonl" or "otlp"), or disable it with None."""
+    global _exporter
+    if _exporter is not None:
+        _exporter.flush()
+    _exporter = _Exporter(path, fmt) if path else None
+
+
+def is_enabled() -> bool:
+    return _exporter is not None
+
+
+def flush() -> None:
+    """Write pending spans (OTLP format only writes on flush or exit)."""
+    if _exporter is not None:
+        _exporter.flush()
+
+
+def finished_spans() -> List[Dict]:
+    """Records of the spans finished since tracing was configured (the latest ones for JSON lines)."""
+    return list(_exporter.records) if _exporter is not None else []
+
+
+if TRACE_EXPORT:
+    configure(TRACE_EXPORT, TRACE_FORMAT)
+atexit.register(flush)
+
+
+# ------------------------------------------------------------------
+# Instrumentation API
+# ------------------------------------------------------------------
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """
+    Time the enclosed block as a span named `name`.
+
+    Yields the span so attributes can be added with `span.set(key, value)`;
+    exceptions are recorded on the span and re-raised.
+    """
+    if _exporter is None:
+        yield _NULL_SPAN
+        return
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end()
+        _current_span.reset(token)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(current)
+
+
+def current_span():
+    """The innermost active span, or a no-op span if there is none."""
+    return _current_span.get() or _NULL_SPAN
+
+
+def traced(name: Optional[str] = None):
+    """Decorator that runs a (sync or async) function inside a span."""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ------------------------------------------------------------------
+# Summary
+# ------------------------------------------------------------------
+def load_records(path: str) -> List[Dict]:
+    """Read span records from a JSON lines or OTLP/JSON trace file."""
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if content.lstrip().startswith('{"resourceSpans"'):
+        records = []
+        for resource in json.loads(content)["resourceSpans"]:
+            for scope in resource["scopeSpans"]:
+                for otlp_span in scope["spans"]:
+                    start, end = int(otlp_span["startTimeUnixNano"]), int(otlp_span["endTimeUnixNano"])
+                    records.append({"name": otlp_span["name"], "duration_ms": (end - start) / 1e6,
+                                    "error": otlp_span["status"].get("message")})
+        return records
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def summarize_stages(records: List[Dict]) -> Dict[str, Dict]:
+    """Count, errors and total/mean/p50/p95/max duration in ms per span name."""
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record["name"], []).append(record)
+    summary = {}
+    for name, group in by_name.items():
+        durations = sorted(record["duration_ms"] for record in group)
+        summary[name] = {
+            "count": len(durations),
+            "errors": sum(1 for record in group if record.get("error")),
+            "total_ms": sum(durations),
+            "mean_ms": sum(durations) / len(durations),
+            "p50_ms": durations[len(durations) // 2],
+            "p95_ms": durations[min(len(durations) - 1, int(0.95 * len(durations)))],
+            "max_ms": durations[-1],
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-stage summary of an exported trace.")
+    parser.add_argument("trace_path", help="Trace file written with TRACE_EXPORT (JSON lines or OTLP/JSON).")
+    args = parser.parse_args()
+
+    summary = summarize_stages(load_records(args.trace_path))
+    if not summary:
+        print("No spans found.")
+        sys.exit(0)
+    print(f"{'stage':<32} {'count':>6} {'errors':>6} {'total ms':>11} {'mean ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for name, stats in sorted(summary.items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"{name:<32} {stats['count']:>6} {stats['errors']:>6} {stats['total_ms']:>11.1f} "
+              f"{stats['mean_ms']:>10.1f} {stats['p95_ms']:>10.1f} {stats['max_ms']:>10.1f}")
@@ -0,0 +1,366 @@
+"""
+Long-running tumor-board service with a warm embedding model and guideline indexes.
+
+The framework scripts are one-shot programs that load the embedding model and
+the guideline corpora for a single case entered through `input()` prompts.
+This service loads everything once at startup:
+- the embedding model (bge-m3), the query embedding cache and the tokenizer,
+- the compiled guideline library (all organs, filtered per request) or, if it
+  has not been compiled, one index per organ from the guideline JSON files,
+  plus the default corpus; their BM25 indexes are built up front,
+and then answers JSON requests over HTTP, one thread per request:
+
+    GET  /health      loaded indexes and request counters
+    POST /simple      {"case_text", "model", "rewrite"}
+    POST /assistant   {"case_text", "rewrite", "rewrite_model"}
+    POST /rag         {"case_text", "model", "rewrite", "organ", "selected_only", "top_k"}
+
+`case_text` is required; `model` is "gpt-4o-mini" (default) or "gpt-4o";
+`rewrite` rewrites the case first (through the rewritten-case store of
+rewrite.py). Embedding runs one request at a time (the model is CPU-bound);
+LLM calls run in parallel up to `--max-concurrency`.
+
+Unexpected failures return 500 with {"error": "internal error", "request_id"};
+the traceback is written to stderr (and the trace, if enabled) under that id,
+which is the trace id when tracing is on.
+
+Usage:
+    python pipelines/tumor_board_service.py --port 8080
+    curl -s localhost:8080/rag -d '{"case_text": "...", "organ": "gastric", "selected_only": true}'
+
+IMPORTANT:
+- Requests carry patient data and the service has no authentication. It
+  binds to 127.0.0.1 by default; keep it on a trusted host.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import secrets
+import threading
+import traceback
+import yaml
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+# ------------------------------------------------------------------
+# Path setup: allow imports from parallel folders
+# ------------------------------------------------------------------
+current_dir = os.path.dirname(os.path.abspath(__file__))
+prompts_dir = os.path.abspath(os.path.join(current_dir, '..', 'prompts'))
+sys.path.append(prompts_dir)
+
+# ------------------------------------------------------------------
+# Imports
+# ------------------------------------------------------------------
+from prompt_templates import CONTEXT_TOKEN_BUDGET, count_tokens, get_prompt_for_configuration
+from chatgpt import chatgpt_assistant, chatgpt_chat_completion, get_latency_stats
+from embeddings import get_embed_model
+from query_vectors import QUERY_MODE, embed_query
+from retrieval import CorpusIndex
+from sparse_index import FUSION, SPARSE_CANDIDATES
+import tracing
+from rewrite import rewrite_case_text
+from corpus_store import ORGANS, MANIFEST_FILE, load_compiled_corpus
+from framework_3_RAG import LIBRARY_STORE, TOP_K, dummy_corpora_dir, load_guideline_index, retrieve_top_k_chunks
+
+# ------------------------------------------------------------------
+# Configuration
+# ------------------------------------------------------------------
+CONFIG_PATH = os.path.abspath(os.path.join(current_dir, '..', 'config', 'hyperparameters.yaml'))
+
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    SERVICE_CONFIG = yaml.safe_load(f).get("service", {})
+
+HOST = SERVICE_CONFIG.get("host", "127.0.0.1")
+PORT = SERVICE_CONFIG.get("port", 8080)
+MAX_CONCURRENCY = SERVICE_CONFIG.get("max_concurrency", 8)
+MAX_REQUEST_BYTES = SERVICE_CONFIG.get("max_request_bytes", 1 << 20)
+
+DEFAULT_CORPUS = os.path.join(dummy_corpora_dir, 'dummy_guidelines_with_embeddings.json')
+
+MODELS = ("gpt-4o-mini", "gpt-4o")
+MAX_TOP_K = 50
+
+
+class RequestError(ValueError):
+    """Invalid request (answered with HTTP 400)."""
+
+
+# ------------------------------------------------------------------
+# Service
+# ------------------------------------------------------------------
+class TumorBoardService:
+    """
+    Warm resources shared by all requests.
+
+    Attributes:
+        library: compiled guideline library (all organs), if it exists
+        organ_indexes: per-organ indexes from JSON files (without a library)
+        default_index: default corpus, used when a request names no organ
+    """
+
+    def __init__(self, default_corpus: str = DEFAULT_CORPUS, max_concurrency: int = MAX_CONCURRENCY):
+        self.default_corpus = default_corpus
+        self.library: Optional[CorpusIndex] = None
+        self.organ_indexes: Dict[str, CorpusIndex] = {}
+        self.default_index: Optional[CorpusIndex] = None
+        self._llm_slots = threading.BoundedSemaphore(max_concurrency)
+        self._embed_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.started = time.time()
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+
+    def warm(self) -> None:
+        """Load the embedding model, tokenizer and every guideline index."""
+        with tracing.span("service.warm") as span:
+            start = time.perf_counter()
+            # First call also initializes the model's inference path
+            get_embed_model().get_text_embedding("warm-up")
+            if CONTEXT_TOKEN_BUDGET is not None:
+                count_tokens("warm-up")
+
+            if os.path.exists(os.path.join(LIBRARY_STORE, MANIFEST_FILE)):
+                self.library = load_compiled_corpus(LIBRARY_STORE)
+            else:
+                for organ in ORGANS:
+                    paths = sorted(
+                        os.path.join(dummy_corpora_dir, f) for f in os.listdir(dummy_corpora_dir)
+                        if f.endswith(".json") and organ in f
+                    )
+                    if paths:
+                        self.organ_indexes[organ] = load_guideline_index(paths)
+            self.default_index = load_guideline_index([self.default_corpus])
+
+            if FUSION != "none" or SPARSE_CANDIDATES > 0:
+                for index in self.indexes().values():
+                    index.sparse_index()
+            span.set("indexes", len(self.indexes()))
+            print(f"Warmed up in {time.perf_counter() - start:.1f}s: " + ", ".join(
+                f"{name} ({len(index)} chunks)" for name, index in self.indexes().items()))
+
+    def indexes(self) -> Dict[str, CorpusIndex]:
+        indexes = {"default": self.default_index}
+        if self.library is not None:
+            indexes["library"] = self.library
+        indexes.update(self.organ_indexes)
+        return {name: index for name, index in indexes.items() if index is not None}
+
+    def corpus_for(self, organ: Optional[str]) -> Tuple[CorpusIndex, Optional[str]]:
+        """Index to search and organ filter for a request."""
+        if organ is None:
+            return self.default_index, None
+        if organ not in ORGANS:
+            raise RequestError(f"Invalid organ: {organ}. Must be one of: {', '.join(ORGANS)}")
+        if self.library is not None:
+            if self.library.filter_rows(organ=organ).size == 0:
+                raise RequestError(f"No chunks for organ '{organ}' in the guideline library.")
+            return self.library, organ
+        if organ not in self.organ_indexes:
+            raise RequestError(f"No guideline corpus loaded for organ '{organ}'.")
+        return self.organ_indexes[organ], None
+
+    def count(self, endpoint: str, ok: bool) -> None:
+        with self._stats_lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.errors += not ok
+
+    # --------------------------------------------------------------
+    # Stages
+    # --------------------------------------------------------------
+    def _llm(self, func, *args, **kwargs):
+        with self._llm_slots:
+            return func(*args, **kwargs)
+
+    def case_text(self, request: Dict, model: str) -> str:
+        case_text = request.get("case_text")
+        if not isinstance(case_text, str) or not case_text.strip():
+            raise RequestError("'case_text' must be a non-empty string.")
+        if request.get("rewrite"):
+            rewrite_model = _model(request.get("rewrite_model", model))
+            return self._llm(rewrite_case_text, case_text, model=rewrite_model)
+        return case_text.strip()
+
+    def query_embedding(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        with self._embed_lock:
+            return embed_query(text, QUERY_MODE)
+
+    # --------------------------------------------------------------
+    # Endpoints
+    # --------------------------------------------------------------
+    def simple(self, request: Dict) -> Dict:
+        model = _model(request.get("model"))
+        case_text = self.case_text(request, model)
+        prompt = get_prompt_for_configuration(case_text, "simple")
+        return {"config_type": "simple", "model": model,
+                "response": self._llm(chatgpt_chat_completion, prompt, model)}
+
+    def assistant(self, request: Dict) -> Dict:
+        case_text = self.case_text(request, _model(request.get("rewrite_model")))
+        prompt = get_prompt_for_configuration(case_text, "assistant")
+        return {"config_type": "assistant", "response": self._llm(chatgpt_assistant, prompt)}
+
+    def rag(self, request: Dict) -> Dict:
+        model = _model(request.get("model"))
+        top_k = request.get("top_k", TOP_K)
+        if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_TOP_K:
+            raise RequestError(f"'top_k' must be an integer between 1 and {MAX_TOP_K}.")
+        selected_only = bool(request.get("selected_only", False))
+        corpus_index, organ = self.corpus_for(request.get("organ"))
+        config_type = "rag_selected" if selected_only else "rag_full"
+        timings = {}
+
+        start = time.perf_counter()
+        case_text = self.case_text(request, model)
+        timings["case_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        query_embedding, query_weights = self.query_embedding(case_text)
+        timings["embed_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows = corpus_index.filter_rows(organ=organ, selected_only=selected_only)
+        retrieved_chunks = retrieve_top_k_chunks(query_embedding, corpus_index, top_k=top_k, rows=rows,
+                                                 weights=query_weights, query_text=case_text)
+        prompt = get_prompt_for_configuration(case_text, config_type, retrieved_chunks=retrieved_chunks,
+                                              context_token_budget=CONTEXT_TOKEN_BUDGET)
+        timings["retrieve_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = self._llm(chatgpt_chat_completion, prompt, model)
+        timings["llm_s"] = time.perf_counter() - start
+        return {
+            "config_type": config_type,
+            "model": model,
+            "organ": organ,
+            "response": response,
+            "retrieved_chunks": [
+                {key: chunk[key] for key in ("chunk_id", "source", "score", "bm25_score") if key in chunk}
+                for chunk in retrieved_chunks
+            ],
+            "timings": timings,
+        }
+
+    def health(self) -> Dict:
+        with self._stats_lock:
+            requests, errors = dict(self.requests), self.errors
+        return {
+            "status": "ok",
+            "uptime_s": time.time() - self.started,
+            "indexes": {name: len(index) for name, index in self.indexes().items()},
+            "requests": requests,
+            "errors": errors,
+            "api_latency": get_latency_stats(),
+        }
+
+
+def _model(model: Optional[str]) -> str:
+    model = model or MODELS[0]
+    if model not in MODELS:
+        raise RequestError(f"Invalid model: {model}. Must be one of: {', '.join(MODELS)}")
+    return model
+
+
+# ------------------------------------------------------------------
+# HTTP
+# ------------------------------------------------------------------
+ENDPOINTS = {
+    "/simple": TumorBoardService.simple,
+    "/assistant": TumorBoardService.assistant,
+    "/rag": TumorBoardService.rag,
+}
+
+
+class TumorBoardHandler(BaseHTTPRequestHandler):
+    """JSON request handler; the service is shared through the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, payload: Dict) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.server.service.health())
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint: GET {self.path}"})
+
+    def do_POST(self):
+        endpoint = ENDPOINTS.get(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        if endpoint is None or length > MAX_REQUEST_BYTES:
+            # Drain the body so the connection stays usable
+            self.rfile.read(min(length, MAX_REQUEST_BYTES))
+            self.close_connection = length > MAX_REQUEST_BYTES
+            if endpoint is None:
+                self._send_json(404, {"error": f"Unknown endpoint: POST {self.path}"})
+            else:
+                self._send_json(413, {"error": f"Request larger than {MAX_REQUEST_BYTES} bytes."})
+            return
+
+        service = self.server.service
+        start = time.perf_counter()
+        with tracing.span("service_request", endpoint=self.path) as span:
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise RequestError("The request body must be a JSON object.")
+                result = endpoint(service, request)
+                status = 200
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                result, status = {"error": f"Invalid JSON: {e}"}, 400
+            except RequestError as e:
+                result, status = {"error": str(e)}, 400
+            except Exception as e:
+                # Details stay in the server log and the trace; the client only gets an id to quote
+                request_id = getattr(span, "trace_id", None) or secrets.token_hex(16)
+                span.set("error", f"{type(e).__name__}: {e}")
+                span.set("request_id", request_id)
+                print(f"ERROR: Request {request_id} (POST {self.path}) failed:\n{traceback.format_exc()}",
+                      file=sys.stderr)
+                result, status = {"error": "internal error", "request_id": request_id}, 500
+            result["latency_s"] = time.perf_counter() - start
+            span.set("status", status)
+        service.count(self.path, ok=status == 200)
+        self._send_json(status, result)
+
+
+def make_server(service: TumorBoardService, host: str = HOST, port: int = PORT) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), TumorBoardHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+# ------------------------------------------------------------------
+# Main
+# ------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the tumor-board configurations over a local HTTP API.")
+    parser.add_argument("--host", default=HOST, help="Interface to bind (default: local only).")
+    parser.add_argument("--port", type=int, default=PORT, help="Port to listen on.")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY, help="Maximum parallel LLM calls.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS,
+                        help="Default guideline corpus JSON file with embeddings (used when no organ is given).")
+    args = parser.parse_args()
+
+    service = TumorBoardService(default_corpus=args.corpus, max_concurrency=args.max_concurrency)
+    service.warm()
+    server = make_server(service, args.host, args.port)
+    print(f"Tumor-board service listening on http://{args.host}:{args.port} "
+          f"(endpoints: GET /health, POST {', POST '.join(ENDPOINTS)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        server.server_close()
@@ -11,8 +11,22 @@ IMPORTANT:
 - This code is intended for research purposes only.
 """
 
+import os
+import sys
 import time
-from openai import OpenAI
+import random
+import asyncio
+import threading
+import contextlib
+import weakref
+
+# Add the parallel 'pipelines' folder to sys.path for the resource registry
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(current_dir, '..', 'pipelines')))
+
+import resources
+import tracing
+from response_cache import CacheMissError, ResponseCache
 
 # =============================================================================
 # CLIENT INITIALIZATION
@@ -21,14 +35,266 @@ from openai import OpenAI
 # Insert your OpenAI project API key here or load it from environment variables
 API_KEY_PROJECT = "YOUR PROJECT API KEY"
 
-# Initialize OpenAI client
-client = OpenAI(api_key=API_KEY_PROJECT)
+# Optional OpenAI-compatible endpoint (e.g. a local stand-in server); None uses api.openai.com
+API_BASE_URL = os.environ.get("OPENAI_BASE_URL")
+
+# Request timeout and retry policy (exponential backoff with full jitter)
+REQUEST_TIMEOUT = 120.0
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Maximum number of concurrent requests of the async API (per event loop)
+MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", "8"))
+
+# Insert your Assistant ID here
+ASSISTANT_ID = "YOUR ASSISTANT ID"
+
+# Assistant runs: stream run events (polling with adaptive backoff otherwise) and give up after the deadline
+ASSISTANT_STREAM = os.environ.get("OPENAI_ASSISTANT_STREAM", "1") != "0"
+ASSISTANT_TIMEOUT = float(os.environ.get("OPENAI_ASSISTANT_TIMEOUT", "600"))
+POLL_INITIAL = 0.25
+POLL_MAX = 5.0
+POLL_FACTOR = 1.5
+
+# LLM response cache: "off", "record" or "replay" (see response_cache.py)
+LLM_CACHE_MODE = os.environ.get("LLM_CACHE_MODE", "off")
+LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH",
+    os.path.abspath(os.path.join(current_dir, '..', '.cache', 'llm_responses.sqlite'))
+)
+LLM_CACHE_MAX_AGE_DAYS = float(os.environ["LLM_CACHE_MAX_AGE_DAYS"]) if "LLM_CACHE_MAX_AGE_DAYS" in os.environ else None
+LLM_CACHE_MAX_ENTRIES = int(os.environ["LLM_CACHE_MAX_ENTRIES"]) if "LLM_CACHE_MAX_ENTRIES" in os.environ else None
+
+
+def _create_client():
+    from openai import OpenAI
+    return OpenAI(api_key=API_KEY_PROJECT, base_url=API_BASE_URL, timeout=REQUEST_TIMEOUT)
+
+
+# The OpenAI client is created on first use, not at import time
+resources.register("openai_client", _create_client)
+
+
+def get_client():
+    """Return the shared OpenAI client, creating it on first use."""
+    return resources.get("openai_client")
+
+
+def _open_response_cache():
+    return ResponseCache(
+        LLM_CACHE_PATH,
+        mode=LLM_CACHE_MODE,
+        max_age_days=LLM_CACHE_MAX_AGE_DAYS,
+        max_entries=LLM_CACHE_MAX_ENTRIES
+    )
+
+
+resources.register("llm_response_cache", _open_response_cache)
+
+
+def get_response_cache():
+    """Return the LLM response cache, or None if caching is off."""
+    if LLM_CACHE_MODE == "off":
+        return None
+    return resources.get("llm_response_cache")
+
+
+class _AsyncPool:
+    """Async client with a shared HTTP connection pool and a concurrency semaphore."""
+
+    def __init__(self, max_concurrency: int):
+        import httpx
+        from openai import AsyncOpenAI
+
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = AsyncOpenAI(
+            api_key=API_KEY_PROJECT,
+            base_url=API_BASE_URL,
+            max_retries=0,  # retries are handled by _retry_delay below
+            http_client=httpx.AsyncClient(
+                timeout=REQUEST_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=max_concurrency,
+                    max_keepalive_connections=max_concurrency
+                )
+            )
+        )
+
+
+# asyncio primitives and HTTP pools are bound to an event loop, so one pool per loop
+_async_pools = weakref.WeakKeyDictionary()
+
+
+def get_async_pool() -> _AsyncPool:
+    """Return the async client pool of the running event loop, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    if loop not in _async_pools:
+        _async_pools[loop] = _AsyncPool(MAX_CONCURRENCY)
+    return _async_pools[loop]
+
+
+# =============================================================================
+# RETRIES AND LATENCY STATISTICS
+# =============================================================================
+
+class LatencyStats:
+    """Thread-safe per-request latency and retry counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.retries = 0
+
+    def record(self, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            self.latencies.append(seconds)
+            if not ok:
+                self.errors += 1
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def summary(self) -> dict:
+        """Request count, errors, retries and latency percentiles in seconds."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            summary = {"requests": len(latencies), "errors": self.errors, "retries": self.retries}
+        if latencies:
+            summary.update({
+                "mean_s": sum(latencies) / len(latencies),
+                "p50_s": latencies[len(latencies) // 2],
+                "p95_s": latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+                "max_s": latencies[-1],
+            })
+        return summary
+
+
+latency_stats = LatencyStats()
+assistant_stats = LatencyStats()
+
+
+def get_latency_stats() -> dict:
+    """Latency summary of all API requests made by this process."""
+    return latency_stats.summary()
+
+
+def get_assistant_stats() -> dict:
+    """Latency summary of complete Assistant runs (create to final message)."""
+    return assistant_stats.summary()
+
+
+def _retry_delay(error: Exception, attempt: int):
+    """
+    Seconds to wait before retrying after `error`, or None if it is not retryable.
+
+    Rate limits (429), server errors (5xx), timeouts and connection errors
+    are retried with exponential backoff and full jitter; a Retry-After
+    header from the server takes precedence.
+    """
+    import openai
+
+    if attempt >= MAX_RETRIES:
+        return None
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code != 429 and error.status_code < 500:
+            return None
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+    elif not isinstance(error, openai.APIConnectionError):
+        return None
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _with_retries(func, **kwargs):
+    """Call `func(**kwargs)`, retrying per `_retry_delay` and recording latencies."""
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            result = func(**kwargs)
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            latency_stats.record(time.perf_counter() - start, ok=False)
+            if delay is None:
+                raise
+            latency_stats.record_retry()
+            tracing.current_span().set("retries", attempt + 1)
+            time.sleep(delay)
+            attempt += 1
+            continue
+        latency_stats.record(time.perf_counter() - start)
+        return result
+
+
+async def _awith_retries(func, semaphore=None, **kwargs):
+    """
+    Async version of `_with_retries`. If `semaphore` is given, each attempt
+    holds it and the backoff happens outside, so other requests can proceed.
+    """
+    attempt = 0
+    while True:
+        async with semaphore or contextlib.nullcontext():
+            start = time.perf_counter()
+            try:
+                result = await func(**kwargs)
+            except Exception as e:
+                delay = _retry_delay(e, attempt)
+                latency_stats.record(time.perf_counter() - start, ok=False)
+                if delay is None:
+                    raise
+            else:
+                latency_stats.record(time.perf_counter() - start)
+                return result
+        latency_stats.record_retry()
+        tracing.current_span().set("retries", attempt + 1)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def _trace_cache_lookup(cache, request: dict):
+    """Look up `request` in the response cache and record the hit on the current span."""
+    cached = cache.get(request)
+    tracing.current_span().set("cache_hit", cached is not None)
+    return cached
+
+
+def _trace_usage(usage) -> None:
+    """Record token usage of an API response (or completed run) on the current span."""
+    if usage is None:
+        return
+    span = tracing.current_span()
+    span.set("prompt_tokens", usage.prompt_tokens)
+    span.set("completion_tokens", usage.completion_tokens)
+    span.set("total_tokens", usage.total_tokens)
 
 
 # =============================================================================
 # CHAT COMPLETION (STANDARD CHAT API)
 # =============================================================================
 
+def _chat_request(prompt_text: str, model: str) -> dict:
+    """Request parameters shared by the sync and async chat completion calls."""
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": prompt_text,
+            }
+        ],
+        "temperature": 0.8,
+        "top_p": 1.0,
+    }
+
+
+@tracing.traced()
 def chatgpt_chat_completion(prompt_text: str, model: str) -> str:
     """
     Send a single-turn prompt to an OpenAI chat completion model.
@@ -38,6 +304,10 @@ def chatgpt_chat_completion(prompt_text: str, model: str) -> str:
     - Custom RAG configurations where retrieved context
       is injected directly into the prompt
 
+    Rate-limit, server and connection errors are retried with
+    exponential backoff (see `_retry_delay`). Responses are served from
+    and stored in the response cache according to `LLM_CACHE_MODE`.
+
     Parameters
     ----------
     prompt_text : str
@@ -51,27 +321,150 @@ def chatgpt_chat_completion(prompt_text: str, model: str) -> str:
         Model-generated response text.
     """
 
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {
-                "role": "user",
-                "content": prompt_text,
-            }
-        ],
-        temperature=0.8,
-        top_p=1.0,
-    )
+    request = _chat_request(prompt_text, model)
+    tracing.current_span().set("model", model)
+    cache = get_response_cache()
+    if cache is not None:
+        cached = _trace_cache_lookup(cache, request)
+        if cached is not None:
+            return cached
+
+    client = get_client().with_options(max_retries=0)
+    response = _with_retries(client.chat.completions.create, **request)
+    _trace_usage(response.usage)
 
     # Extract and return the assistant's response text
-    return response.choices[0].message.content.strip()
+    response_text = response.choices[0].message.content.strip()
+    if cache is not None:
+        cache.put(request, response_text)
+    return response_text
+
+
+@tracing.traced()
+async def achatgpt_chat_completion(prompt_text: str, model: str) -> str:
+    """
+    Async version of `chatgpt_chat_completion`.
+
+    Requests share one HTTP connection pool per event loop and at most
+    `MAX_CONCURRENCY` of them are in flight at the same time; the retry
+    policy and response cache are the same as for the sync call.
+
+    Parameters
+    ----------
+    prompt_text : str
+        Fully formatted prompt string sent to the model.
+    model : str
+        Model identifier (e.g. "gpt-4o-mini" or "gpt-4o").
+
+    Returns
+    -------
+    str
+        Model-generated response text.
+    """
+
+    request = _chat_request(prompt_text, model)
+    tracing.current_span().set("model", model)
+    cache = get_response_cache()
+    if cache is not None:
+        cached = _trace_cache_lookup(cache, request)
+        if cached is not None:
+            return cached
+
+    pool = get_async_pool()
+    response = await _awith_retries(pool.client.chat.completions.create, semaphore=pool.semaphore, **request)
+    _trace_usage(response.usage)
+
+    response_text = response.choices[0].message.content.strip()
+    if cache is not None:
+        cache.put(request, response_text)
+    return response_text
 
 
 # =============================================================================
 # CHATGPT ASSISTANT API (WITH UPLOADED GUIDELINES)
 # =============================================================================
 
-def chatgpt_assistant(prompt_text: str) -> str:
+# Statuses after which a run does not change any more
+RUN_TERMINAL_STATUSES = {"completed", "failed", "cancelled", "expired", "incomplete"}
+
+
+class AssistantRunError(RuntimeError):
+    """Raised when an Assistant run ends in any status other than "completed"."""
+
+    def __init__(self, run, reason: str = ""):
+        self.run = run
+        if not reason and getattr(run, "last_error", None) is not None:
+            reason = f"{run.last_error.code}: {run.last_error.message}"
+        if not reason and getattr(run, "incomplete_details", None) is not None:
+            reason = str(run.incomplete_details.reason)
+        super().__init__(f"Assistant run {run.id} ended with status '{run.status}'" + (f" ({reason})" if reason else ""))
+
+
+def _assistant_request(prompt_text: str) -> dict:
+    """Parameters of the thread-and-run request (one API call instead of two)."""
+    return {
+        "assistant_id": ASSISTANT_ID,
+        "thread": {
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt_text,
+                }
+            ]
+        },
+    }
+
+
+def _message_text(message) -> str:
+    return "".join(part.text.value for part in message.content if part.type == "text").strip()
+
+
+class _RunTracker:
+    """State of one Assistant run, updated from stream events or polled run objects."""
+
+    def __init__(self):
+        self.run = None
+        self.text = None
+
+    def track(self, run) -> None:
+        self.run = run
+
+    def on_event(self, event) -> bool:
+        """Consume one stream event; return True once the run has stopped."""
+        if event.event == "error":
+            raise RuntimeError(f"Assistant stream error: {event.data.message}")
+        if event.event == "thread.message.completed" and event.data.role == "assistant":
+            self.text = _message_text(event.data)
+        elif event.event.startswith("thread.run.") and not event.event.startswith("thread.run.step."):
+            self.run = event.data
+            return self.stopped
+        return False
+
+    @property
+    def stopped(self) -> bool:
+        return self.run is not None and (
+            self.run.status in RUN_TERMINAL_STATUSES or self.run.status == "requires_action"
+        )
+
+    def check(self) -> None:
+        """Raise `AssistantRunError` unless the run completed."""
+        if self.run.status == "requires_action":
+            raise AssistantRunError(self.run, "function tools are not supported by this pipeline")
+        if self.run.status != "completed":
+            raise AssistantRunError(self.run)
+
+
+def _deadline_error(tracker: _RunTracker, timeout: float) -> TimeoutError:
+    run_id = tracker.run.id if tracker.run is not None else "(not created)"
+    return TimeoutError(f"Assistant run {run_id} did not finish within {timeout:g}s")
+
+
+def _next_poll_delay(delay: float, deadline: float) -> float:
+    return max(0.0, min(delay, deadline - time.monotonic()))
+
+
+@tracing.traced()
+def chatgpt_assistant(prompt_text: str, timeout: float = None, stream: bool = None) -> str:
     """
     Send a prompt to a pre-configured ChatGPT Assistant.
 
@@ -79,62 +472,215 @@ def chatgpt_assistant(prompt_text: str) -> str:
     where full guideline PDFs are uploaded to the Assistant
     environment and retrieval is handled internally by OpenAI.
 
+    The thread and run are created in one request. By default the run is
+    followed through its streamed events, so the answer is returned as
+    soon as the run completes; otherwise (or if the stream breaks) the run
+    is polled with adaptive backoff. A run that does not finish before the
+    deadline is cancelled.
+
     Parameters
     ----------
     prompt_text : str
         Fully formatted prompt string sent to the Assistant.
+    timeout : float, optional
+        Deadline for the whole run in seconds (default `ASSISTANT_TIMEOUT`).
+    stream : bool, optional
+        Follow the run through streamed events (default `ASSISTANT_STREAM`).
 
     Returns
     -------
     str
         Model-generated response text.
+
+    Raises
+    ------
+    AssistantRunError
+        If the run fails, is cancelled, expires, ends incomplete or
+        requires tool outputs.
+    TimeoutError
+        If the run does not finish within `timeout`.
     """
 
-    # Insert your Assistant ID here
-    ASSISTANT_ID = "YOUR ASSISTANT ID"
+    import httpx
+    import openai
 
-    # Create a new conversation thread with the user prompt
-    thread = client.beta.threads.create(
-        messages=[
-            {
-                "role": "user",
-                "content": prompt_text,
-            }
-        ]
-    )
+    request = {"assistant_id": ASSISTANT_ID, "prompt": prompt_text}
+    cache = get_response_cache()
+    if cache is not None:
+        cached = _trace_cache_lookup(cache, request)
+        if cached is not None:
+            return cached
 
-    # Start the Assistant run
-    run = client.beta.threads.runs.create(
-        thread_id=thread.id,
-        assistant_id=ASSISTANT_ID,
-    )
+    timeout = ASSISTANT_TIMEOUT if timeout is None else timeout
+    stream = ASSISTANT_STREAM if stream is None else stream
+    client = get_client().with_options(max_retries=0)
+    runs = client.beta.threads.runs
+    deadline = time.monotonic() + timeout
+    tracker = _RunTracker()
+    start = time.perf_counter()
 
-    print(f"Assistant run created: {run.id}")
+    try:
+        if stream:
+            # A read timeout no longer than the deadline bounds a stalled stream
+            events = _with_retries(
+                client.beta.threads.create_and_run, stream=True, timeout=min(REQUEST_TIMEOUT, timeout),
+                **_assistant_request(prompt_text)
+            )
+            try:
+                with events:
+                    for event in events:
+                        if tracker.on_event(event):
+                            break
+                        if time.monotonic() > deadline:
+                            raise _deadline_error(tracker, timeout)
+            except (httpx.HTTPError, openai.APIConnectionError):
+                # Continue by polling if the stream broke after the run was created
+                if tracker.run is None:
+                    raise
+        else:
+            tracker.track(_with_retries(client.beta.threads.create_and_run, **_assistant_request(prompt_text)))
+            print(f"Assistant run created: {tracker.run.id}")
 
-    # Poll run status until completion
-    while True:
-        run = client.beta.threads.runs.retrieve(
-            thread_id=thread.id,
-            run_id=run.id
-        )
+        # Poll run status with adaptive backoff until the run stops
+        delay = POLL_INITIAL
+        while not tracker.stopped:
+            if time.monotonic() > deadline:
+                raise _deadline_error(tracker, timeout)
+            time.sleep(_next_poll_delay(delay, deadline))
+            delay = min(delay * POLL_FACTOR, POLL_MAX)
+            tracker.track(_with_retries(runs.retrieve, thread_id=tracker.run.thread_id, run_id=tracker.run.id))
 
-        if run.status == "completed":
-            break
+        if tracker.run.status == "requires_action":
+            _with_retries(runs.cancel, thread_id=tracker.run.thread_id, run_id=tracker.run.id)
+        tracing.current_span().set("run_id", tracker.run.id)
+        tracker.check()
+        _trace_usage(getattr(tracker.run, "usage", None))
 
-        if run.status == "failed":
-            raise RuntimeError(
-                f"Assistant run failed: {run}"
+        if tracker.text is None:
+            # The latest assistant message is the first item
+            message_response = _with_retries(
+                client.beta.threads.messages.list, thread_id=tracker.run.thread_id, order="desc", limit=1
             )
+            tracker.text = _message_text(message_response.data[0])
+    except TimeoutError:
+        if tracker.run is not None:
+            try:
+                runs.cancel(thread_id=tracker.run.thread_id, run_id=tracker.run.id)
+            except openai.OpenAIError:
+                pass
+        assistant_stats.record(time.perf_counter() - start, ok=False)
+        raise
+    except Exception:
+        assistant_stats.record(time.perf_counter() - start, ok=False)
+        raise
+    assistant_stats.record(time.perf_counter() - start)
 
-        print(f"Run status: {run.status}")
-        time.sleep(1)
+    if cache is not None:
+        cache.put(request, tracker.text)
+    return tracker.text
 
-    # Retrieve messages from the completed thread
-    message_response = client.beta.threads.messages.list(
-        thread_id=thread.id
-    )
 
-    # The latest assistant message is the first item
-    latest_message = message_response.data[0]
+@tracing.traced()
+async def achatgpt_assistant(prompt_text: str, timeout: float = None, stream: bool = None) -> str:
+    """
+    Async version of `chatgpt_assistant`.
+
+    Many threads can be driven concurrently from one event loop. A
+    streamed run holds one of the `MAX_CONCURRENCY` connection slots until
+    it stops; polled runs only hold a slot per status request.
+
+    Parameters
+    ----------
+    prompt_text : str
+        Fully formatted prompt string sent to the Assistant.
+    timeout : float, optional
+        Deadline for the whole run in seconds (default `ASSISTANT_TIMEOUT`).
+    stream : bool, optional
+        Follow the run through streamed events (default `ASSISTANT_STREAM`).
+
+    Returns
+    -------
+    str
+        Model-generated response text.
+    """
+
+    import httpx
+    import openai
+
+    request = {"assistant_id": ASSISTANT_ID, "prompt": prompt_text}
+    cache = get_response_cache()
+    if cache is not None:
+        cached = _trace_cache_lookup(cache, request)
+        if cached is not None:
+            return cached
+
+    timeout = ASSISTANT_TIMEOUT if timeout is None else timeout
+    stream = ASSISTANT_STREAM if stream is None else stream
+    pool = get_async_pool()
+    runs = pool.client.beta.threads.runs
+    deadline = time.monotonic() + timeout
+    tracker = _RunTracker()
+    start = time.perf_counter()
+
+    try:
+        if stream:
+            async with pool.semaphore:
+                events = await _awith_retries(
+                    pool.client.beta.threads.create_and_run, stream=True, timeout=min(REQUEST_TIMEOUT, timeout),
+                    **_assistant_request(prompt_text)
+                )
+                try:
+                    async with events:
+                        async for event in events:
+                            if tracker.on_event(event):
+                                break
+                            if time.monotonic() > deadline:
+                                raise _deadline_error(tracker, timeout)
+                except (httpx.HTTPError, openai.APIConnectionError):
+                    if tracker.run is None:
+                        raise
+        else:
+            tracker.track(await _awith_retries(
+                pool.client.beta.threads.create_and_run, semaphore=pool.semaphore, **_assistant_request(prompt_text)
+            ))
+
+        delay = POLL_INITIAL
+        while not tracker.stopped:
+            if time.monotonic() > deadline:
+                raise _deadline_error(tracker, timeout)
+            await asyncio.sleep(_next_poll_delay(delay, deadline))
+            delay = min(delay * POLL_FACTOR, POLL_MAX)
+            tracker.track(await _awith_retries(
+                runs.retrieve, semaphore=pool.semaphore, thread_id=tracker.run.thread_id, run_id=tracker.run.id
+            ))
+
+        if tracker.run.status == "requires_action":
+            await _awith_retries(
+                runs.cancel, semaphore=pool.semaphore, thread_id=tracker.run.thread_id, run_id=tracker.run.id
+            )
+        tracing.current_span().set("run_id", tracker.run.id)
+        tracker.check()
+        _trace_usage(getattr(tracker.run, "usage", None))
+
+        if tracker.text is None:
+            message_response = await _awith_retries(
+                pool.client.beta.threads.messages.list, semaphore=pool.semaphore,
+                thread_id=tracker.run.thread_id, order="desc", limit=1
+            )
+            tracker.text = _message_text(message_response.data[0])
+    except TimeoutError:
+        if tracker.run is not None:
+            try:
+                await runs.cancel(thread_id=tracker.run.thread_id, run_id=tracker.run.id)
+            except openai.OpenAIError:
+                pass
+        assistant_stats.record(time.perf_counter() - start, ok=False)
+        raise
+    except Exception:
+        assistant_stats.record(time.perf_counter() - start, ok=False)
+        raise
+    assistant_stats.record(time.perf_counter() - start)
 
-    return latest_message.content[0].text.value.strip()
+    if cache is not None:
+        cache.put(request, tracker.text)
+    return tracker.text
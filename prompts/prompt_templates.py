@@ -10,7 +10,29 @@ This module contains the four main prompt templates used in the study:
 No patient data or guideline content is included.
 """
 
-from typing import List, Dict, Optional
+import os
+import sys
+import yaml
+from typing import List, Dict, Optional, Tuple
+
+# Add the parallel 'pipelines' folder to sys.path for the tracing layer
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(current_dir, '..', 'pipelines')))
+
+import tracing
+import resources
+
+CONFIG_PATH = os.path.abspath(os.path.join(current_dir, '..', 'config', 'hyperparameters.yaml'))
+with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+    RETRIEVAL_CONFIG = yaml.safe_load(f)["retrieval"]
+
+# Token budget for the retrieved context of RAG prompts (None: no limit)
+CONTEXT_TOKEN_BUDGET = RETRIEVAL_CONFIG.get("context_token_budget")
+# tiktoken encoding of the answer models (gpt-4o and gpt-4o-mini use o200k_base)
+TOKENIZER_ENCODING = RETRIEVAL_CONFIG.get("tokenizer_encoding", "o200k_base")
+# Chunks that would be cut below this many tokens are dropped instead
+MIN_PACKED_CHUNK_TOKENS = RETRIEVAL_CONFIG.get("min_packed_chunk_tokens", 64)
+TRUNCATION_MARKER = " [...]"
 
 # =============================================================================
 # PROMPT TYPE 1: REWRITING PROMPT
@@ -103,10 +125,140 @@ def format_retrieved_context(chunks: List[Dict]) -> str:
     return '\n'.join(context_lines)
 
 
+# Characters per token of the fallback estimate (English/German prose with tiktoken)
+CHARS_PER_TOKEN_ESTIMATE = 4
+
+
+class _CharacterEstimateTokenizer:
+    """Fallback tokenizer: fixed-size character pieces as tokens (an estimate, no network needed)."""
+
+    def encode(self, text: str) -> List[str]:
+        return [text[i:i + CHARS_PER_TOKEN_ESTIMATE] for i in range(0, len(text), CHARS_PER_TOKEN_ESTIMATE)]
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+def _load_tokenizer():
+    """
+    Local tiktoken encoding. tiktoken downloads the encoding file on first use
+    (then reads it from TIKTOKEN_CACHE_DIR); if it cannot be loaded, tokens
+    are estimated from the character count instead.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        print(f"WARNING: Could not load the tiktoken encoding '{TOKENIZER_ENCODING}' ({type(e).__name__}: {e}). "
+              f"Estimating tokens as {CHARS_PER_TOKEN_ESTIMATE} characters each; copy the encoding file "
+              f"into TIKTOKEN_CACHE_DIR for exact counts.")
+        return _CharacterEstimateTokenizer()
+
+resources.register("tokenizer", _load_tokenizer)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Number of tokens of `text` for the answer models (local tiktoken encoding).
+    """
+    return len(resources.get("tokenizer").encode(text))
+
+
+def _chunk_line(chunk: Dict, text: str) -> str:
+    """One context line as written by `format_retrieved_context`."""
+    return f"- Chunk {chunk.get('chunk_id', 'Unknown')} - {chunk.get('source', 'Unknown source')}: {text}"
+
+
+def _trim_text(chunk: Dict, text: str, max_tokens: int) -> Optional[str]:
+    """
+    Longest leading part of `text` whose context line fits into `max_tokens`.
+
+    Whole sections (paragraphs, then lines) are kept where possible; only if
+    not even the first section fits is the text cut at a token boundary.
+    Returns None if nothing meaningful fits.
+    """
+    tokenizer = resources.get("tokenizer")
+    overhead = count_tokens(_chunk_line(chunk, TRUNCATION_MARKER))
+    available = max_tokens - overhead
+    if available < MIN_PACKED_CHUNK_TOKENS:
+        return None
+
+    for separator in ("\n\n", "\n"):
+        sections = text.split(separator)
+        kept = []
+        used = 0
+        for section in sections:
+            section_tokens = count_tokens(section + separator)
+            if used + section_tokens > available:
+                break
+            kept.append(section)
+            used += section_tokens
+        if kept and used >= MIN_PACKED_CHUNK_TOKENS:
+            return separator.join(kept).rstrip() + TRUNCATION_MARKER
+
+    return tokenizer.decode(tokenizer.encode(text)[:available]).rstrip() + TRUNCATION_MARKER
+
+
+def pack_retrieved_context(
+    chunks: List[Dict],
+    token_budget: int
+) -> Tuple[List[Dict], Dict]:
+    """
+    Fit retrieved chunks into a token budget for the prompt context.
+
+    Chunks are taken best first (retrieval order). Every chunk that fits is
+    kept in full; a chunk that does not fit is trimmed to its leading
+    sections (or truncated) to fill the remaining budget, and chunks for
+    which fewer than `MIN_PACKED_CHUNK_TOKENS` tokens remain are dropped.
+
+    Args:
+        chunks: Retrieved chunks, best first, with keys 'chunk_id', 'source', 'text'
+        token_budget: Maximum number of tokens of the formatted context
+
+    Returns:
+        Tuple of the packed chunks (copies; trimmed ones have 'truncated': True)
+        and packing statistics: token_budget, tokens_before, tokens_used,
+        chunks_full, chunks_trimmed, chunks_dropped.
+    """
+    packed = []
+    used = 0
+    tokens_before = 0
+    trimmed = 0
+    for i, chunk in enumerate(chunks):
+        text = chunk.get('text', '')
+        line_tokens = count_tokens(_chunk_line(chunk, text))
+        # One token for the newline joining consecutive context lines
+        tokens_before += line_tokens + (1 if i else 0)
+        line_tokens += 1 if packed else 0
+        remaining = token_budget - used
+        if line_tokens <= remaining:
+            packed.append(dict(chunk))
+            used += line_tokens
+            continue
+        trimmed_text = _trim_text(chunk, text, remaining - (1 if packed else 0))
+        if trimmed_text is not None:
+            packed.append(dict(chunk, text=trimmed_text, truncated=True))
+            used += count_tokens(_chunk_line(chunk, trimmed_text)) + (1 if len(packed) > 1 else 0)
+            trimmed += 1
+
+    stats = {
+        "token_budget": token_budget,
+        "tokens_before": tokens_before,
+        "tokens_used": count_tokens(format_retrieved_context(packed)),
+        "chunks_full": len(packed) - trimmed,
+        "chunks_trimmed": trimmed,
+        "chunks_dropped": len(chunks) - len(packed),
+    }
+    return packed, stats
+
+
+@tracing.traced()
 def get_prompt_for_configuration(
     case_text: str,
     config_type: str,
-    retrieved_chunks: Optional[List[Dict]] = None
+    retrieved_chunks: Optional[List[Dict]] = None,
+    context_token_budget: Optional[int] = None,
+    packing_stats: Optional[Dict] = None
 ) -> str:
     """
     Get the appropriate prompt based on configuration type.
@@ -115,6 +267,10 @@ def get_prompt_for_configuration(
         case_text: Patient case description (original or rewritten)
         config_type: One of ['simple', 'assistant', 'rag_full', 'rag_selected']
         retrieved_chunks: List of retrieved guideline chunks (for RAG configs only)
+        context_token_budget: Pack the retrieved chunks into this many context
+            tokens with `pack_retrieved_context` (None: use every chunk in full)
+        packing_stats: If given, updated with the packing statistics of
+            `pack_retrieved_context` (only when a budget is set)
         
     Returns:
         Formatted prompt string ready for model execution
@@ -122,6 +278,10 @@ def get_prompt_for_configuration(
     Raises:
         ValueError: If config_type is invalid or retrieved_chunks missing for RAG
     """
+    span = tracing.current_span()
+    span.set("config_type", config_type)
+    span.set("retrieved_chunks", len(retrieved_chunks) if retrieved_chunks is not None else None)
+
     if config_type == 'simple':
         return SIMPLE_REQUEST_PROMPT.format(case_text=case_text)
     
@@ -132,6 +292,12 @@ def get_prompt_for_configuration(
         if retrieved_chunks is None:
             raise ValueError(f"retrieved_chunks required for {config_type}")
         
+        if context_token_budget is not None:
+            retrieved_chunks, packing = pack_retrieved_context(retrieved_chunks, context_token_budget)
+            for key, value in packing.items():
+                span.set(f"context.{key}", value)
+            if packing_stats is not None:
+                packing_stats.update(packing)
         context = format_retrieved_context(retrieved_chunks)
         return CUSTOM_RAG_PROMPT.format(
             case_text=case_text,
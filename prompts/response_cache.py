@@ -0,0 +1,129 @@
+"""
+Content-addressed cache of LLM responses.
+
+Every request to the OpenAI API (model, messages, sampling parameters or
+Assistant ID and prompt) is hashed into a key, and the response text is
+stored in a SQLite file under that key. Modes (environment variable
+`LLM_CACHE_MODE`):
+- `off` (default): every call goes to the API,
+- `record`: cached responses are reused, new responses are stored,
+- `replay`: only cached responses are returned, a miss raises
+  `CacheMissError` (runs without network access).
+
+Entries are evicted by age (`LLM_CACHE_MAX_AGE_DAYS`) and by count
+(`LLM_CACHE_MAX_ENTRIES`, oldest first) when new responses are stored.
+
+IMPORTANT:
+- The cache contains prompts, i.e. patient case texts. Keep it local and
+  delete `.cache/llm_responses.sqlite` when the data must not be retained.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+
+CACHE_MODES = ("off", "record", "replay")
+
+
+class CacheMissError(RuntimeError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+class ResponseCache:
+    """
+    SQLite-backed response cache keyed by the SHA-256 of the full request.
+
+    Attributes:
+        hits: number of requests answered from the cache
+        misses: number of requests without a cached response
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str = "record",
+        max_age_days: Optional[float] = None,
+        max_entries: Optional[int] = None
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode: {mode}. Must be one of: {', '.join(CACHE_MODES)}")
+        self.path = path
+        self.mode = mode
+        self.max_age_days = max_age_days
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " request TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(request: dict) -> str:
+        """Stable hash of a request (key order does not matter)."""
+        canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, request: dict) -> Optional[str]:
+        """
+        Return the cached response for `request`, or None on a miss.
+
+        Raises:
+            CacheMissError: On a miss in replay mode
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (self.key(request),)
+            ).fetchone()
+            if row is not None:
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+        if self.mode == "replay":
+            raise CacheMissError(
+                f"No cached response for {request.get('model') or request.get('assistant_id')} request "
+                f"in replay mode ({self.path})."
+            )
+        return None
+
+    def put(self, request: dict, response: str) -> None:
+        """Store a response (record mode only) and apply the eviction limits."""
+        if self.mode != "record":
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, request, response, created) VALUES (?, ?, ?, ?)",
+                (self.key(request), json.dumps(request, ensure_ascii=False), response, time.time())
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        if self.max_age_days is not None:
+            cutoff = time.time() - self.max_age_days * 86400
+            self._conn.execute("DELETE FROM responses WHERE created < ?", (cutoff,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def stats(self) -> dict:
+        """Hit/miss counters, mode and current size."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses, "entries": entries}